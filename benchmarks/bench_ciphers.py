@@ -0,0 +1,60 @@
+#! usr/bin/env/ python3
+
+"""
+Throughput comparison of partition ciphers.
+
+Usage:
+    python benchmarks/bench_ciphers.py [size MiB] [repeat]
+"""
+
+import os
+from os.path import abspath, dirname
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from cryptography.fernet import Fernet
+
+from choppy.crypto import CIPHERS, batch_decrypt, batch_encrypt
+
+# ------------------------------------------------------------------------------
+def best_of(repeat, func, *args):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main(size_mib=64, repeat=3):
+    key = Fernet.generate_key()
+    nbytes = size_mib * 2**20
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fp = os.path.join(tmpdir, 'input.bin')
+        with open(fp, 'wb') as outfile:
+            outfile.write(os.urandom(nbytes))
+
+        print('{:>10} {:>12} {:>12} {:>10}'.format('cipher', 'enc MiB/s', 'dec MiB/s', 'size'))
+
+        for cipher in CIPHERS:
+            enc_dir = os.path.join(tmpdir, cipher)
+            dec_dir = os.path.join(tmpdir, cipher + '_dec')
+            os.mkdir(enc_dir)
+            os.mkdir(dec_dir)
+
+            t_enc = best_of(repeat, batch_encrypt, key, [fp], enc_dir, cipher)
+            enc_fp = os.path.join(enc_dir, 'input.bin')
+            t_dec = best_of(repeat, batch_decrypt, key, [enc_fp], dec_dir)
+
+            ratio = os.path.getsize(enc_fp) / nbytes
+            print('{:>10} {:>12.1f} {:>12.1f} {:>9.3f}x'.format(
+                cipher, size_mib / t_enc, size_mib / t_dec, ratio))
+
+
+# ------------------------------------------------------------------------------
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:3]))
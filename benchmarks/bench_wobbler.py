@@ -0,0 +1,48 @@
+#! usr/bin/env/ python3
+
+"""
+Microbenchmark of partition size randomization.
+
+Usage:
+    python benchmarks/bench_wobbler.py [max partitions] [percent]
+"""
+
+from os.path import abspath, dirname
+import sys
+import time
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from choppy import partition
+
+# ------------------------------------------------------------------------------
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def main(max_parts=10**6, percent=25):
+    backends = [False]
+    if partition.np is not None:
+        backends.append(True)
+
+    header = '{:>10}'.format('partitions')
+    for vectorize in backends:
+        header += ' {:>14}'.format('numpy ms' if vectorize else 'python ms')
+    print(header)
+
+    n_parts = 10
+    while n_parts <= max_parts:
+        byte_reads = partition.byte_lengths(2**40, n_parts)
+        line = '{:>10}'.format(n_parts)
+        for vectorize in backends:
+            seconds = timed(partition.wobbler, byte_reads, percent, seed=0, vectorize=vectorize)
+            line += ' {:>14.3f}'.format(seconds * 1000)
+        print(line)
+        n_parts *= 10
+
+
+# ------------------------------------------------------------------------------
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:3]))
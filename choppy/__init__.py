@@ -5,18 +5,62 @@ Choppy public functions
 -----------------------
 chop, chop_encrypt, merge, decrypt_merge
 
+Choppy public coroutine functions
+---------------------------------
+chop_encrypt_async, decrypt_merge_async
+
+Choppy public class
+-------------------
+PartitionReader
+
 Choppy public module
 --------------------
 crypto
 
+Public names are imported on first access, so importing choppy or running the
+CLI does not load cryptography or numpy until they are needed.
+
 
 copyright: (c) Jeremy Jacobs 2017-2018
 license: BSD-2-Clause see LICENSE.txt for details
 """
 
-from choppy.chop import chop, chop_encrypt
-from choppy.merge import merge, decrypt_merge
-from choppy import crypto
+from importlib import import_module
+import sys
+
 from choppy.version import VERSION as __version__
 
-__all__ = ['__version__', 'chop', 'chop_encrypt', 'merge', 'decrypt_merge', 'crypto']
+# public name: (module, attribute or None for the module itself)
+_LAZY = {
+    'chop': ('choppy.chop', 'chop'),
+    'chop_encrypt': ('choppy.chop', 'chop_encrypt'),
+    'merge': ('choppy.merge', 'merge'),
+    'decrypt_merge': ('choppy.merge', 'decrypt_merge'),
+    'chop_encrypt_async': ('choppy.aio', 'chop_encrypt_async'),
+    'decrypt_merge_async': ('choppy.aio', 'decrypt_merge_async'),
+    'PartitionReader': ('choppy.reader', 'PartitionReader'),
+    'crypto': ('choppy.crypto', None),
+    }
+
+__all__ = ['__version__', 'chop', 'chop_encrypt', 'merge', 'decrypt_merge', 'chop_encrypt_async',
+           'decrypt_merge_async', 'PartitionReader', 'crypto']
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+    import_module(_LAZY[name][0])
+
+    # importing a submodule binds it on the package, e.g. choppy.merge while
+    # importing choppy.chop, so rebind every public name already loaded
+    for public, (module_name, attr) in _LAZY.items():
+        module = sys.modules.get(module_name)
+        if module is not None:
+            globals()[public] = module if attr is None else getattr(module, attr)
+
+    return globals()[name]
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
@@ -0,0 +1,160 @@
+#! usr/bin/env/ python3
+
+"""
+Asyncio API for chopping and merging.
+
+Each call runs the blocking chop or merge in its own thread, partition work
+runs on the given executor. Progress events are passed to the event loop
+through a bounded queue: when the consumer falls behind, the job stops
+scheduling new partitions until events are taken from the queue, so memory
+and work in flight stay bounded by the queue size and max_inflight.
+
+Cancelling the consuming task, or closing the generator early, stops the job
+at the next partition. Partitions not yet started are dropped and the
+generator only finishes closing once partitions in flight are written.
+"""
+
+import asyncio
+from concurrent.futures import TimeoutError as FutureTimeout
+from functools import partial
+import threading
+
+from choppy.chop import chop_encrypt
+from choppy.merge import decrypt_merge
+from choppy.parallel import Merged, Partition
+
+# ------------------------------------------------------------------------------
+DEFAULT_QUEUE_SIZE = 64
+POLL_INTERVAL = 0.1
+
+
+class Cancelled(Exception):
+    """Raised in the job thread when the consumer stops listening."""
+
+
+def _retrieve(future):
+    # errors of cancelled jobs have no consumer left to raise them
+    if not future.cancelled():
+        future.exception()
+
+
+async def run_events(func, args, kwargs, queue_size=DEFAULT_QUEUE_SIZE):
+    """Runs blocking func in a thread, yielding the events it reports.
+
+    Args:
+        func: function taking a progress keyword argument
+        args: tuple of positional arguments for func
+        kwargs: dict of keyword arguments for func
+        queue_size: int max number of events waiting for the consumer
+
+    Yields:
+        events passed to progress, in order
+
+    Raises:
+        any exception raised by func
+    """
+
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=max(1, queue_size))
+    cancelled = threading.Event()
+
+    def progress(event):
+        if cancelled.is_set():
+            raise Cancelled()
+
+        put = asyncio.run_coroutine_threadsafe(queue.put(event), loop)
+        while True:
+            try:
+                return put.result(POLL_INTERVAL)
+            except FutureTimeout:
+                if cancelled.is_set():
+                    put.cancel()
+                    raise Cancelled()
+
+    worker = loop.run_in_executor(None, partial(func, *args, progress=progress, **kwargs))
+    worker.add_done_callback(_retrieve)
+    get = None
+
+    try:
+        while True:
+            get = asyncio.ensure_future(queue.get())
+            await asyncio.wait((get, worker), return_when=asyncio.FIRST_COMPLETED)
+
+            if get.done():
+                yield get.result()
+                continue
+
+            # every event is queued before the job returns
+            get.cancel()
+            while not queue.empty():
+                yield queue.get_nowait()
+
+            worker.result()
+            return
+
+    finally:
+        if get is not None:
+            get.cancel()
+
+        if not worker.done():
+            cancelled.set()
+            await asyncio.wait((worker,))
+
+
+def job_kwargs(kwargs, executor):
+    if executor is not None:
+        kwargs['workers'] = executor
+    return kwargs
+
+
+async def chop_encrypt_async(filepaths, outdir, key, nparts, *args, executor=None,
+                             queue_size=DEFAULT_QUEUE_SIZE, **kwargs):
+    """Partitions files into encrypted partitions, yielding each partition as
+    it is written.
+
+    Arguments are those of choppy.chop.chop_encrypt.
+
+    Args:
+        executor: optional concurrent.futures executor for encrypting and
+            writing partitions, overrides workers
+        queue_size: int max number of events waiting for the consumer
+
+    Yields:
+        parallel.Partition (input filepath, partition filepath) in write order
+    """
+
+    events = run_events(chop_encrypt, (tuple(filepaths), outdir, key, nparts) + args,
+                        job_kwargs(kwargs, executor), queue_size)
+    try:
+        async for event in events:
+            yield event
+    finally:
+        await events.aclose()
+
+
+async def decrypt_merge_async(filepaths, outdir, key, *args, executor=None,
+                              queue_size=DEFAULT_QUEUE_SIZE, **kwargs):
+    """Decrypts and merges partitions, yielding progress as each partition is
+    merged and each file is reassembled.
+
+    Arguments are those of choppy.merge.decrypt_merge. Used partitions are
+    removed once every file is reassembled.
+
+    Args:
+        executor: optional concurrent.futures executor for decrypting
+            partitions, overrides workers
+        queue_size: int max number of events waiting for the consumer
+
+    Yields:
+        parallel.Partition (output filepath, partition filepath) for each
+        partition merged and parallel.Merged (output filepath, bool status)
+        for each file reassembled
+    """
+
+    events = run_events(decrypt_merge, (tuple(filepaths), outdir, key) + args,
+                        job_kwargs(kwargs, executor), queue_size)
+    try:
+        async for event in events:
+            yield event
+    finally:
+        await events.aclose()
@@ -0,0 +1,207 @@
+#! usr/bin/env/ python3
+
+"""
+Persistent catalog of partition metadata for large merge directories.
+
+The catalog is an SQLite file mapping partition path, size and mtime to the
+metadata block parsed by merge.read_metadata. Files whose size and mtime are
+unchanged since they were cataloged are not opened again, so repeated merges
+and status queries only read new or changed files.
+
+Metadata of encrypted partitions is stored as a Fernet token under the same
+key used for the partitions, so the catalog does not reveal filenames or
+digests. Rows are only used with the key they were written with.
+"""
+
+from contextlib import contextmanager
+import hashlib
+import json
+import os
+import sqlite3
+
+from choppy import crypto, digest
+
+# ------------------------------------------------------------------------------
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS partitions (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    key_id TEXT NOT NULL,
+    meta BLOB
+)
+"""
+
+MISS = object()
+
+
+def key_id(key):
+    """Returns non-reversible id of key for matching catalog rows."""
+
+    if not key:
+        return ''
+    if isinstance(key, str):
+        key = bytes(key, 'utf-8')
+    return hashlib.blake2b(key, digest_size=16, person=b'choppy-catalog').hexdigest()
+
+
+def encode_meta(meta):
+    """Serializes read_metadata result to JSON bytes."""
+
+    if meta is None:
+        return b'null'
+
+    (tot, group_id, filename, filehash), ix, seek, nbytes, codec_name = meta
+
+    if isinstance(filehash, digest.TreeDigest):
+        chunks = filehash.chunks
+        filehash = {
+            'name': filehash.name,
+            'root': filehash.root.hex(),
+            'parts': [part.hex() for part in filehash.parts],
+            'chunks': None if chunks is None else [chunk.hex() for chunk in chunks],
+            'members': filehash.members,
+            }
+    elif filehash is not None:
+        filehash = filehash.hex()
+
+    record = {
+        'tot': tot, 'group_id': group_id.hex(), 'filename': filename,
+        'filehash': filehash, 'ix': ix, 'seek': seek, 'nbytes': nbytes,
+        'codec': codec_name,
+        }
+
+    return bytes(json.dumps(record), 'utf-8')
+
+
+def decode_meta(data):
+    """Restores read_metadata result from encode_meta output."""
+
+    record = json.loads(data.decode('utf-8'))
+    if record is None:
+        return None
+
+    filehash = record['filehash']
+    if isinstance(filehash, dict):
+        chunks = filehash.get('chunks')
+        if chunks is not None:
+            chunks = tuple(bytes.fromhex(chunk) for chunk in chunks)
+        members = filehash.get('members')
+        if members is not None:
+            members = tuple(tuple(member) for member in members)
+        filehash = digest.TreeDigest(
+            filehash['name'], bytes.fromhex(filehash['root']),
+            tuple(bytes.fromhex(part) for part in filehash['parts']), chunks, members)
+    elif filehash is not None:
+        filehash = bytes.fromhex(filehash)
+
+    group_key = (record['tot'], bytes.fromhex(record['group_id']), record['filename'], filehash)
+    return group_key, record['ix'], record['seek'], record['nbytes'], record.get('codec', 'none')
+
+
+# ------------------------------------------------------------------------------
+class Catalog:
+    """SQLite cache of parsed partition metadata.
+
+    Args:
+        db_path: str filepath of SQLite catalog - created if missing
+        key: cryptographic key of the partitions, None for plaintext
+    """
+
+    def __init__(self, db_path, key=None):
+        self._conn = sqlite3.connect(db_path)
+        self._conn.execute(SCHEMA)
+        self._key_id = key_id(key)
+        self._fernet = crypto.fernet(key) if key else None
+
+
+    def lookup(self, fp, stat):
+        """Returns cached metadata for fp or MISS if fp is new or changed.
+
+        Args:
+            fp: str filepath
+            stat: os.stat_result of fp
+
+        Returns:
+            read_metadata result, None for cataloged non-partitions, or MISS
+        """
+
+        row = self._conn.execute(
+            'SELECT size, mtime_ns, key_id, meta FROM partitions WHERE path = ?',
+            (os.path.abspath(fp),)).fetchone()
+
+        if row is None or tuple(row[:3]) != (stat.st_size, stat.st_mtime_ns, self._key_id):
+            return MISS
+
+        data = row[3]
+        if self._fernet:
+            try:
+                data = self._fernet.decrypt(data)
+            except crypto.decrypt_errors():
+                return MISS
+
+        try:
+            return decode_meta(data)
+        except (ValueError, KeyError, TypeError):
+            return MISS
+
+
+    def store(self, fp, stat, meta):
+        """Records metadata for fp as of stat, replacing any previous row."""
+
+        data = encode_meta(meta)
+        if self._fernet:
+            data = self._fernet.encrypt(data)
+
+        self._conn.execute(
+            'INSERT OR REPLACE INTO partitions VALUES (?, ?, ?, ?, ?)',
+            (os.path.abspath(fp), stat.st_size, stat.st_mtime_ns, self._key_id, data))
+
+
+    def forget(self, paths):
+        """Removes rows for paths, e.g. after partitions are merged and deleted."""
+
+        self._conn.executemany(
+            'DELETE FROM partitions WHERE path = ?',
+            ((os.path.abspath(fp),) for fp in paths))
+
+
+    def prune(self):
+        """Removes rows for files that no longer exist.
+
+        Returns:
+            int number of rows removed
+        """
+
+        paths = [row[0] for row in self._conn.execute('SELECT path FROM partitions')]
+        missing = [fp for fp in paths if not os.path.exists(fp)]
+        self.forget(missing)
+        return len(missing)
+
+
+    def commit(self):
+        self._conn.commit()
+
+
+    def close(self):
+        self._conn.commit()
+        self._conn.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+@contextmanager
+def open_catalog(db_path, key=None):
+    """Context manager providing a Catalog, or None if db_path is None."""
+
+    if db_path is None:
+        yield None
+    else:
+        with Catalog(db_path, key) as catalog:
+            yield catalog
@@ -4,15 +4,22 @@
 Functions for file partioning and batch encrypting.
 """
 
+import io
 from itertools import count
 import os
 from random import randint
 from secrets import token_urlsafe
-import tempfile
 
 import choppy.partition as partition
-from choppy.crypto import batch_encrypt, hash_str, md5_hash
-from choppy import util
+from choppy.crypto import (
+    DEFAULT_CIPHER, decrypt_errors, encrypted_size, encryptor, md5_hash, memory_cost)
+from choppy.digest import DEFAULT_HASH
+from choppy.merge import manifest_chunks, open_partition, read_path_metadata, read_paths
+from choppy.store import DEFAULT_CHUNK_SIZE, chunk_filename, chunk_path
+from choppy import codec, digest, parallel, parity, util
+
+MAX_PARTITIONS = 2**32 - 1
+STREAM_PART_SIZE = 2**26
 
 # ------------------------------------------------------------------------------
 def convert_filename(fp):
@@ -65,46 +72,919 @@ def convert_nbytes(n):
     return util.byte_len(nbx), nbx
 
 
-def partition_file(fp, outpaths, nparts, wobble=0):
-    """Creates file partitions and embeds metadata for reassembly.
+def metadata_block(kind, group_id, ix, tot, nbytes, codec_name='none'):
+    """Builds the metadata block common to every partition kind.
+
+    Args:
+        kind: int util.KIND_* partition kind
+        group_id: bytes random id shared by the partitions of one file
+        ix: int partition index
+        tot: int number of data partitions
+        nbytes: int payload length before compression
+        codec_name: str name of payload codec in codec.CODECS
+
+    Returns:
+        bytearray
+    """
+
+    codec_id = codec.CODECS[codec_name][0]
+    if nbytes.bit_length() <= 64:
+        return bytearray(util.METADATA.pack(
+            util.CFPV, util.LAYOUT_VERSION, kind, codec_id, group_id, ix, tot, 8, nbytes))
+
+    return util.bcat(
+        util.CFPV, (util.LAYOUT_VERSION, kind, codec_id), group_id,
+        util.encode_uint32(ix), util.encode_uint32(tot), *convert_nbytes(nbytes))
+
+
+def set_codec(meta_block, codec_name):
+    """Returns copy of metadata block recording codec_name as payload codec."""
+
+    meta_block = bytearray(meta_block)
+    meta_block[util.CODEC_OFFSET] = codec.CODECS[codec_name][0]
+    return bytes(meta_block)
+
+
+def manifest_block(group_id, tot, fp, hash_algo, digests, chunk_ids=None, members=None):
+    """Builds metadata block for the manifest partition written after all
+    data partitions of a file.
+
+    Args:
+        group_id: bytes random id shared by the partitions of one file
+        tot: int number of data partitions
+        fp: str filepath of input
+        hash_algo: str name of hash in digest.HASHES
+        digests: iterable of bytes leaf digest for each data partition
+        chunk_ids: optional iterable of bytes chunk id for each content
+            defined partition, makes this a chunk manifest
+        members: optional iterable of tuple (str filepath, int byte length)
+            of files packed into the group, makes this a pack manifest
+
+    Returns:
+        bytearray
+    """
+
+    digests = tuple(digests)
+    root = digest.tree_root(hash_algo, digests)
+    hash_id = digest.HASHES[hash_algo][0]
+
+    if chunk_ids is not None:
+        kind = util.KIND_CHUNK_MANIFEST
+    elif members is not None:
+        kind = util.KIND_PACK_MANIFEST
+    else:
+        kind = util.KIND_MANIFEST
+
+    block = metadata_block(kind, group_id, tot, tot, 0)
+    block.extend(util.bcat(*convert_filename(fp), (hash_id,), util.byte_len(root), root))
+    block.extend(b''.join(digests))
+    if chunk_ids is not None:
+        block.extend(b''.join(chunk_ids))
+    if members is not None:
+        members = tuple(members)
+        block.extend(util.encode_uint32(len(members)))
+        for member_fp, nbytes in members:
+            block.extend(util.bcat(*convert_filename(member_fp), util.encode_uint64(nbytes)))
+    return block
+
+
+def is_chunk(fp, chunk_id, nbytes, key=None, leaf=None, hash_algo=DEFAULT_HASH):
+    """Checks fp is an existing complete partition of chunk_id.
+
+    Uncompressed partitions must have the exact length of a partition of
+    nbytes, so partitions truncated by an interrupted write are not reused.
+    Compressed partitions have no predictable length, their payload is read
+    and compared to the leaf digest.
 
     Args:
         fp: str filepath
-        outpaths: iterable (or generator) of filepaths for partitions
+        chunk_id: bytes from digest.chunk_id
+        nbytes: int payload length
+        key: str or bytes - encryption key, None for plaintext partitions
+        leaf: bytes leaf digest of the payload
+        hash_algo: str name of hash in digest.HASHES of leaf
+    """
+
+    if not os.path.isfile(fp):
+        return False
+
+    meta = read_path_metadata(fp, key)
+    if meta is None or (meta[0][:2], meta[3]) != ((0, chunk_id), nbytes):
+        return False
+
+    seek, codec_name = meta[2], meta[4]
+
+    if codec_name == 'none':
+        with open(fp, 'rb') as file_:
+            size = encrypted_size(file_, nbytes, seek) if key else seek + nbytes
+        return os.path.getsize(fp) == size
+
+    hasher = digest.new_leaf(hash_algo)
+    try:
+        file_ix, reader = open_partition(fp, seek, key, codec_name)
+        with file_ix:
+            util.copy_bytes(reader, util.NullWriter(), nbytes, hasher=hasher)
+    except decrypt_errors() + (EOFError, codec.CorruptPayload):
+        return False
+
+    return hasher.digest() == leaf
+
+
+def chunk_tasks(fp, chunk_fp, chunking, key=None, cipher=DEFAULT_CIPHER,
+                hash_algo=DEFAULT_HASH, chunks=None, compress=None, level=None,
+                planned=None):
+    """Plans content defined partitions, skipping partitions already written.
+
+    The input is read once to find partition boundaries, chunk ids and leaf
+    digests. Partitions are named by chunk id, so any partition found at its
+    filepath from an earlier chop is reused instead of written again.
+
+    Args:
+        fp: str filepath
+        chunk_fp: function returning str filepath for a chunk id
+        chunking: tuple (int min size, int avg size, int max size)
+        key: str or bytes - encryption key, None for plaintext partitions
+        cipher: str - stream cipher name or 'fernet' for legacy format
+        hash_algo: str name of hash in digest.HASHES for partition digests
+        chunks: list appended with tuple (chunk id, leaf digest) of every
+            partition in order
+        compress: str name of codec in codec.CODECS, None for no compression
+        level: int compression level, None for codec default
+        planned: optional set of chunk filepaths already being written, e.g.
+            shared by the files of one chop, updated with new partitions
+
+    Yields:
+        tuple of write_partition arguments for each new partition
+    """
+
+    planned = set() if planned is None else planned
+    offset = 0
+
+    with open(fp, 'rb') as file_:
+        for data in partition.chunker(file_, *chunking):
+            chunk_id = digest.chunk_id(data)
+            hasher = digest.new_leaf(hash_algo)
+            hasher.update(data)
+            leaf = hasher.digest()
+            chunks.append((chunk_id, leaf))
+
+            if len(chunks) > MAX_PARTITIONS:
+                raise ValueError('Too many partitions: {}'.format(len(chunks)))
+
+            nbytes = len(data)
+            fp_out = chunk_fp(chunk_id)
+
+            if fp_out not in planned and not is_chunk(
+                    fp_out, chunk_id, nbytes, key, leaf, hash_algo):
+                planned.add(fp_out)
+                os.makedirs(os.path.dirname(fp_out), exist_ok=True)
+                meta_block = metadata_block(util.KIND_CHUNK, chunk_id, 0, 0, nbytes)
+                yield (fp, offset, nbytes, bytes(meta_block), fp_out, key, cipher, None,
+                       compress, level)
+
+            offset += nbytes
+
+
+def partition_tasks(fp, outpaths, nparts, wobble=0, key=None, cipher=DEFAULT_CIPHER,
+                    group_id=None, hash_algo=DEFAULT_HASH, seed=None, part_size=None,
+                    compress=None, level=None, nparity=0, lengths=None):
+    """Plans data partitions and builds metadata for reassembly.
+
+    Partition sizes, metadata and output paths are all decided here so the
+    partitions written by write_partition do not depend on how tasks are
+    scheduled.
+
+    Args:
+        fp: str filepath
+        outpaths: iterator of filepaths for partitions
         nparts: int number of partitions to create
         wobble: int (1-99) percent to randomize partition size
+        key: str or bytes - encryption key, None for plaintext partitions
+        cipher: str - stream cipher name or 'fernet' for legacy format
+        group_id: bytes random id shared by the partitions of one file
+        hash_algo: str name of hash in digest.HASHES for partition digests
+        seed: optional int seed for reproducible wobble
+        part_size: optional int max partition size in bytes, overrides nparts
+        compress: str name of codec in codec.CODECS, None for no compression
+        level: int compression level, None for codec default
+        nparity: int number of parity partitions planned for the group
+        lengths: optional list extended with the byte length of every
+            partition in order
 
     Yields:
-        partition filepath
+        tuple of write_partition arguments
     """
 
-    byte_reads = partition.byte_lengths(os.path.getsize(fp), nparts)
+    n_bytes = os.path.getsize(fp)
+    if part_size:
+        nparts = partition.part_count(n_bytes, part_size)
+
+    max_parts = parity.max_data_partitions(nparity) if nparity else MAX_PARTITIONS
+    if nparts > max_parts:
+        raise ValueError('Too many partitions: {}'.format(nparts))
+
+    byte_reads = partition.byte_lengths(n_bytes, nparts)
 
     if wobble:
-        byte_reads = partition.wobbler(byte_reads, wobble)
+        byte_reads = partition.wobbler(byte_reads, wobble, seed)
 
-    fingerprint = util.CFP[:]
-    group_id = hash_str(''.join(map(str, byte_reads)))
-    id_tot = util.encode_uint16(nparts)
+    if lengths is not None:
+        lengths.extend(byte_reads)
 
-    group_block = util.bcat(fingerprint, group_id, id_tot)
-    group_block.extend(util.bcat(*convert_filename(fp), *convert_hash(fp)))
+    if group_id is None:
+        group_id = os.urandom(16)
 
+    offset = 0
+    for ix, (nbytes, fp_out) in enumerate(zip(byte_reads, outpaths)):
+        meta_block = metadata_block(util.KIND_DATA, group_id, ix, nparts, nbytes)
+        yield (fp, offset, nbytes, bytes(meta_block), fp_out, key, cipher, hash_algo,
+               compress, level)
+        offset += nbytes
 
-    def metabytes(idx, nbytes):
-        ix = util.encode_uint16(idx)
-        cnb = convert_nbytes(nbytes)
-        part_block = util.bcat(ix, *cnb)
-        meta_block = b''.join((group_block, part_block))
-        return meta_block
 
+def write_partition(fp, offset, nbytes, meta_block, fp_out, key=None,
+                    cipher=DEFAULT_CIPHER, hash_algo=None, compress=None, level=None):
+    """Writes metadata block and a byte range of the input to a partition.
+
+    Encrypted partitions store the metadata block as a separately
+    authenticated header record so merge can group them without decrypting
+    payloads.
+
+    With compress, the payload is compressed before encryption unless a
+    sample from the start of the byte range does not shrink. The codec used
+    is recorded in the metadata block.
+
+    Args:
+        fp: str filepath of input
+        offset: int position of byte range in input
+        nbytes: int length of byte range
+        meta_block: bytes metadata block
+        fp_out: str filepath for partition
+        key: str or bytes - encryption key, None for plaintext partitions
+        cipher: str - stream cipher name or 'fernet' for legacy format
+        hash_algo: str name of hash in digest.HASHES, None to skip hashing
+        compress: str name of codec in codec.CODECS, None for no compression
+        level: int compression level, None for codec default
+
+    Returns:
+        tuple (str partition filepath, bytes leaf digest of byte range or None)
+    """
 
     with open(fp, 'rb') as file_:
-        for ix, (nbytes, fp_out) in enumerate(zip(byte_reads, outpaths)):
-            with open(fp_out, 'wb') as file_ix:
-                file_ix.write(metabytes(ix, nbytes))
-                file_ix.write(file_.read(nbytes))
-                yield file_ix.name
+        file_.seek(offset)
+        return copy_partition(
+            file_, nbytes, meta_block, fp_out, key, cipher, hash_algo, compress, level)
+
+
+def write_partition_data(data, meta_block, fp_out, key=None, cipher=DEFAULT_CIPHER,
+                         hash_algo=None, compress=None, level=None):
+    """Writes metadata block and bytes data to a partition.
+
+    Same as write_partition for input already read into memory, such as
+    partitions of a stream.
+
+    Returns:
+        tuple (str partition filepath, bytes leaf digest of data or None)
+    """
+
+    return copy_partition(
+        io.BytesIO(data), len(data), meta_block, fp_out, key, cipher, hash_algo,
+        compress, level)
+
+
+def copy_partition(file_, nbytes, meta_block, fp_out, key=None, cipher=DEFAULT_CIPHER,
+                   hash_algo=None, compress=None, level=None):
+    """Writes metadata block and nbytes from a seekable file object to a
+    partition, see write_partition.
+
+    Returns:
+        tuple (str partition filepath, bytes leaf digest of payload or None)
+    """
+
+    hasher = digest.new_leaf(hash_algo) if hash_algo else None
+
+    with util.atomic_write(fp_out) as file_ix:
+        codec_name = 'none'
+        if compress and compress != 'none':
+            offset = file_.tell()
+            if codec.is_compressible(file_.read(min(nbytes, codec.SAMPLE_SIZE))):
+                codec_name = compress
+            file_.seek(offset)
+            meta_block = set_codec(meta_block, codec_name)
+
+        if key:
+            writer = encryptor(key, file_ix, cipher, header=meta_block)
+        else:
+            writer = file_ix
+            writer.write(meta_block)
+
+        if codec_name != 'none':
+            payload_writer = codec.CompressingWriter(writer, codec_name, level)
+            util.copy_bytes(file_, payload_writer, nbytes, hasher=hasher)
+            payload_writer.close()
+        else:
+            util.copy_bytes(file_, writer, nbytes, hasher=hasher)
+
+        if key:
+            writer.close()
+
+    return fp_out, hasher.digest() if hasher else None
+
+
+def task_cost(fp, offset, nbytes, meta_block, fp_out, key=None, cipher=DEFAULT_CIPHER,
+              hash_algo=None, compress=None, level=None):
+    """Estimated memory used by write_partition for bounding work in flight,
+    including compressor state."""
+
+    return (memory_cost(nbytes, streamed=bool(key) and cipher != 'fernet') +
+            codec.memory_cost(compress, level))
+
+
+def parity_tasks(fp, outpaths, lengths, nparity, key=None, cipher=DEFAULT_CIPHER,
+                 group_id=None, compress=None, level=None):
+    """Computes parity partitions over the data partitions of a file.
+
+    The input is read once more and all parity payloads are held in memory,
+    nparity times the longest data partition.
+
+    Args:
+        fp: str filepath
+        outpaths: iterator of filepaths for partitions
+        lengths: sequence of int byte lengths of data partitions
+        nparity: int number of parity partitions
+        key: str or bytes - encryption key, None for plaintext partitions
+        cipher: str - stream cipher name or 'fernet' for legacy format
+        group_id: bytes random id shared by the partitions of one file
+        compress: str name of codec in codec.CODECS, None for no compression
+        level: int compression level, None for codec default
+
+    Yields:
+        tuple of write_partition_data arguments
+    """
+
+    tot = len(lengths)
+    with open(fp, 'rb') as file_:
+        payloads = parity.encode(file_, lengths, nparity)
+
+    for j, payload in enumerate(payloads):
+        meta_block = metadata_block(util.KIND_PARITY, group_id, tot + 1 + j, tot, len(payload))
+        yield (payload, bytes(meta_block), next(outpaths), key, cipher, None, compress, level)
+
+
+class FilePlan:
+    """Partitions planned for one input file, see partition_file.
+
+    tasks yields write_partition arguments of the data partitions, the leaf
+    digest of each written partition is appended to digests in order before
+    finish writes the parity partitions and the manifest.
+
+    replaced_chunks lists the chunk partitions of a manifest about to be
+    overwritten, see remove_replaced_chunks.
+
+    Args:
+        fp: str filepath
+        outpaths: iterable (or generator) of filepaths for partitions
+        planned: optional set of chunk filepaths already being written
+        other arguments: see partition_file
+
+    Raises:
+        ValueError for unsupported combinations of options
+    """
+
+    def __init__(self, fp, outpaths, nparts, wobble=0, key=None, cipher=DEFAULT_CIPHER,
+                 hash_algo=DEFAULT_HASH, seed=None, part_size=None, chunking=None,
+                 store=None, compress=None, level=None, nparity=0, planned=None):
+
+        if compress:
+            codec.validate(compress, level)
+
+        if nparity and (chunking or store):
+            raise ValueError('Parity partitions require fixed size partitions')
+
+        if store and not chunking:
+            chunking = partition.chunk_sizes(DEFAULT_CHUNK_SIZE)
+
+        self.fp = fp
+        self.digests = []
+        self._outpaths = iter(outpaths)
+        self._group_id = os.urandom(16)
+        self._lengths = []
+        self._chunks = None
+        self._chunk_fp = None
+        self._options = (key, cipher, hash_algo, compress, level, nparity)
+        self.replaced_chunks = ()
+
+        if chunking:
+            self._manifest_path = next(self._outpaths)
+            self._chunks = []
+
+            if store:
+                chunk_fp = lambda chunk_id: chunk_path(store, chunk_id, key)
+            else:
+                chunkdir = os.path.dirname(self._manifest_path)
+                chunk_fp = lambda chunk_id: os.path.join(chunkdir, chunk_filename(chunk_id, key))
+
+                # a store is pruned separately, see merge.prune_store
+                if os.path.isfile(self._manifest_path):
+                    meta = read_path_metadata(self._manifest_path, key)
+                    self.replaced_chunks = tuple(map(chunk_fp, manifest_chunks(meta)))
+
+            self._chunk_fp = chunk_fp
+
+            self.tasks = chunk_tasks(
+                fp, chunk_fp, chunking, key, cipher, hash_algo, self._chunks, compress, level,
+                planned)
+        else:
+            self.tasks = partition_tasks(
+                fp, self._outpaths, nparts, wobble, key, cipher, self._group_id, hash_algo,
+                seed, part_size, compress, level, nparity, self._lengths)
+
+
+    def chunk_paths(self):
+        """Returns filepaths of every chunk partition listed by the manifest."""
+
+        return [self._chunk_fp(chunk[0]) for chunk in self._chunks or ()]
+
+
+    def finish(self, executor=None, max_inflight=parallel.DEFAULT_MAX_INFLIGHT):
+        """Writes parity partitions and the manifest once every data partition
+        is written.
+
+        Yields:
+            partition filepath - parity partitions then the manifest
+        """
+
+        key, cipher, hash_algo, compress, level, nparity = self._options
+
+        if nparity:
+            tasks = parity_tasks(
+                self.fp, self._outpaths, self._lengths, nparity, key, cipher, self._group_id,
+                compress, level)
+            for fp_out, _ in parallel.bounded_map(
+                    write_partition_data, tasks, executor, max_inflight, data_cost):
+                yield fp_out
+
+        if self._chunks is not None:
+            chunk_ids = [chunk[0] for chunk in self._chunks]
+            digests = [chunk[1] for chunk in self._chunks]
+            manifest_path = self._manifest_path
+            meta_block = manifest_block(
+                self._group_id, len(digests), self.fp, hash_algo, digests, chunk_ids)
+        else:
+            manifest_path = next(self._outpaths)
+            meta_block = manifest_block(
+                self._group_id, len(self.digests), self.fp, hash_algo, self.digests)
+
+        fp_out, _ = write_partition(self.fp, 0, 0, meta_block, manifest_path, key, cipher)
+        yield fp_out
+
+
+def remove_replaced_chunks(plans, key=None, executor=None):
+    """Removes chunk partitions listed by manifests that plans overwrote and
+    by no manifest left next to them.
+
+    Re-chopping a changed file into the same output directory overwrites its
+    manifest, chunks only the old version used would otherwise stay behind.
+    Manifests in other keys cannot list these chunks, chunk filenames are
+    keyed.
+
+    Args:
+        plans: iterable of finished FilePlan
+        key: str or bytes - encryption key, None for plaintext partitions
+        executor: optional concurrent.futures executor for reading files
+
+    Returns:
+        list of removed filepaths
+    """
+
+    replaced, listed = set(), set()
+    for plan in plans:
+        replaced.update(plan.replaced_chunks)
+        listed.update(plan.chunk_paths())
+
+    replaced -= listed
+    if not replaced:
+        return []
+
+    # chunk partitions are named [name].chp, other partitions [name].chp.[n]
+    paths = [os.path.join(dirpath, fn)
+             for dirpath in {os.path.dirname(fp) for fp in replaced}
+             for fn in os.listdir(dirpath)
+             if not util.is_temp(fn) and not fn.endswith('.chp')]
+
+    for fp, meta in read_paths(paths, key, executor).items():
+        chunkdir = os.path.dirname(fp)
+        replaced.difference_update(os.path.join(chunkdir, chunk_filename(chunk_id, key))
+                                   for chunk_id in manifest_chunks(meta))
+
+    removed = []
+    for fp in sorted(replaced):
+        try:
+            os.remove(fp)
+        except FileNotFoundError:
+            continue
+        removed.append(fp)
+
+    return removed
+
+
+def partition_file(fp, outpaths, nparts, wobble=0, key=None, cipher=DEFAULT_CIPHER,
+                   executor=None, max_inflight=parallel.DEFAULT_MAX_INFLIGHT,
+                   hash_algo=DEFAULT_HASH, seed=None, part_size=None, chunking=None,
+                   store=None, compress=None, level=None, nparity=0):
+    """Creates file partitions and embeds metadata for reassembly.
+
+    Each byte range of the input is read once and written directly to its
+    partition file, encrypted when a key is given. Every payload is hashed
+    while it is written and the partition digests are stored, along with
+    their tree hash root, in a manifest partition written last.
+
+    Partition layout:
+        data:     [metadata block][payload]
+        parity:   [metadata block][data partition lengths][parity bytes]
+        manifest: [metadata block][read next][encoded filename] ||
+                  [hash id][read next][tree root][partition digests] ||
+                  [chunk ids - content defined partitions only]
+
+    With nparity, parity partitions written after the data partitions let
+    merge rebuild up to nparity missing data partitions, see choppy.parity.
+
+    With chunking, partition boundaries are content defined and partitions
+    are named by content in the directory of the manifest, or in a store.
+    Partitions already there from an earlier chop of a similar file are
+    reused and only new partitions are written. Partitions only listed by a
+    manifest overwritten at the same filepath are removed.
+
+    Args:
+        fp: str filepath
+        outpaths: iterable (or generator) of filepaths for partitions
+        nparts: int number of data partitions to create
+        wobble: int (1-99) percent to randomize partition size
+        key: str or bytes - encryption key, None for plaintext partitions
+        cipher: str - stream cipher name or 'fernet' for legacy format
+        executor: optional concurrent.futures executor for writing partitions
+        max_inflight: int - cap in bytes on estimated memory of partitions
+            being encrypted at once
+        hash_algo: str name of hash in digest.HASHES for partition digests
+        seed: optional int seed for reproducible wobble
+        part_size: optional int max partition size in bytes, overrides nparts
+        chunking: optional tuple (int min size, int avg size, int max size)
+            for content defined partitions, overrides nparts and part_size
+        store: optional str directory path of a content addressed store for
+            chunk partitions, the manifest is still written to outpaths
+        compress: str name of codec in codec.CODECS, None for no compression
+        level: int compression level, None for codec default
+        nparity: int number of parity partitions, not supported with chunking
+
+    Yields:
+        partition filepath - new data partitions, parity partitions then the
+        manifest
+    """
+
+    plan = FilePlan(fp, outpaths, nparts, wobble, key, cipher, hash_algo, seed, part_size,
+                    chunking, store, compress, level, nparity)
+
+    for fp_out, part_digest in parallel.bounded_map(
+            write_partition, plan.tasks, executor, max_inflight, task_cost):
+        plan.digests.append(part_digest)
+        yield fp_out
+
+    yield from plan.finish(executor, max_inflight)
+    remove_replaced_chunks([plan], key, executor)
+
+
+def write_file_partition(file_ix, *args):
+    """write_partition for tasks of several files, tagged with file index."""
+
+    return file_ix, write_partition(*args)
+
+
+def file_task_cost(file_ix, *args):
+    """task_cost of write_file_partition."""
+
+    return task_cost(*args)
+
+
+def partition_files(filepaths, outdir, nparts, wobble=0, randfn=False, key=None,
+                    cipher=DEFAULT_CIPHER, executor=None,
+                    max_inflight=parallel.DEFAULT_MAX_INFLIGHT, hash_algo=DEFAULT_HASH,
+                    seed=None, part_size=None, chunking=None, store=None, compress=None,
+                    level=None, nparity=0):
+    """Partitions several files through one pipeline of write tasks, see
+    partition_file.
+
+    Data partitions of the next file are handed to the executor while those
+    of the previous file are still being written, so workers stay busy
+    across file boundaries. The parity partitions and manifest of each file
+    are written once all its data partitions are written.
+
+    Args:
+        filepaths: iterable of filepaths to partition
+        outdir: str directory path
+        randfn: bool enabling random filenames instead of sequential numeric
+        other arguments: see partition_file
+
+    Yields:
+        parallel.Partition (input filepath, partition filepath) - for each
+        file in order, new data partitions, parity partitions then the
+        manifest
+    """
+
+    planned = set()
+    plans = [FilePlan(fp, generate_filepath(outdir, ix, randfn), nparts, wobble, key, cipher,
+                      hash_algo, seed, part_size, chunking, store, compress, level, nparity,
+                      planned)
+             for ix, fp in enumerate(filepaths)]
+
+    def tasks():
+        for ix, plan in enumerate(plans):
+            for args in plan.tasks:
+                yield (ix,) + args
+
+    def finish(plan):
+        for fp_out in plan.finish(executor, max_inflight):
+            yield parallel.Partition(plan.fp, fp_out)
+
+    done = 0
+    for ix, (fp_out, part_digest) in parallel.bounded_map(
+            write_file_partition, tasks(), executor, max_inflight, file_task_cost):
+        for plan in plans[done:ix]:
+            yield from finish(plan)
+        done = ix
+
+        plans[ix].digests.append(part_digest)
+        yield parallel.Partition(plans[ix].fp, fp_out)
+
+    for plan in plans[done:]:
+        yield from finish(plan)
+
+    remove_replaced_chunks(plans, key, executor)
+
+
+def stream_tasks(file_, outpaths, part_size, key=None, cipher=DEFAULT_CIPHER,
+                 group_id=None, hash_algo=DEFAULT_HASH, compress=None, level=None):
+    """Reads an unbounded stream into partitions of part_size bytes.
+
+    The number of partitions is only known at the end of the stream, so
+    stream data partitions record an index total of 0 and the count is
+    stored in the manifest.
+
+    Args:
+        file_: readable binary file object, e.g. sys.stdin.buffer
+        outpaths: iterator of filepaths for partitions
+        part_size: int partition size in bytes, the last may be shorter
+        key: str or bytes - encryption key, None for plaintext partitions
+        cipher: str - stream cipher name or 'fernet' for legacy format
+        group_id: bytes random id shared by the partitions of one stream
+        hash_algo: str name of hash in digest.HASHES for partition digests
+        compress: str name of codec in codec.CODECS, None for no compression
+        level: int compression level, None for codec default
+
+    Yields:
+        tuple of write_partition_data arguments
+    """
+
+    for ix in count():
+        data = util.read_full(file_, part_size)
+        if not data:
+            return
+
+        if ix >= MAX_PARTITIONS:
+            raise ValueError('Too many partitions: {}'.format(ix + 1))
+
+        meta_block = metadata_block(util.KIND_DATA, group_id, ix, 0, len(data))
+        yield (data, bytes(meta_block), next(outpaths), key, cipher, hash_algo,
+               compress, level)
+
+
+def data_cost(data, meta_block, fp_out, key=None, cipher=DEFAULT_CIPHER,
+              hash_algo=None, compress=None, level=None):
+    """Estimated memory used by write_partition_data, including data and
+    compressor state."""
+
+    return (len(data) + memory_cost(len(data), streamed=bool(key) and cipher != 'fernet') +
+            codec.memory_cost(compress, level))
+
+
+def partition_stream(file_, name, outpaths, part_size=STREAM_PART_SIZE, key=None,
+                     cipher=DEFAULT_CIPHER, executor=None,
+                     max_inflight=parallel.DEFAULT_MAX_INFLIGHT, hash_algo=DEFAULT_HASH,
+                     compress=None, level=None):
+    """Partitions a stream of unknown length, see partition_file.
+
+    The stream is read one partition at a time when the previous partitions
+    are written, or handed to the executor, so memory use is bounded by
+    max_inflight plus one partition.
+
+    Args:
+        file_: readable binary file object, e.g. sys.stdin.buffer
+        name: str filename recorded in the manifest
+        outpaths: iterable (or generator) of filepaths for partitions
+        part_size: int partition size in bytes
+        key: str or bytes - encryption key, None for plaintext partitions
+        cipher: str - stream cipher name or 'fernet' for legacy format
+        executor: optional concurrent.futures executor for writing partitions
+        max_inflight: int - cap in bytes on estimated memory of partitions
+            being written at once
+        hash_algo: str name of hash in digest.HASHES for partition digests
+        compress: str name of codec in codec.CODECS, None for no compression
+        level: int compression level, None for codec default
+
+    Yields:
+        partition filepath - data partitions then the manifest
+    """
+
+    outpaths = iter(outpaths)
+    group_id = os.urandom(16)
+
+    if compress:
+        codec.validate(compress, level)
+
+    tasks = stream_tasks(
+        file_, outpaths, part_size, key, cipher, group_id, hash_algo, compress, level)
+
+    digests = []
+    for fp_out, part_digest in parallel.bounded_map(
+            write_partition_data, tasks, executor, max_inflight, data_cost):
+        digests.append(part_digest)
+        yield fp_out
+
+    meta_block = manifest_block(group_id, len(digests), name, hash_algo, digests)
+    fp_out, _ = write_partition_data(b'', meta_block, next(outpaths), key, cipher)
+    yield fp_out
+
+
+def chop_stream(file_, outdir, key=None, part_size=None, name='stdin', randfn=False,
+                sfx=0, cipher=DEFAULT_CIPHER, workers=1, max_inflight=parallel.DEFAULT_MAX_INFLIGHT,
+                hash_algo=DEFAULT_HASH, compress=None, level=None):
+    """Partitions a stream such as stdin without staging it on disk.
+
+    Args:
+        file_: readable binary file object, e.g. sys.stdin.buffer
+        outdir: str directory path
+        key: str or bytes - encryption key, None for plaintext partitions
+        part_size: int partition size in bytes - default: STREAM_PART_SIZE
+        name: str filename for the merged stream
+        randfn: bool enabling random filenames instead of sequential numeric
+        sfx: int numerical file extension suffix of partition filenames
+        cipher: str - stream cipher name or 'fernet' for legacy format
+        workers: int number of workers - 0 or None uses all cores
+        max_inflight: int - cap in bytes on estimated memory of partitions
+            being written at once
+        hash_algo: str name of hash in digest.HASHES for partition digests
+        compress: str name of codec in codec.CODECS, None for no compression
+        level: int compression level, None for codec default
+
+    Returns:
+        iterable of partition filepaths
+    """
+
+    with parallel.pool(workers, threads=not key) as executor:
+        return list(partition_stream(
+            file_, name, generate_filepath(outdir, sfx, randfn), part_size or STREAM_PART_SIZE,
+            key, cipher, executor, max_inflight, hash_algo, compress, level))
+
+
+def pack_tasks(packs, outpaths, key=None, cipher=DEFAULT_CIPHER, hash_algo=DEFAULT_HASH,
+               compress=None, level=None, planned=None):
+    """Plans one partition per group of small files, members are read by
+    write_pack.
+
+    Args:
+        packs: iterable of lists of tuple (str filepath, int byte length)
+        outpaths: iterator of filepaths for partitions
+        key: str or bytes - encryption key, None for plaintext partitions
+        cipher: str - stream cipher name or 'fernet' for legacy format
+        hash_algo: str name of hash in digest.HASHES for partition digests
+        compress: str name of codec in codec.CODECS, None for no compression
+        level: int compression level, None for codec default
+        planned: list appended with tuple (group id, manifest filepath, pack
+            members) for each pack in order
+
+    Yields:
+        tuple of write_pack arguments
+    """
+
+    for members in packs:
+        members = tuple(members)
+        group_id = os.urandom(16)
+        meta_block = metadata_block(
+            util.KIND_DATA, group_id, 0, 1, sum(nbytes for _, nbytes in members))
+        fp_out = next(outpaths)
+        planned.append((group_id, next(outpaths), members))
+        yield (members, bytes(meta_block), fp_out, key, cipher, hash_algo, compress, level)
+
+
+def write_pack(members, meta_block, fp_out, key=None, cipher=DEFAULT_CIPHER,
+               hash_algo=None, compress=None, level=None):
+    """Reads a group of small files and writes them as one partition payload,
+    see write_partition.
+
+    Args:
+        members: tuple of tuple (str filepath, int byte length) in payload order
+
+    Returns:
+        tuple (str partition filepath, bytes leaf digest of payload or None)
+
+    Raises:
+        EOFError if a file is shorter than its planned byte length
+    """
+
+    payload = io.BytesIO()
+    for fp, nbytes in members:
+        with open(fp, 'rb') as file_:
+            util.copy_bytes(file_, payload, nbytes)
+
+    nbytes = payload.tell()
+    payload.seek(0)
+    return copy_partition(payload, nbytes, meta_block, fp_out, key, cipher, hash_algo,
+                          compress, level)
+
+
+def pack_cost(members, meta_block, fp_out, key=None, cipher=DEFAULT_CIPHER,
+              hash_algo=None, compress=None, level=None):
+    """Estimated memory used by write_pack, including the payload."""
+
+    nbytes = sum(member[1] for member in members)
+    return (nbytes + memory_cost(nbytes, streamed=bool(key) and cipher != 'fernet') +
+            codec.memory_cost(compress, level))
+
+
+def pack_files(packs, outpaths, key=None, cipher=DEFAULT_CIPHER, executor=None,
+               max_inflight=parallel.DEFAULT_MAX_INFLIGHT, hash_algo=DEFAULT_HASH,
+               compress=None, level=None):
+    """Chops groups of small files into one partition and a pack manifest per
+    group, see partition_file.
+
+    Groups are read and written concurrently by the executor, so many small
+    inputs cost one partition write each instead of a partition per file.
+
+    Args:
+        packs: iterable of lists of tuple (str filepath, int byte length)
+        outpaths: iterable (or generator) of filepaths for partitions
+        key: str or bytes - encryption key, None for plaintext partitions
+        cipher: str - stream cipher name or 'fernet' for legacy format
+        executor: optional concurrent.futures executor for writing partitions
+        max_inflight: int - cap in bytes on estimated memory of partitions
+            being written at once
+        hash_algo: str name of hash in digest.HASHES for partition digests
+        compress: str name of codec in codec.CODECS, None for no compression
+        level: int compression level, None for codec default
+
+    Yields:
+        partition filepath - data partition then manifest of each group
+    """
+
+    outpaths = iter(outpaths)
+    planned = []
+
+    if compress:
+        codec.validate(compress, level)
+
+    tasks = pack_tasks(packs, outpaths, key, cipher, hash_algo, compress, level, planned)
+
+    for ix, (fp_out, part_digest) in enumerate(parallel.bounded_map(
+            write_pack, tasks, executor, max_inflight, pack_cost)):
+        yield fp_out
+
+        group_id, manifest_path, members = planned[ix]
+        meta_block = manifest_block(
+            group_id, 1, 'pack.{}'.format(ix), hash_algo, (part_digest,), members=members)
+        fp_out, _ = write_partition_data(b'', meta_block, manifest_path, key, cipher)
+        yield fp_out
+
+
+def split_small_files(filepaths, pack_size):
+    """Separates files smaller than pack_size and packs them into groups.
+
+    Packed files are extracted by filename on merge, so their filenames must
+    be unique.
+
+    Returns:
+        tuple (list of str filepaths of other files, list of lists of tuple
+        (str filepath, int byte length) for each group of small files)
+
+    Raises:
+        ValueError if two small files share a filename
+    """
+
+    if not pack_size:
+        return list(filepaths), []
+
+    sizes = [(fp, os.path.getsize(fp)) for fp in filepaths]
+    small = [member for member in sizes if member[1] < pack_size]
+
+    seen = {}
+    for fp, _ in small:
+        fn = os.path.basename(fp)
+        if fn in seen:
+            raise ValueError('Packed files must have unique filenames: {} and {}'.format(
+                seen[fn], fp))
+        seen[fn] = fp
+    bins = partition.pack_bins((member[1] for member in small), pack_size)
+
+    return ([fp for fp, nbytes in sizes if nbytes >= pack_size],
+            [[small[ix] for ix in members] for members in bins])
 
 
 def generate_filepath(outdir, sfx=0, randfn=False):
@@ -129,7 +1009,9 @@ def generate_filepath(outdir, sfx=0, randfn=False):
             yield fp_out
 
 
-def chop(filepaths, outdir, nparts, wobble, randfn):
+def chop(filepaths, outdir, nparts, wobble, randfn, hash_algo=DEFAULT_HASH, seed=None,
+         part_size=None, chunking=None, store=None, compress=None, level=None,
+         nparity=0, pack_size=None):
     """Batch process function to manage partitioning multiple files.
 
     Args:
@@ -138,36 +1020,102 @@ def chop(filepaths, outdir, nparts, wobble, randfn):
         nparts: int number of partitions to create
         wobble: int (1-99) percent to randomize partition size
         randfn: bool enabling random filenames instead of sequential numeric
+        hash_algo: str name of hash in digest.HASHES for partition digests
+        seed: optional int seed for reproducible wobble
+        part_size: optional int max partition size in bytes, overrides nparts
+        chunking: optional tuple (int min size, int avg size, int max size)
+            for content defined partitions, overrides nparts and part_size
+        store: optional str directory path of a content addressed store for
+            chunk partitions, implies chunking
+        compress: str name of codec in codec.CODECS, None for no compression
+        level: int compression level, None for codec default
+        nparity: int number of parity partitions per file
+        pack_size: optional int size in bytes - files smaller than pack_size
+            are packed together into partitions of up to pack_size bytes
 
     Returns:
-        iterable of partition filepaths
+        iterable of new partition filepaths
     """
 
-    chopped_paths = []
-    for ix, fp in enumerate(filepaths):
-        outpath_gen = generate_filepath(outdir, ix, randfn)
-        chopped_paths.extend(partition_file(fp, outpath_gen, nparts, wobble))
+    filepaths = tuple(filepaths)
+    if pack_size and (chunking or store):
+        raise ValueError('Packing small files requires fixed size partitions')
+
+    large, packs = split_small_files(filepaths, pack_size)
+
+    chopped_paths = [event.path for event in partition_files(
+        large, outdir, nparts, wobble, randfn, hash_algo=hash_algo, seed=seed,
+        part_size=part_size, chunking=chunking, store=store, compress=compress,
+        level=level, nparity=nparity)]
+
+    outpath_gen = generate_filepath(outdir, len(filepaths), randfn)
+    chopped_paths.extend(pack_files(
+        packs, outpath_gen, hash_algo=hash_algo, compress=compress, level=level))
 
     return chopped_paths
 
 
-def chop_encrypt(filepaths, outdir, key, nparts, wobble=0, randfn=False):
-    """Batch process function to partition files then encrypt partitions.
+def chop_encrypt(filepaths, outdir, key, nparts, wobble=0, randfn=False,
+                 cipher=DEFAULT_CIPHER, workers=1,
+                 max_inflight=parallel.DEFAULT_MAX_INFLIGHT, hash_algo=DEFAULT_HASH,
+                 seed=None, part_size=None, chunking=None, store=None, compress=None,
+                 level=None, nparity=0, pack_size=None, progress=None):
+    """Batch process function to partition files into encrypted partitions.
+
+    Plaintext partitions are never written to disk. With workers > 1
+    partitions are encrypted in a process pool; partition sizes, names and
+    metadata match the serial path. Without a key, partitions are written
+    as plaintext by a thread pool, e.g. for inputs already encrypted.
 
     Args:
         filepaths: iterable of filepaths to partition
         outdir: str directory path
-        key: str or bytes - encryption key
+        key: str or bytes - encryption key, None for plaintext partitions
         nparts: int number of partitions to create
         wobble: int (1-99) percent to randomize partition size
         randfn: bool enabling random filenames instead of sequential numeric
+        cipher: str - stream cipher name or 'fernet' for legacy format
+        workers: int number of processes - 0 or None uses all cores
+        max_inflight: int - cap in bytes on estimated memory of partitions
+            being encrypted at once
+        hash_algo: str name of hash in digest.HASHES for partition digests
+        seed: optional int seed for reproducible wobble
+        part_size: optional int max partition size in bytes, overrides nparts
+        chunking: optional tuple (int min size, int avg size, int max size)
+            for content defined partitions, overrides nparts and part_size
+        store: optional str directory path of a content addressed store for
+            chunk partitions, implies chunking
+        compress: str name of codec in codec.CODECS, None for no compression
+        level: int compression level, None for codec default
+        nparity: int number of parity partitions per file
+        pack_size: optional int size in bytes - files smaller than pack_size
+            are packed together into partitions of up to pack_size bytes
+        progress: optional function called with a parallel.Partition event
+            as each partition is written
 
     Returns:
-        iterable of filepaths for encrypted partitions
+        iterable of filepaths for new encrypted partitions
     """
 
-    with tempfile.TemporaryDirectory() as tmpdir:
-        chopped_paths = chop(filepaths, tmpdir, nparts, wobble, randfn)
-        encrypted_paths = batch_encrypt(key, chopped_paths, outdir)
+    filepaths = tuple(filepaths)
+    if pack_size and (chunking or store):
+        raise ValueError('Packing small files requires fixed size partitions')
+
+    large, packs = split_small_files(filepaths, pack_size)
+
+    encrypted_paths = []
+
+    with parallel.pool(workers, threads=not key) as executor:
+        for event in partition_files(
+                large, outdir, nparts, wobble, randfn, key, cipher, executor, max_inflight,
+                hash_algo, seed, part_size, chunking, store, compress, level, nparity):
+            if progress is not None:
+                progress(event)
+            encrypted_paths.append(event.path)
+
+        outpath_gen = generate_filepath(outdir, len(filepaths), randfn)
+        encrypted_paths.extend(parallel.report(pack_files(
+            packs, outpath_gen, key, cipher, executor, max_inflight, hash_algo, compress,
+            level), None, progress))
 
     return encrypted_paths
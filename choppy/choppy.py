@@ -5,11 +5,8 @@ Choppy functions for CLI usage.
 """
 
 import sys
-import tempfile
 
 from choppy import crypto
-from choppy.chop import chop_encrypt
-from choppy.merge import decrypt_merge
 from choppy.user_options import parse_arguments
 
 # ------------------------------------------------------------------------------
@@ -26,10 +23,13 @@ def read_bytes_file(fp):
 
 
 def path_tuple(arg_infiles):
-    return tuple(infile.name for infile in arg_infiles)
+    return tuple(infile for infile in arg_infiles if infile is not sys.stdin.buffer)
 
 
 def load_user_key(args):
+    if getattr(args, 'no_encrypt', False):
+        return None
+
     if args.use_key:
         if args.keyfile:
             key = read_bytes_file(args.keyfile.name)
@@ -41,22 +41,29 @@ def load_user_key(args):
         else:
             password = args.pw
 
-        salt = read_bytes_file(args.salt)
-        key = crypto.load_key(password, salt, args.iterations)
+        salt = read_bytes_file(args.salt.name)
+        key = crypto.load_key(
+            password, salt, args.iterations, args.kdf, (args.scrypt_cost,) + crypto.SCRYPT_COST[1:])
 
     return key
 
 
 # ------------------------------------------------------------------------------
 def main():
-    """Entry point for CLI"""
+    """Entry point for CLI
+
+    Modules for chopping and merging are imported by the commands using them,
+    so generating keys does not load cryptography or numpy.
+    """
 
     args = parse_arguments()
 
     outdir = args.outdir
     cmd = args.command
+    stdout = sys.stdout.buffer
 
     if args.quiet:
+        import tempfile
         sys_stdout_backup = sys.stdout
         sys_stdout_file = tempfile.TemporaryFile(mode='w')
         sys.stdout = sys_stdout_file
@@ -70,6 +77,31 @@ def main():
             if args.gensalt:
                 crypto.generate_salt(length=args.gensalt, outdir=outdir)
 
+    elif cmd == 'serve':
+        from choppy import server
+
+        print('>>> Serving jobs on {}'.format(args.socket))
+        server.serve(args.socket, args.jobs, args.max_jobs, args.max_inflight)
+
+    elif cmd == 'client':
+        import json
+        from choppy import server
+
+        files = [infile if infile is sys.stdin.buffer else open(infile, 'rb')
+                 for infile in args.jobs]
+        failures = 0
+        try:
+            for event in server.submit(args.socket, server.read_jobs(files)):
+                print(json.dumps(event), flush=True)
+                failures += server.failed(event)
+        finally:
+            for infile in files:
+                if infile is not sys.stdin.buffer:
+                    infile.close()
+
+        if failures:
+            sys.exit(1)
+
     else:
         key = load_user_key(args)
 
@@ -77,14 +109,57 @@ def main():
             crypto.generate_keyfile(key=key, outdir=outdir)
 
         elif cmd == 'chop':
+            from choppy import partition
+            from choppy.chop import chop_encrypt, chop_stream
+
             paths = path_tuple(args.input)
             p, w, r = args.partitions, args.wobble, args.randfn
-            e_paths = chop_encrypt(paths, outdir, key, p, w, r)
+            chunking = partition.chunk_sizes(args.chunk_size) if args.chunk_size else None
+            e_paths = chop_encrypt(
+                paths, outdir, key, p, w, r, cipher=args.cipher,
+                workers=args.jobs, max_inflight=args.max_inflight * 2**20,
+                hash_algo=args.hash_algo, seed=args.seed, part_size=args.part_size,
+                chunking=chunking, store=args.store, compress=args.compress,
+                level=args.level, nparity=args.nparity, pack_size=args.pack_size)
+
+            if sys.stdin.buffer in args.input:
+                e_paths += chop_stream(
+                    sys.stdin.buffer, outdir, key, args.part_size, args.name, r,
+                    sfx=len(paths) + 1, cipher=args.cipher, workers=args.jobs,
+                    max_inflight=args.max_inflight * 2**20, hash_algo=args.hash_algo,
+                    compress=args.compress, level=args.level)
+
             print('>>> Partitions generated: {}'.format(len(e_paths)))
 
         elif cmd == 'merge':
+            from choppy.merge import decrypt_merge, group_status, merge_stream, verify
+
             paths = path_tuple(args.input)
-            status, filepaths = decrypt_merge(paths, outdir, key)
+            if args.stdout:
+                try:
+                    merge_stream(
+                        paths, stdout, key, args.jobs, args.max_inflight * 2**20,
+                        args.catalog, args.store)
+                except crypto.decrypt_errors() + (EOFError, ValueError) as e:
+                    sys.stderr.write('>>> Merge failed: {}\n'.format(e))
+                    sys.exit(1)
+            elif args.verify_only:
+                results = verify(
+                    paths, key, args.jobs, args.max_inflight * 2**20, args.catalog,
+                    args.store)
+                for filename, verified in results:
+                    print('{} {}'.format(filename, 'verified' if verified else 'FAILED'))
+                if not all(verified for _, verified in results):
+                    sys.exit(1)
+            elif args.status:
+                summary = group_status(paths, key, args.jobs, args.catalog, args.store)
+                for filename, found, tot, state in summary:
+                    print('{} {}/{} {}'.format(filename, found, tot, state))
+            else:
+                status, filepaths = decrypt_merge(
+                    paths, outdir, key,
+                    workers=args.jobs, max_inflight=args.max_inflight * 2**20,
+                    catalog=args.catalog, store=args.store)
 
     if args.quiet:
         sys.stdout = sys_stdout_backup
@@ -0,0 +1,234 @@
+#! usr/bin/env/ python3
+
+"""
+Compression of partition payloads before encryption.
+
+Payloads are compressed as a single stream with a stdlib codec. Whether a
+partition is worth compressing is decided from a sample of its payload, so
+the codec is known before the metadata block is written and partitions are
+still written in one pass. The codec of each partition is recorded in its
+metadata block.
+
+Codec ids:
+    0: none
+    1: zlib
+    2: lzma
+    3: bz2
+"""
+
+import bz2
+import lzma
+import zlib
+
+# ------------------------------------------------------------------------------
+SAMPLE_SIZE = 2**16
+MIN_RATIO = 0.95
+READ_SIZE = 2**18
+
+CODECS = {
+    'none': (0, None),
+    'zlib': (1, range(0, 10)),
+    'lzma': (2, range(0, 10)),
+    'bz2': (3, range(1, 10)),
+    }
+
+CODEC_IDS = {v[0]: k for k, v in CODECS.items()}
+
+DEFAULT_LEVELS = {'zlib': 6, 'lzma': 6, 'bz2': 9}
+
+# approximate compressor and decompressor state of lzma presets 0-9 in MiB,
+# from the xz documentation
+LZMA_MEMORY = (3, 9, 17, 32, 48, 94, 94, 186, 370, 674)
+LZMA_DECOMPRESS_MEMORY = 65
+
+# bz2 reports invalid data as OSError
+DECOMPRESS_ERRORS = (zlib.error, lzma.LZMAError, OSError, EOFError)
+
+
+class CorruptPayload(ValueError):
+    """Raised when a compressed payload cannot be decompressed."""
+
+
+def validate(codec, level=None):
+    """Checks codec name and compression level.
+
+    Returns:
+        int level, the codec default if level is None
+
+    Raises:
+        ValueError for unknown codec or level out of range
+    """
+
+    if codec not in CODECS:
+        raise ValueError('Unsupported codec: {}'.format(codec))
+
+    if codec == 'none':
+        return None
+
+    if level is None:
+        return DEFAULT_LEVELS[codec]
+
+    if level not in CODECS[codec][1]:
+        raise ValueError('Invalid {} level: {}'.format(codec, level))
+
+    return level
+
+
+def is_compressible(sample):
+    """Estimates if data shrinks by compressing a sample with fast zlib."""
+
+    if not sample:
+        return False
+    return len(zlib.compress(sample, 1)) < len(sample) * MIN_RATIO
+
+
+def memory_cost(codec, level=None, decompress=False):
+    """Estimates memory held by the compressor or decompressor state of codec.
+
+    Decompressors do not know the level a payload was compressed with, their
+    estimate covers the most demanding level.
+
+    Args:
+        codec: str name of codec in CODECS, None for no compression
+        level: int compression level, None for codec default
+        decompress: bool - estimate decompressor instead of compressor
+
+    Returns:
+        int bytes
+    """
+
+    if not codec or codec == 'none':
+        return 0
+
+    level = validate(codec, level)
+
+    if codec == 'zlib':
+        # deflate window and hash chains, inflate window
+        return 2**15 + 2**13 if decompress else 2**18
+    elif codec == 'lzma':
+        return (LZMA_DECOMPRESS_MEMORY if decompress else LZMA_MEMORY[level]) * 2**20
+
+    # bzip2 blocks are 100k times level, the compressor holds 8 blocks
+    if decompress:
+        return 100000 + 4 * 900000
+    return 400000 + 8 * 100000 * level
+
+
+def compressor(codec, level=None):
+    """Returns new compressor object with compress and flush methods."""
+
+    level = validate(codec, level)
+    if codec == 'zlib':
+        return zlib.compressobj(level)
+    elif codec == 'lzma':
+        return lzma.LZMACompressor(preset=level)
+    elif codec == 'bz2':
+        return bz2.BZ2Compressor(level)
+    raise ValueError('Codec has no compressor: {}'.format(codec))
+
+
+class ZlibDecompressor:
+    """zlib.decompressobj with the max_length and needs_input interface of
+    lzma.LZMADecompressor and bz2.BZ2Decompressor."""
+
+    def __init__(self):
+        self._decomp = zlib.decompressobj()
+        self.needs_input = True
+
+
+    @property
+    def eof(self):
+        return self._decomp.eof
+
+
+    def decompress(self, data, max_length=-1):
+        data = self._decomp.unconsumed_tail + data
+        out = self._decomp.decompress(data, max(max_length, 0))
+        self.needs_input = not self._decomp.unconsumed_tail
+        return out
+
+
+def decompressor(codec):
+    """Returns new decompressor object with lzma.LZMADecompressor interface."""
+
+    if codec == 'zlib':
+        return ZlibDecompressor()
+    elif codec == 'lzma':
+        return lzma.LZMADecompressor()
+    elif codec == 'bz2':
+        return bz2.BZ2Decompressor()
+    raise ValueError('Codec has no decompressor: {}'.format(codec))
+
+
+# ------------------------------------------------------------------------------
+class CompressingWriter:
+    """Write only file-like object compressing data into file_.
+
+    Args:
+        file_: binary file object opened for writing
+        codec: str - name of codec in CODECS
+        level: int - compression level, None for codec default
+    """
+
+    def __init__(self, file_, codec, level=None):
+        self._file = file_
+        self._comp = compressor(codec, level)
+
+
+    def write(self, data):
+        out = self._comp.compress(data)
+        if out:
+            self._file.write(out)
+        return len(data)
+
+
+    def close(self):
+        """Flushes compressor. Underlying file object is not closed."""
+
+        if self._comp is not None:
+            self._file.write(self._comp.flush())
+            self._comp = None
+
+
+class DecompressingReader:
+    """Read only file-like object decompressing a payload from file_.
+
+    Output per read is bounded by the requested size, so memory use does not
+    depend on the compression ratio.
+
+    Args:
+        file_: readable binary file object positioned at the payload
+        codec: str - name of codec in CODECS
+    """
+
+    def __init__(self, file_, codec):
+        self._file = file_
+        self._decomp = decompressor(codec)
+
+
+    def read(self, n):
+        """Reads up to n > 0 bytes of decompressed data, b'' at end of payload."""
+
+        while n and not self._decomp.eof:
+            data = b''
+            if self._decomp.needs_input:
+                data = self._file.read(READ_SIZE)
+                if not data:
+                    break
+
+            try:
+                out = self._decomp.decompress(data, n)
+            except DECOMPRESS_ERRORS as e:
+                raise CorruptPayload('Invalid compressed payload: {}'.format(e))
+            if out:
+                return out
+
+        return b''
+
+
+def wrap_reader(file_, codec):
+    """Returns reader of decompressed payload, file_ if codec is 'none'."""
+
+    if codec == 'none':
+        return file_
+    return DecompressingReader(file_, codec)
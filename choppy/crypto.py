@@ -1,14 +1,51 @@
 #! usr/bin/env/ python3
 
 import base64
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
 import hashlib
+import io
 import os
 from secrets import token_urlsafe
+import threading
+import time
+
+from choppy import stream
+
+# ------------------------------------------------------------------------------
+DEFAULT_CIPHER = 'aesgcm'
+CIPHERS = ('fernet',) + tuple(stream.CIPHERS)
+
+DEFAULT_KDF = 'pbkdf2'
+KDFS = ('pbkdf2', 'scrypt')
+SCRYPT_COST = (2**14, 8, 1)
+
+KEY_CACHE_SIZE = 16
+KEY_CACHE_TTL = 300
+
+
+def decrypt_errors():
+    """Returns tuple of exceptions raised when partitions fail to decrypt:
+    Fernet tokens or stream frames that do not authenticate and stream
+    headers that are not recognized.
+
+    cryptography is imported on first use so commands which do not encrypt,
+    e.g. generating keys, start without loading it.
+    """
+
+    from cryptography.exceptions import InvalidTag
+    from cryptography.fernet import InvalidToken
+    return (InvalidToken, InvalidTag, stream.StreamHeaderError)
+
+
+@lru_cache(maxsize=stream.KEY_CACHE_SIZE)
+def fernet(key):
+    """Returns Fernet instance for key, reused across partitions and calls."""
+
+    from cryptography.fernet import Fernet
+    return Fernet(key)
 
-from cryptography.fernet import Fernet, InvalidToken
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 
 # ------------------------------------------------------------------------------
 def rand_fn(fn, outdir):
@@ -31,7 +68,7 @@ def generate_keyfile(key=None, outdir=os.curdir):
         if isinstance(key, str):
             key = bytes(key, 'utf-8')
     else:
-        key = Fernet.generate_key()
+        key = base64.urlsafe_b64encode(os.urandom(32))
 
     fp = rand_fn('key', outdir)
     with open(fp, 'xb') as outfile:
@@ -44,7 +81,7 @@ def hash_str(s):
 
 
 def md5_hash(fp):
-    chunk = 2**12
+    chunk = 2**18
     f_hash = hashlib.md5()
     with open(fp, 'rb') as file_:
         data = file_.read(chunk)
@@ -55,38 +92,392 @@ def md5_hash(fp):
     return f_hash.digest()
 
 
-def load_key(password, salt, iterations=100000):
+# ------------------------------------------------------------------------------
+class KeyCache:
+    """Bounded cache of keys derived from passwords, safe to share between
+    threads.
+
+    Entries are looked up by a SHA-256 digest of the password together with
+    the salt, KDF name and KDF parameters, so passwords are not kept. Keys
+    expire ttl seconds after they were derived and the least recently used
+    key is dropped once maxsize keys are cached. Expired keys are dropped on
+    the next get or put. Dropped keys are overwritten in place - copies
+    already returned to callers are not. Concurrent derivations of one entry
+    can wait for each other with deriving, other entries are not blocked.
+
+    Args:
+        maxsize: int max number of keys kept
+        ttl: int or float seconds a derived key is kept
+        clock: function returning monotonic time in seconds
+        on_drop: optional function called after keys are dropped, e.g. to
+            clear cipher instances built from them
+    """
+
+    def __init__(self, maxsize=KEY_CACHE_SIZE, ttl=KEY_CACHE_TTL, clock=time.monotonic,
+                 on_drop=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._on_drop = on_drop
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._deriving = {}
+
+
+    @staticmethod
+    def entry(password, salt, kdf, params):
+        """Returns cache entry key for password and KDF inputs."""
+
+        return (hashlib.sha256(password).digest(), bytes(salt), kdf, params)
+
+
+    @contextmanager
+    def deriving(self, entry):
+        """Holds a lock for entry only, so threads deriving the same key wait
+        for the first one instead of repeating the derivation."""
+
+        with self._lock:
+            waiter = self._deriving.setdefault(entry, [threading.Lock(), 0])
+            waiter[1] += 1
+
+        try:
+            with waiter[0]:
+                yield
+        finally:
+            with self._lock:
+                waiter[1] -= 1
+                if not waiter[1]:
+                    del self._deriving[entry]
+
+
+    def get(self, entry):
+        """Returns cached key of entry, None if missing or expired."""
+
+        with self._lock:
+            dropped = self._expire()
+            cached = self._entries.get(entry)
+
+            if cached is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(entry)
+                cached = bytes(cached[1])
+
+        self._dropped(dropped)
+        return cached
+
+
+    def put(self, entry, key):
+        with self._lock:
+            dropped = self._expire()
+            if entry in self._entries:
+                self._drop(entry)
+
+            self._entries[entry] = (self._clock() + self.ttl, bytearray(key))
+
+            while len(self._entries) > max(0, self.maxsize):
+                self._drop(next(iter(self._entries)))
+                dropped = True
+
+        self._dropped(dropped)
+
+
+    def wipe(self):
+        """Overwrites and drops every cached key, counters are kept."""
+
+        with self._lock:
+            dropped = bool(self._entries)
+            for entry in list(self._entries):
+                self._drop(entry)
+
+        self._dropped(dropped)
+
+
+    def _expire(self):
+        now = self._clock()
+        expired = [entry for entry, (expires, _) in self._entries.items() if expires <= now]
+        for entry in expired:
+            self._drop(entry)
+        return bool(expired)
+
+
+    def _drop(self, entry):
+        _, key = self._entries.pop(entry)
+        key[:] = bytes(len(key))
+
+
+    def _dropped(self, dropped):
+        if dropped and self._on_drop is not None:
+            self._on_drop()
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def clear_ciphers():
+    """Drops every cached cipher instance.
+
+    Instances keep the key they were built with, so they are dropped
+    whenever a derived key expires or is evicted from KEY_CACHE.
+    """
+
+    fernet.cache_clear()
+    stream.aead_cipher.cache_clear()
+
+
+KEY_CACHE = KeyCache(on_drop=clear_ciphers)
+
+
+def wipe_keys():
+    """Drops every cached derived key and cipher instance."""
+
+    KEY_CACHE.wipe()
+    clear_ciphers()
+
+
+def derive(password, salt, kdf, params):
+    """Derives 32 raw key bytes with kdf, see load_key."""
+
+    from cryptography.hazmat.backends import default_backend
+
+    if kdf == 'pbkdf2':
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+
+        kdf_ = PBKDF2HMAC(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=salt,
+            iterations=params[0],
+            backend=default_backend()
+            )
+
+    elif kdf == 'scrypt':
+        from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+
+        n, r, p = params
+        kdf_ = Scrypt(salt=salt, length=32, n=n, r=r, p=p, backend=default_backend())
+
+    else:
+        raise ValueError('Unsupported key derivation function: {}'.format(kdf))
+
+    return kdf_.derive(password)
+
+
+def load_key(password, salt, iterations=100000, kdf=DEFAULT_KDF, scrypt_cost=SCRYPT_COST,
+             cache=KEY_CACHE):
+    """Derives a urlsafe base64 encoded 32 byte key from password and salt.
+
+    The same key is used by every cipher in CIPHERS - stream ciphers derive
+    their own subkeys from it. Derived keys are cached, so calls repeating the
+    same password, salt and KDF parameters skip the derivation. Concurrent
+    calls for the same key wait for one derivation, calls for other keys run
+    alongside it.
+
+    Args:
+        password: str or bytes
+        salt: bytes
+        iterations: int - PBKDF2 iterations
+        kdf: str - 'pbkdf2' for PBKDF2-HMAC-SHA256 or the memory-hard 'scrypt'
+        scrypt_cost: tuple of int (n, r, p) - scrypt CPU/memory cost n, a
+            power of 2, block size r and parallelization p, memory use is
+            128 * n * r bytes
+        cache: KeyCache to reuse derived keys from, None to always derive
+
+    Returns:
+        bytes key
+
+    Raises:
+        ValueError if kdf or its parameters are not supported
+    """
 
     if isinstance(password, str):
         password = bytes(password, 'utf-8')
 
-    kdf = PBKDF2HMAC(
-        algorithm=hashes.SHA256(),
-        length=32,
-        salt=salt,
-        iterations=iterations,
-        backend=default_backend()
-        )
+    params = (iterations,) if kdf == 'pbkdf2' else tuple(scrypt_cost)
+    entry = KeyCache.entry(password, salt, kdf, params)
+
+    if cache is None:
+        return base64.urlsafe_b64encode(derive(password, salt, kdf, params))
+
+    with cache.deriving(entry):
+        key = cache.get(entry)
+        if key is None:
+            key = base64.urlsafe_b64encode(derive(password, salt, kdf, params))
+            cache.put(entry, key)
+
+    return key
+
+
+# ------------------------------------------------------------------------------
+class FernetWriter:
+    """Write only file-like object for the legacy Fernet format.
+
+    Fernet tokens cannot be produced incrementally so all data is buffered
+    and encrypted on close.
+
+    Args:
+        key: str or bytes - encryption key
+        file_: binary file object opened for writing
+    """
+
+    def __init__(self, key, file_):
+        self._fernet = fernet(key)
+        self._file = file_
+        self._buffer = bytearray()
+        self.closed = False
+
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError('write to closed FernetWriter')
+        self._buffer.extend(data)
+        return len(data)
+
+
+    def close(self):
+        if not self.closed:
+            self._file.write(self._fernet.encrypt(bytes(self._buffer)))
+            self._buffer = bytearray()
+            self.closed = True
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.close()
+
+
+def encryptor(key, file_, cipher=DEFAULT_CIPHER, header=None):
+    """Wraps writable binary file object in an encrypting writer.
+
+    Stream ciphers encrypt header as a separately authenticated record that
+    can be read without decrypting any data. Fernet tokens have no such
+    record so header is encrypted as the start of the data.
 
-    return base64.urlsafe_b64encode(kdf.derive(password))
+    Args:
+        key: str or bytes - encryption key
+        file_: binary file object opened for writing
+        cipher: str - 'fernet' for legacy format or stream cipher name
+        header: bytes - optional header record, e.g. partition metadata
+
+    Returns:
+        file-like object with write and close - close must be called to
+        finalize ciphertext
+    """
+
+    if cipher == 'fernet':
+        writer = FernetWriter(key, file_)
+        if header is not None:
+            writer.write(header)
+        return writer
+    elif cipher in stream.CIPHERS:
+        return stream.StreamWriter(key, file_, cipher, header=header)
+    else:
+        raise ValueError('Unsupported cipher: {}'.format(cipher))
+
+
+def memory_cost(nbytes, streamed=True):
+    """Estimates peak memory used to encrypt or decrypt a partition.
+
+    Stream partitions hold a few frames at a time, Fernet partitions are held
+    whole alongside their base64 token.
+
+    Args:
+        nbytes: int partition size
+        streamed: bool - False for legacy Fernet partitions
+
+    Returns:
+        int bytes
+    """
+
+    return 4 * stream.FRAME_SIZE if streamed else 3 * nbytes
+
+
+def encrypted_size(file_, nbytes, header_size=0):
+    """Byte length of a complete encrypted partition in the format of file_.
+
+    Args:
+        file_: readable, seekable binary file object of a stream or Fernet
+            partition, positioned at its start
+        nbytes: int plaintext length of payload
+        header_size: int plaintext length of metadata block
+
+    Returns:
+        int bytes
+    """
+
+    if stream.is_stream(file_):
+        return stream.stream_size(nbytes, header_size, stream.frame_size(file_))
+
+    # [version][timestamp][iv][padded ciphertext][hmac], base64 encoded
+    token = 1 + 8 + 16 + 16 * ((header_size + nbytes) // 16 + 1) + 32
+    return 4 * -(-token // 3)
+
+
+def decryptor(key, file_):
+    """Wraps readable binary file object in a decrypting reader.
+
+    Stream partitions are decrypted one frame at a time as they are read.
+    Legacy Fernet partitions are decrypted whole on open.
+
+    Args:
+        key: str or bytes - encryption key
+        file_: binary file object opened for reading
+
+    Returns:
+        file-like object with read
+
+    Raises:
+        any of decrypt_errors() if file_ cannot be authenticated with key
+    """
+
+    if stream.is_stream(file_):
+        return stream.StreamReader(key, file_)
+    else:
+        return io.BytesIO(fernet(key).decrypt(file_.read()))
 
 
 def batch_decrypt(key, paths, outdir):
+    """Decrypts partition files, detecting stream or legacy Fernet format.
+
+    Args:
+        key: str or bytes - encryption key
+        paths: iterable of encrypted filepaths
+        outdir: str directory path
+
+    Returns:
+        list of decrypted filepaths - empty str where decryption failed
+    """
 
     def random_filename():
         while True:
             yield os.path.join(outdir, token_urlsafe(8))
 
-    fernet = Fernet(key)
+    token_cipher = fernet(key)
     decrypted_paths = []
 
     def decrypt_file(fp_in, fp_out):
         with open(fp_out, 'wb') as outfile:
             with open(fp_in, 'rb') as infile:
                 try:
-                    token = fernet.decrypt(infile.read())
-                    outfile.write(token)
-                except InvalidToken:
+                    if stream.is_stream(infile):
+                        reader = stream.StreamReader(key, infile)
+                        data = reader.read(stream.FRAME_SIZE)
+                        while data:
+                            outfile.write(data)
+                            data = reader.read(stream.FRAME_SIZE)
+                    else:
+                        token = token_cipher.decrypt(infile.read())
+                        outfile.write(token)
+                except decrypt_errors():
                     fp_out = ''
 
         return fp_out
@@ -98,15 +489,32 @@ def batch_decrypt(key, paths, outdir):
     return decrypted_paths
 
 
-def batch_encrypt(key, paths, outdir):
+def batch_encrypt(key, paths, outdir, cipher=DEFAULT_CIPHER):
+    """Encrypts partition files.
+
+    Args:
+        key: str or bytes - encryption key
+        paths: iterable of filepaths to encrypt
+        outdir: str directory path
+        cipher: str - 'fernet' for legacy format or stream cipher name
 
-    fernet = Fernet(key)
+    Returns:
+        list of encrypted filepaths
+    """
+
+    if cipher not in CIPHERS:
+        raise ValueError('Unsupported cipher: {}'.format(cipher))
+
+    token_cipher = fernet(key)
     outpaths = []
 
     def encrypt_file(fp_in, fp_out):
+        if cipher != 'fernet':
+            return stream.encrypt_file(key, fp_in, fp_out, cipher)
+
         with open(fp_out, 'wb') as outfile:
             with open(fp_in, 'rb') as infile:
-                outfile.write(fernet.encrypt(infile.read()))
+                outfile.write(token_cipher.encrypt(infile.read()))
 
         return fp_out
 
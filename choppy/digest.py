@@ -0,0 +1,127 @@
+#! usr/bin/env/ python3
+
+"""
+Hash algorithms for partition digests and the tree hash of a partitioned file.
+
+Each data partition payload is hashed into a leaf digest. The file digest is
+the root of a binary hash tree over the leaf digests in index order:
+
+    leaf = H(0x00 || payload)
+    node = H(0x01 || left || right)
+
+An odd node at the end of a level is promoted to the next level unchanged.
+"""
+
+from collections import namedtuple
+import hashlib
+import zlib
+
+# ------------------------------------------------------------------------------
+DEFAULT_HASH = 'blake2b'
+CHUNK_ID_SIZE = 16
+
+LEAF = b'\x00'
+NODE = b'\x01'
+
+
+class CRC32:
+    """Minimal hashlib style wrapper around zlib.crc32 - a fast checksum for
+    detecting accidental corruption, not tampering."""
+
+    digest_size = 4
+
+    def __init__(self):
+        self._crc = 0
+
+
+    def update(self, data):
+        self._crc = zlib.crc32(data, self._crc)
+
+
+    def digest(self):
+        return self._crc.to_bytes(4, 'big')
+
+
+HASHES = {
+    'md5': (1, hashlib.md5),
+    'sha256': (2, hashlib.sha256),
+    'blake2b': (3, lambda: hashlib.blake2b(digest_size=32)),
+    'crc32': (4, CRC32),
+    }
+
+HASH_IDS = {v[0]: k for k, v in HASHES.items()}
+
+
+class DigestMismatch(ValueError):
+    """Raised when a partition payload does not match its recorded digest."""
+
+
+TreeDigest = namedtuple('TreeDigest', ('name', 'root', 'parts', 'chunks', 'members'))
+TreeDigest.__new__.__defaults__ = (None, None)
+TreeDigest.__doc__ = """File digest from a manifest partition.
+
+    name: str hash algorithm name
+    root: bytes tree hash root
+    parts: tuple of bytes leaf digest for each data partition
+    chunks: tuple of bytes chunk id for each content defined partition,
+        None if partitions belong to the manifest group
+    members: tuple of (str filename, int byte length) for each file packed
+        into the group, None if the group holds one file
+    """
+
+
+# ------------------------------------------------------------------------------
+def new(name):
+    """Returns new hash object for algorithm name."""
+
+    if name not in HASHES:
+        raise ValueError('Unsupported hash: {}'.format(name))
+    return HASHES[name][1]()
+
+
+def new_leaf(name):
+    """Returns new hash object for a partition payload leaf digest."""
+
+    hasher = new(name)
+    hasher.update(LEAF)
+    return hasher
+
+
+def chunk_id(data):
+    """Returns stable identity of a content defined partition payload."""
+
+    return hashlib.blake2b(data, digest_size=CHUNK_ID_SIZE, person=b'choppy-chunk').digest()
+
+
+def tree_root(name, digests):
+    """Computes tree hash root from leaf digests in index order.
+
+    Args:
+        name: str hash algorithm name
+        digests: iterable of bytes leaf digests
+
+    Returns:
+        bytes root digest
+    """
+
+    level = list(digests)
+    if not level:
+        return new_leaf(name).digest()
+
+    while len(level) > 1:
+        parents = []
+        for ix in range(0, len(level) - 1, 2):
+            hasher = new(name)
+            hasher.update(NODE + level[ix] + level[ix + 1])
+            parents.append(hasher.digest())
+        if len(level) % 2:
+            parents.append(level[-1])
+        level = parents
+
+    return level[0]
+
+
+def verify_tree(tree):
+    """Checks the leaf digests of a TreeDigest produce its root."""
+
+    return tree_root(tree.name, tree.parts) == tree.root
@@ -5,20 +5,24 @@ Choppy merge functions.
 """
 
 from collections import defaultdict
-from itertools import groupby
+import hashlib
+import io
+from itertools import accumulate, chain, groupby
 from operator import itemgetter
 import os
-import tempfile
+import struct
 
-from choppy.crypto import batch_decrypt, md5_hash
-from choppy import util
+from choppy.catalog import MISS, open_catalog
+from choppy.crypto import decrypt_errors, decryptor, memory_cost
+from choppy.store import chunk_path, contains, remove_unreferenced
+from choppy.stream import is_stream
+from choppy import codec, digest, parallel, parity, util
 
 # ------------------------------------------------------------------------------
-def load_paths(paths):
-    """Loads files and checks for valid metadata block.
+def read_legacy_metadata(file_):
+    """Reads remainder of a legacy metadata block after the fingerprint.
 
-    Chopped partition files start with a 16 byte fingerprint.
-    Metadata format:
+    Legacy metadata format:
         [fingerprint][group id hash][index total] ||
         [read next][encoded filename][read next][file hash] ||
         [index][read next][byte len of partition]
@@ -27,145 +31,985 @@ def load_paths(paths):
         [2][read value][2][read value]
         [2][2][read value]
 
+    Returns:
+        read_metadata result or None if not a partition
+    """
+
+    seek = 16
+
+    group_id = util.read_exact(file_, 16)
+    seek += 16
+
+    ix_tot = util.decode_uint16(util.read_exact(file_, 2))
+    seek += 2
+
+    read_next = util.decode_uint16(util.read_exact(file_, 2))
+    seek += 2
+    filename = util.read_exact(file_, read_next).decode('utf-8')
+    seek += read_next
+
+    read_next = util.decode_uint16(util.read_exact(file_, 2))
+    seek += 2
+    if read_next % 16:
+        return None
+    filehash = util.read_exact(file_, read_next)
+    seek += read_next
+
+    ix = util.decode_uint16(util.read_exact(file_, 2))
+    seek += 2
+
+    read_next = util.decode_uint16(util.read_exact(file_, 2))
+    seek += 2
+    if not read_next:
+        return None
+    nbytes = util.decode_uint(util.read_exact(file_, read_next))
+    seek += read_next
+
+    group_key = (ix_tot, group_id, filename, filehash)
+    return group_key, ix, seek, nbytes, 'none'
+
+
+def read_metadata(file_):
+    """Reads metadata block from start of a readable partition stream.
+
+    Chopped partition files start with a 16 byte fingerprint, either the
+    legacy fingerprint (see read_legacy_metadata) or the versioned layout.
+    Metadata format:
+        [fingerprint][version][kind][codec id][group id][index][index total] ||
+        [read next][byte len of partition]
+
+        [16][1][1][1][16][4][4]
+        [2][read value]
+
+    Versions 1 and 2 store index and index total as 2 byte fields, versions
+    before 4 have no codec id and uncompressed payloads. The byte len of
+    partition is the payload length before compression.
+
+    Manifest partitions follow with:
+        [read next][encoded filename] ||
+        [hash id][read next][tree root][partition digests]
+
+        [2][read value]
+        [1][2][read value][index total * len(tree root)]
+
+    Version 1 manifests store an MD5 of the whole file instead:
+        [read next][encoded filename][read next][file hash]
+
+    Chunk manifests of content defined partitions add the chunk id of each
+    partition in index order:
+        [index total * 16]
+
+    Pack manifests of small files packed into one group add the filename and
+    byte length of each file in payload order:
+        [member count][read next][encoded filename][byte len of file] ...
+
+        [4][2][read value][8] ...
+
+    The file hash of a version 2 or later group key is a digest.TreeDigest.
+
+    Data partitions only know their group id and index total, the filename
+    and file hash of the group key are None until joined with the manifest.
+    Data partitions of a stream have an index total of 0.
+    Chunk partitions have an index total of 0 and their chunk id as group id.
+    Parity partitions follow the manifest at indices after the index total.
+
     Arg:
-        paths: iterable of filepaths
+        file_: binary file-like object positioned at start of partition
 
     Returns:
-        dict of filepaths grouped by matching metadata blocks
+        tuple (group key, index, seek, nbytes, codec) or None if not a partition
+        group key: tuple (index total, group id, filename, file hash)
+        seek: int byte length of metadata block
+        codec: str name of payload codec in codec.CODECS
     """
 
-    metadata = defaultdict(list)
+    fingerprint = file_.read(16)
+    if fingerprint == util.CFP:
+        return read_legacy_metadata(file_)
+    elif fingerprint != util.CFPV:
+        return None
 
-    for fp in paths:
-        with open(fp, 'rb') as file_ix:
+    seek = 16
 
-            seek = 0
+    version, kind = util.read_exact(file_, 2)
+    seek += 2
+    if version not in util.LAYOUT_VERSIONS:
+        return None
 
-            fingerprint = file_ix.read(16)
-            seek += 16
-            if fingerprint != util.CFP:
-                continue
+    codec_name = 'none'
+    if version >= 4:
+        codec_id = util.read_exact(file_, 1)[0]
+        seek += 1
+        if codec_id not in codec.CODEC_IDS:
+            return None
+        codec_name = codec.CODEC_IDS[codec_id]
 
-            group_id = file_ix.read(16)
-            seek += 16
+    group_id = util.read_exact(file_, 16)
+    seek += 16
 
-            ix_tot = util.decode_uint16(file_ix.read(2))
-            seek += 2
+    ix_width = 2 if version < 3 else 4
 
-            read_next = util.decode_uint16(file_ix.read(2))
-            seek += 2
-            filename = file_ix.read(read_next).decode('utf-8')
-            seek += read_next
+    ix = util.decode_uint(util.read_exact(file_, ix_width))
+    seek += ix_width
 
-            read_next = util.decode_uint16(file_ix.read(2))
+    ix_tot = util.decode_uint(util.read_exact(file_, ix_width))
+    seek += ix_width
+
+    read_next = util.decode_uint16(util.read_exact(file_, 2))
+    seek += 2
+    if not read_next:
+        return None
+    nbytes = util.decode_uint(util.read_exact(file_, read_next))
+    seek += read_next
+
+    filename, filehash = None, None
+
+    if kind in (util.KIND_MANIFEST, util.KIND_CHUNK_MANIFEST, util.KIND_PACK_MANIFEST):
+        read_next = util.decode_uint16(util.read_exact(file_, 2))
+        seek += 2
+        filename = util.read_exact(file_, read_next).decode('utf-8')
+        seek += read_next
+
+        if version == 1:
+            read_next = util.decode_uint16(util.read_exact(file_, 2))
             seek += 2
-            if read_next % 16:
-                continue
-            filehash = file_ix.read(read_next)
+            filehash = util.read_exact(file_, read_next)
             seek += read_next
 
-            ix = util.decode_uint16(file_ix.read(2))
-            seek += 2
+        else:
+            hash_id = util.read_exact(file_, 1)[0]
+            seek += 1
+            if hash_id not in digest.HASH_IDS:
+                return None
 
-            read_next = util.decode_uint16(file_ix.read(2))
+            read_next = util.decode_uint16(util.read_exact(file_, 2))
             seek += 2
-            nbytes = util.decode_uint(file_ix.read(read_next))
+            root = util.read_exact(file_, read_next)
             seek += read_next
 
-            group_key = (ix_tot, group_id, filename, filehash)
-            metadata[group_key].append((ix, seek, nbytes, fp))
+            parts = util.read_exact(file_, read_next * ix_tot)
+            seek += read_next * ix_tot
+            parts = tuple(parts[i:i + read_next] for i in range(0, len(parts), read_next))
+
+            chunks = None
+            if kind == util.KIND_CHUNK_MANIFEST:
+                read_next = digest.CHUNK_ID_SIZE
+                chunks = util.read_exact(file_, read_next * ix_tot)
+                seek += read_next * ix_tot
+                chunks = tuple(chunks[i:i + read_next] for i in range(0, len(chunks), read_next))
+
+            members = None
+            if kind == util.KIND_PACK_MANIFEST:
+                members = []
+                n_members = util.decode_uint32(util.read_exact(file_, 4))
+                seek += 4
+                for _ in range(n_members):
+                    read_next = util.decode_uint16(util.read_exact(file_, 2))
+                    seek += 2
+                    member = util.read_exact(file_, read_next).decode('utf-8')
+                    seek += read_next
+                    members.append((member, util.decode_uint64(util.read_exact(file_, 8))))
+                    seek += 8
+                members = tuple(members)
+
+            filehash = digest.TreeDigest(
+                digest.HASH_IDS[hash_id], root, parts, chunks, members)
+
+    elif kind not in (util.KIND_DATA, util.KIND_CHUNK, util.KIND_PARITY):
+        return None
+
+    group_key = (ix_tot, group_id, filename, filehash)
+    return group_key, ix, seek, nbytes, codec_name
+
+
+def read_path_metadata(fp, key=None):
+    """Reads metadata block of a single partition file.
+
+    Arg:
+        fp: str filepath
+        key: cryptographic key for encrypted partitions, None for plaintext
+
+    Returns:
+        read_metadata result or None if fp is not a usable partition
+    """
+
+    with open(fp, 'rb') as file_ix:
+        try:
+            reader = decryptor(key, file_ix) if key else file_ix
+            return read_metadata(reader)
+        except decrypt_errors() + (struct.error, UnicodeDecodeError):
+            return None
+
+
+def read_paths(paths, key=None, executor=None, catalog=None):
+    """Reads metadata blocks of files, through the catalog if given.
+
+    Only the separately authenticated header record holding the metadata
+    block of encrypted partitions is decrypted, payload frames are not read.
+    Legacy Fernet partitions must be decrypted whole.
+
+    With a catalog, files with unchanged size and mtime are not opened and
+    the metadata of all other files is added to the catalog.
+
+    Arg:
+        paths: iterable of filepaths
+        key: cryptographic key for encrypted partitions, None for plaintext
+        executor: optional concurrent.futures executor for reading files
+        catalog: optional catalog.Catalog of previously read metadata
+
+    Returns:
+        dict of filepath to read_metadata result or None
+    """
+
+    path_meta = {}
+    stats = {}
+
+    for fp in paths:
+        if catalog is not None and fp not in stats:
+            stats[fp] = os.stat(fp)
+            meta = catalog.lookup(fp, stats[fp])
+            if meta is not MISS:
+                path_meta[fp] = meta
+
+    unread = [fp for fp in dict.fromkeys(paths) if fp not in path_meta]
+    tasks = ((fp, key) for fp in unread)
+
+    for fp, meta in zip(unread, parallel.bounded_map(read_path_metadata, tasks, executor)):
+        path_meta[fp] = meta
+        if catalog is not None:
+            catalog.store(fp, stats[fp], meta)
+
+    if catalog is not None:
+        catalog.commit()
+
+    return path_meta
+
+
+def manifest_chunks(meta):
+    """Returns chunk ids listed by a chunk manifest, empty for other metadata."""
+
+    filehash = meta[0][3] if meta else None
+    if isinstance(filehash, digest.TreeDigest) and filehash.chunks is not None:
+        return filehash.chunks
+    return ()
+
+
+def load_paths(paths, key=None, executor=None, catalog=None, store=None):
+    """Loads files and checks for valid metadata block.
+
+    Chunk partitions listed by a chunk manifest but not found in paths are
+    looked up in the store.
+
+    Arg:
+        paths: iterable of filepaths
+        key: cryptographic key for encrypted partitions, None for plaintext
+        executor: optional concurrent.futures executor for reading files
+        catalog: optional catalog.Catalog of previously read metadata
+        store: optional str directory path of a content addressed store
+
+    Returns:
+        dict of filepaths grouped by matching metadata blocks
+    """
+
+    metadata = defaultdict(list)
+    data_parts = defaultdict(list)
+
+    paths = tuple(paths)
+    path_meta = read_paths(paths, key, executor, catalog)
+
+    if store is not None:
+        chunk_ids = set(chain.from_iterable(map(manifest_chunks, path_meta.values())))
+        store_paths = [chunk_path(store, chunk_id, key) for chunk_id in chunk_ids]
+        store_paths = [fp for fp in store_paths if fp not in path_meta and os.path.isfile(fp)]
+        path_meta.update(read_paths(store_paths, key, executor, catalog))
+        paths += tuple(store_paths)
+
+    for fp in paths:
+        meta = path_meta[fp]
+        if meta:
+            group_key, ix, seek, nbytes, codec_name = meta
+            if group_key[2] is None:
+                data_parts[group_key[:2]].append((ix, seek, nbytes, fp, codec_name))
+            else:
+                metadata[group_key].append((ix, seek, nbytes, fp, codec_name))
+
+    # data partitions join the group of their manifest, chunk partitions
+    # join every group listing their chunk id
+    for group_key, metapaths in metadata.items():
+        filehash = group_key[3]
+        if isinstance(filehash, digest.TreeDigest) and filehash.chunks is not None:
+            for ix, chunk_id in enumerate(filehash.chunks):
+                for _, seek, nbytes, fp, codec_name in data_parts.get((0, chunk_id), ())[:1]:
+                    metapaths.append((ix, seek, nbytes, fp, codec_name))
+        else:
+            metapaths.extend(data_parts.get(group_key[:2], ()))
+            # stream data partitions do not know the index total
+            metapaths.extend(data_parts.get((0, group_key[1]), ()))
 
     return metadata
 
 
-def find_valid_path_groups(paths):
+def is_complete(tot, metapaths):
+    """Checks partition metadata covers every index of a group.
+
+    Parity partitions after the index total are not required.
+
+    Args:
+        tot: int index total of group
+        metapaths: iterable of partition metadata tuples starting with index
+
+    Returns:
+        bool
+    """
+
+    indices = sorted(set(meta[0] for meta in metapaths if meta[0] <= tot))
+    return indices in ([i for i in range(tot)], [i for i in range(tot + 1)])
+
+
+def is_rebuildable(tot, metapaths, tree=None):
+    """Checks a group has its manifest and a parity partition for each
+    missing data partition, so rebuild_missing can rebuild it.
+
+    Args:
+        tot: int index total of group
+        metapaths: iterable of partition metadata tuples starting with index
+        tree: digest.TreeDigest of the group manifest
+
+    Returns:
+        bool
+    """
+
+    present = set(meta[0] for meta in metapaths)
+    missing = sum(1 for ix in range(tot) if ix not in present)
+    nparity = sum(1 for ix in present if ix > tot)
+    return tot in present and isinstance(tree, digest.TreeDigest) and nparity >= missing
+
+
+def rebuild_missing(tot, metapaths, key=None, tree=None):
+    """Rebuilds missing data partitions of a group from its parity partitions.
+
+    Every data partition still present is read once and up to one parity
+    partition per missing partition is read into memory. Rebuilt payloads
+    are verified against the tree and kept in memory in place of their
+    filepath.
+
+    Args:
+        tot: int index total of group
+        metapaths: iterable of partition metadata tuples, one per index
+        key: cryptographic key for encrypted partitions, None for plaintext
+        tree: digest.TreeDigest of the group manifest
+
+    Returns:
+        list of partition metadata tuples with missing data partitions as
+        parity.Rebuilt or None if the group cannot be rebuilt
+
+    Raises:
+        digest.DigestMismatch if a rebuilt payload does not match the tree
+    """
+
+    present = {meta[0]: meta for meta in metapaths}
+    missing = [ix for ix in range(tot) if ix not in present]
+    parity_paths = [meta for meta in metapaths if meta[0] > tot][:len(missing)]
+
+    if not is_rebuildable(tot, metapaths, tree):
+        return None
+
+    parities = {}
+    for ix, seek, nbytes, fp, codec_name in parity_paths:
+        payload = read_payload(fp, seek, nbytes, key, ix, tree, codec_name)
+        lengths, parities[ix - tot - 1] = parity.split_payload(payload, tot)
+
+    def blocks():
+        for ix, seek, nbytes, fp, codec_name in (present[i] for i in range(tot) if i in present):
+            file_ix, reader = open_partition(fp, seek, key, codec_name)
+            with file_ix:
+                offset = 0
+                while offset < nbytes:
+                    data = util.read_full(reader, min(util.COPY_SIZE, nbytes - offset))
+                    if not data:
+                        raise EOFError('Input ended {} bytes early'.format(nbytes - offset))
+                    yield ix, offset, data
+                    offset += len(data)
+
+    for ix, payload in zip(missing, parity.decode(parities, blocks(), missing)):
+        payload = parity.Rebuilt(ix, payload[:lengths[ix]])
+        hasher = digest.new_leaf(tree.name)
+        hasher.update(payload.payload)
+        check_digest(payload, ix, hasher, tree)
+        present[ix] = (ix, 0, lengths[ix], payload, 'none')
+
+    return [present[ix] for ix in sorted(present)]
+
+
+def find_valid_path_groups(paths, key=None, executor=None, catalog=None, store=None):
     """Inspects and validates path groups by metadata.
 
+    Groups in the versioned layout also include their manifest partition,
+    stored at index total with an empty payload. Incomplete groups with
+    enough parity partitions are rebuilt, see rebuild_missing. Parity
+    partitions are yielded with an empty payload so they are consumed with
+    the group.
+
     Arg:
         paths: iterable of filepaths with candidate partitions
+        key: cryptographic key for encrypted partitions, None for plaintext
+        executor: optional concurrent.futures executor for reading files
+        catalog: optional catalog.Catalog of previously read metadata
+        store: optional str directory path of a content addressed store
 
     Yields:
         tuple (str filename, input file hash, iterable of partition filepaths)
     """
 
     get_ix = itemgetter(0)
-    metadata = load_paths(paths)
+    metadata = load_paths(paths, key, executor, catalog, store)
 
     valid_keys = (k for k, v in metadata.items() if len(v) >= k[0])
 
-    for key in valid_keys:
-        tot, group_id, filename, filehash = key
-        metapaths = metadata[key]
-        if sorted(set(map(get_ix, metapaths))) == [i for i in range(tot)]:
-            metapaths.sort(key=get_ix)
+    for group_key in valid_keys:
+        tot, group_id, filename, filehash = group_key
+        metapaths = metadata[group_key]
+        metapaths.sort(key=get_ix)
 
-            if len(metapaths) == tot:
-                yield filename, filehash, metapaths
+        if len(metapaths) != len(set(map(get_ix, metapaths))):
+            metapaths = [next(group) for _, group in groupby(metapaths, get_ix)]
 
-            else:
-                filtered_paths = []
-                for _, group in groupby(metapaths, get_ix):
-                    fpaths = tuple(group)
-                    filtered_paths.append(fpaths[0])
+        if not is_complete(tot, metapaths):
+            try:
+                metapaths = rebuild_missing(tot, metapaths, key, filehash)
+            except decrypt_errors() + (EOFError, digest.DigestMismatch, codec.CorruptPayload):
+                metapaths = None
+            if metapaths is None:
+                continue
+
+        yield filename, filehash, [meta if meta[0] <= tot else meta[:2] + (0,) + meta[3:]
+                                   for meta in metapaths]
+
+
+def open_partition(fp, seek, key=None, codec_name='none'):
+    """Opens partition file positioned at the start of its payload.
 
-                yield filename, filehash, filtered_paths
+    Args:
+        fp: str filepath or parity.Rebuilt payload
+        seek: int byte length of metadata block
+        key: cryptographic key for encrypted partitions, None for plaintext
+        codec_name: str name of payload codec in codec.CODECS
+
+    Returns:
+        tuple (opened file object, reader of decompressed payload)
+    """
 
+    if isinstance(fp, parity.Rebuilt):
+        file_ix = io.BytesIO(fp.payload)
+        return file_ix, file_ix
+
+    file_ix = open(fp, 'rb')
+    if key:
+        reader = decryptor(key, file_ix)
+        reader.read(seek)
+    else:
+        reader = file_ix
+        reader.seek(seek)
+
+    return file_ix, codec.wrap_reader(reader, codec_name)
+
+
+def check_digest(fp, ix, hasher, tree):
+    """Compares leaf digest of a copied payload to the manifest.
+
+    Raises:
+        digest.DigestMismatch
+    """
 
-def merge_partitions(meta_paths, fn):
-    """Recreates original input file from decrypted file partitions.
+    if hasher.digest() != tree.parts[ix]:
+        raise digest.DigestMismatch('Partition digest mismatch: {}'.format(fp))
+
+
+def write_payload(fp, seek, nbytes, key, fn, offset, ix=None, tree=None, codec_name='none'):
+    """Writes the payload of one partition into the output file at offset.
+
+    Args:
+        fp: str partition filepath
+        seek: int byte length of metadata block
+        nbytes: int payload length
+        key: cryptographic key for encrypted partitions, None for plaintext
+        fn: str filepath of existing output file
+        offset: int position of payload in output file
+        ix: int partition index
+        tree: optional digest.TreeDigest to verify the payload against
+        codec_name: str name of payload codec in codec.CODECS
+
+    Returns:
+        str partition filepath
+
+    Raises:
+        digest.DigestMismatch if payload does not match the tree
+    """
+
+    verify = tree is not None and ix < len(tree.parts)
+    hasher = digest.new_leaf(tree.name) if verify else None
+
+    file_ix, reader = open_partition(fp, seek, key, codec_name)
+    with file_ix, open(fn, 'r+b') as outfile:
+        writer = util.PositionalWriter(outfile, offset)
+        util.copy_bytes(reader, writer, nbytes, hasher=hasher)
+
+    if verify:
+        check_digest(fp, ix, hasher, tree)
+
+    return fp
+
+
+def read_payload(fp, seek, nbytes, key=None, ix=None, tree=None, codec_name='none'):
+    """Reads the payload of one partition into memory.
+
+    Args:
+        fp: str partition filepath
+        seek: int byte length of metadata block
+        nbytes: int payload length
+        key: cryptographic key for encrypted partitions, None for plaintext
+        ix: int partition index
+        tree: optional digest.TreeDigest to verify the payload against
+        codec_name: str name of payload codec in codec.CODECS
+
+    Returns:
+        bytes payload
+
+    Raises:
+        digest.DigestMismatch if payload does not match the tree
+    """
+
+    verify = tree is not None and ix < len(tree.parts)
+    hasher = digest.new_leaf(tree.name) if verify else None
+    payload = io.BytesIO()
+
+    file_ix, reader = open_partition(fp, seek, key, codec_name)
+    with file_ix:
+        util.copy_bytes(reader, payload, nbytes, hasher=hasher)
+
+    if verify:
+        check_digest(fp, ix, hasher, tree)
+
+    return payload.getvalue()
+
+
+def verify_payload(fp, seek, nbytes, key=None, ix=None, tree=None, codec_name='none'):
+    """Checks the payload of one partition against the tree without keeping
+    or writing it.
+
+    Returns:
+        str partition filepath
+
+    Raises:
+        digest.DigestMismatch if payload does not match the tree
+    """
+
+    if tree is None or ix >= len(tree.parts):
+        return fp
+
+    hasher = digest.new_leaf(tree.name)
+    file_ix, reader = open_partition(fp, seek, key, codec_name)
+    with file_ix:
+        util.copy_bytes(reader, util.NullWriter(), nbytes, hasher=hasher)
+
+    check_digest(fp, ix, hasher, tree)
+    return fp
+
+
+def verify_cost(fp, seek, nbytes, key=None, ix=None, tree=None, codec_name='none'):
+    """Estimated memory used by verify_payload."""
+
+    return payload_cost(fp, seek, nbytes, key, None, 0, codec_name=codec_name)
+
+
+def read_cost(fp, seek, nbytes, key=None, ix=None, tree=None, codec_name='none'):
+    """Estimated memory used by read_payload, including the payload."""
+
+    return nbytes + payload_cost(fp, seek, nbytes, key, None, 0, codec_name=codec_name)
+
+
+def payload_cost(fp, seek, nbytes, key, fn, offset, ix=None, tree=None, codec_name='none'):
+    """Estimated memory used by write_payload for bounding work in flight,
+    including decompressor state."""
+
+    if isinstance(fp, parity.Rebuilt):
+        return nbytes
+
+    state = codec.memory_cost(codec_name, decompress=True)
+    if not key:
+        return util.COPY_SIZE + state
+
+    with open(fp, 'rb') as file_ix:
+        return memory_cost(nbytes, streamed=is_stream(file_ix)) + state
+
+
+def merge_partitions(meta_paths, fn, key=None, hasher=None, executor=None,
+                     max_inflight=parallel.DEFAULT_MAX_INFLIGHT, tree=None):
+    """Recreates original input file from file partitions.
+
+    Each partition payload is written at its final position in the output
+    as it is read, so encrypted partitions are decrypted straight into the
+    output file. With an executor, the output is preallocated at its final
+    size and payloads are written concurrently with positional writes at
+    offsets computed from the metadata. With an executor and a hasher,
+    payloads are decrypted concurrently but hashed and written in order, so
+    the output is never re-read to hash it.
+
+    With a tree, each payload is checked against its digest in the manifest
+    as soon as it is written, by the worker that wrote it.
 
     Arg:
-        meta_paths: dict of sorted iterable of partition file paths
+        meta_paths: sorted iterable of tuple (index, seek, nbytes, filepath,
+            codec name) for each partition
         fn: str filepath out
+        key: cryptographic key for encrypted partitions, None for plaintext
+        hasher: optional hashlib object updated with the reassembled bytes
+        executor: optional concurrent.futures executor for writing payloads
+        max_inflight: int - cap in bytes on estimated memory of partitions
+            being decrypted at once
+        tree: optional digest.TreeDigest to verify payloads against
 
     Yields:
-        str filepath for merged file
+        str filepath of each consumed partition
+
+    Raises:
+        digest.DigestMismatch if a payload does not match the tree
     """
 
+    if executor is not None and hasher is not None:
+        tasks = ((fp, seek, nbytes, key, ix, tree, codec_name)
+                 for ix, seek, nbytes, fp, codec_name in meta_paths)
+        payloads = parallel.bounded_map(read_payload, tasks, executor, max_inflight, read_cost)
+
+        with open(fn, 'wb') as outfile:
+            for meta, payload in zip(meta_paths, payloads):
+                hasher.update(payload)
+                outfile.write(payload)
+                yield meta[3]
+        return
+
+    if executor is not None:
+        offsets = accumulate(chain((0,), (meta[2] for meta in meta_paths)))
+        tasks = [(fp, seek, nbytes, key, fn, offset, ix, tree, codec_name)
+                 for (ix, seek, nbytes, fp, codec_name), offset in zip(meta_paths, offsets)]
+
+        util.preallocate(fn, sum(task[2] for task in tasks))
+
+        yield from parallel.bounded_map(
+            write_payload, tasks, executor, max_inflight, payload_cost)
+        return
+
     with open(fn, 'wb') as outfile:
-        for _, seek, nbytes, fp in meta_paths:
-            with open(fp, 'rb') as file_ix:
-                file_ix.seek(seek)
-                outfile.write(file_ix.read(nbytes))
+        for ix, seek, nbytes, fp, codec_name in meta_paths:
+            verify = tree is not None and ix < len(tree.parts)
+            part_hasher = digest.new_leaf(tree.name) if verify else hasher
+
+            file_ix, reader = open_partition(fp, seek, key, codec_name)
+            with file_ix:
+                util.copy_bytes(reader, outfile, nbytes, hasher=part_hasher)
+
+            if verify:
+                check_digest(fp, ix, part_hasher, tree)
 
             yield fp
 
 
-def merge(filepaths, outdir):
-    """Merges groups of valid partitions and confirms reassembled file is
-        identical to original input file.
+def merge_pack(meta_paths, outdir, key=None, executor=None,
+               max_inflight=parallel.DEFAULT_MAX_INFLIGHT, tree=None):
+    """Extracts each file packed into a group from its partitions.
 
-    Args:
-        filepaths: iterable of str filepaths to merge
+    Payloads are read into memory and verified in index order, then split
+    into the member files listed by the manifest.
+
+    Arg:
+        meta_paths: sorted iterable of tuple (index, seek, nbytes, filepath,
+            codec name) for each partition
         outdir: directory output path
+        key: cryptographic key for encrypted partitions, None for plaintext
+        executor: optional concurrent.futures executor for reading payloads
+        max_inflight: int - cap in bytes on estimated memory of partitions
+            being read at once
+        tree: digest.TreeDigest of a pack manifest
 
     Returns:
-        status: iterable of bool corresponding to filepath in new_files
-        new_files: iterable of filepaths for all files reassembled
-        used_files: iterable of filepaths to consumed partitions
+        tuple (list of str member filepaths, list of consumed partition
+        filepaths)
+
+    Raises:
+        digest.DigestMismatch if a payload does not match the tree
+        ValueError if the manifest lists a filename twice
     """
 
-    valid_groups = tuple(find_valid_path_groups(filepaths))
+    filenames = [fn for fn, _ in tree.members]
+    if len(set(filenames)) != len(filenames):
+        raise ValueError('Pack manifest lists duplicate filenames')
 
-    status = []
-    new_files = []
-    used_files = []
+    members = [(os.path.join(outdir, fn), nbytes) for fn, nbytes in tree.members]
+    tasks = ((fp, seek, nbytes, key, ix, tree, codec_name)
+             for ix, seek, nbytes, fp, codec_name in meta_paths)
 
-    if not valid_groups:
-        print('> No partitions to merge from {} files'.format(len(filepaths)))
+    with util.SplitWriter(members) as writer:
+        for payload in parallel.bounded_map(read_payload, tasks, executor, max_inflight,
+                                            read_cost):
+            writer.write(payload)
+
+    return [member[0] for member in members], [meta[3] for meta in meta_paths]
+
+
+def group_status(filepaths, key=None, workers=1, catalog=None, store=None):
+    """Summarizes partition groups found in filepaths without merging.
+
+    Args:
+        filepaths: iterable of str filepaths with candidate partitions
+        key: cryptographic key for encrypted partitions, None for plaintext
+        workers: int number of workers - 0 or None uses all cores
+        catalog: optional str filepath of SQLite catalog to read and update
+        store: optional str directory path of a content addressed store
+
+    A group missing data partitions is rebuildable when merge can rebuild
+    them from its parity partitions, see is_rebuildable.
+
+    Returns:
+        list of tuple (str filename, int partitions found, int index total,
+        str state - 'complete', 'rebuildable' or 'incomplete')
+    """
+
+    summary = []
+
+    with parallel.pool(workers, threads=not key) as executor, \
+            open_catalog(catalog, key) as cat:
+        metadata = load_paths(filepaths, key, executor, cat, store)
+
+    for (tot, _, filename, filehash), metapaths in metadata.items():
+        found = len(set(meta[0] for meta in metapaths if meta[0] < tot))
+        if is_complete(tot, metapaths):
+            state = 'complete'
+        elif is_rebuildable(tot, metapaths, filehash):
+            state = 'rebuildable'
+        else:
+            state = 'incomplete'
+        summary.append((filename, found, tot, state))
+
+    return summary
+
+
+def merge_stream(filepaths, outfile, key=None, workers=1,
+                 max_inflight=parallel.DEFAULT_MAX_INFLIGHT, catalog=None, store=None):
+    """Streams one reassembled file to a writable file object such as stdout.
+
+    Payloads are written in index order. Each payload is read into memory
+    and verified against its digest before any of it is written, so only
+    verified data reaches outfile. With workers > 1 the following partitions
+    are read while earlier ones are written, memory is bounded by
+    max_inflight plus one partition.
+
+    Args:
+        filepaths: iterable of str filepaths with partitions of one file
+        outfile: writable binary file object, e.g. sys.stdout.buffer
+        key: cryptographic key for encrypted partitions, None for plaintext
+        workers: int number of workers - 0 or None uses all cores
+        max_inflight: int - cap in bytes on estimated memory of partitions
+            being read at once
+        catalog: optional str filepath of SQLite catalog to read and update
+        store: optional str directory path of a content addressed store to
+            resolve chunk partitions through
+
+    Returns:
+        str filename of the streamed file
+
+    Raises:
+        ValueError if filepaths do not hold exactly one complete group
+        digest.DigestMismatch or a decryption error if a partition is invalid,
+            outfile then holds the verified partitions before it
+    """
+
+    with parallel.pool(workers, threads=not key) as executor:
+        with open_catalog(catalog, key) as cat:
+            valid_groups = tuple(
+                find_valid_path_groups(filepaths, key, executor, cat, store))
+
+        if len(valid_groups) != 1:
+            raise ValueError('Expected one complete partition group, found {}'.format(
+                len(valid_groups)))
+
+        filename, filehash, valid_paths = valid_groups[0]
+
+        if isinstance(filehash, digest.TreeDigest) and filehash.members is not None:
+            raise ValueError('Packed group holds {} files'.format(len(filehash.members)))
+
+        if isinstance(filehash, digest.TreeDigest):
+            tree, hasher = filehash, None
+            if not digest.verify_tree(tree):
+                raise digest.DigestMismatch('Manifest root mismatch')
+        else:
+            tree, hasher = None, hashlib.md5()
+
+        tasks = ((fp, seek, nbytes, key, ix, tree, codec_name)
+                 for ix, seek, nbytes, fp, codec_name in valid_paths)
+
+        for payload in parallel.bounded_map(read_payload, tasks, executor, max_inflight,
+                                            read_cost):
+            if hasher:
+                hasher.update(payload)
+            outfile.write(payload)
+
+    if hasher and hasher.digest() != filehash:
+        raise digest.DigestMismatch('File hash mismatch: {}'.format(filename))
+
+    return filename
+
+
+def verify(filepaths, key=None, workers=1, max_inflight=parallel.DEFAULT_MAX_INFLIGHT,
+           catalog=None, store=None):
+    """Checks partition groups reassemble to their original files without
+    writing any output.
+
+    Partitions with a tree digest manifest are hashed as they are decrypted,
+    in parallel when workers > 1, without being held in memory. Older
+    layouts are hashed in order as an MD5 of the whole file.
+
+    Args:
+        filepaths: iterable of str filepaths with candidate partitions
+        key: cryptographic key for encrypted partitions, None for plaintext
+        workers: int number of workers - 0 or None uses all cores
+        max_inflight: int - cap in bytes on estimated memory of partitions
+            being decrypted at once
+        catalog: optional str filepath of SQLite catalog to read and update
+        store: optional str directory path of a content addressed store to
+            resolve chunk partitions through
+
+    Returns:
+        list of tuple (str filename, bool verified) for each complete group
+    """
+
+    results = []
+
+    with parallel.pool(workers, threads=not key) as executor:
+        with open_catalog(catalog, key) as cat:
+            valid_groups = tuple(
+                find_valid_path_groups(filepaths, key, executor, cat, store))
 
-    else:
         for filename, filehash, valid_paths in valid_groups:
-            filepath = os.path.join(outdir, filename)
+            tree = filehash if isinstance(filehash, digest.TreeDigest) else None
+            tasks = ((fp, seek, nbytes, key, ix, tree, codec_name)
+                     for ix, seek, nbytes, fp, codec_name in valid_paths)
+
+            try:
+                if tree:
+                    if not digest.verify_tree(tree):
+                        raise digest.DigestMismatch('Manifest root mismatch')
+                    for _ in parallel.bounded_map(
+                            verify_payload, tasks, executor, max_inflight, verify_cost):
+                        pass
+                    verified = True
+                else:
+                    hasher = hashlib.md5()
+                    for payload in parallel.bounded_map(
+                            read_payload, tasks, executor, max_inflight, read_cost):
+                        hasher.update(payload)
+                    verified = hasher.digest() == filehash
+            except decrypt_errors() + (EOFError, digest.DigestMismatch, codec.CorruptPayload):
+                verified = False
+
+            results.append((filename, verified))
+
+    return results
+
+
+def merge(filepaths, outdir, key=None, workers=1,
+          max_inflight=parallel.DEFAULT_MAX_INFLIGHT, catalog=None, store=None,
+          progress=None):
+    """Merges groups of valid partitions and confirms reassembled file is
+        identical to original input file.
 
-            partition_files = tuple(merge_partitions(valid_paths, filepath))
-            merge_status = md5_hash(filepath) == filehash
+    Partitions with a tree digest manifest are verified one by one as they
+    are written, in parallel when workers > 1, and the reassembled file is
+    never re-read. Older layouts store an MD5 of the whole file, which is
+    updated in order as the file is written. Encrypted partitions are
+    decrypted in a process pool, plaintext partitions are copied by a thread
+    pool. Each file packed into a shared group is extracted to its own
+    filepath in new_files.
+
+    Args:
+        filepaths: iterable of str filepaths to merge
+        outdir: directory output path
+        key: cryptographic key for encrypted partitions, None for plaintext
+        workers: int number of workers - 0 or None uses all cores
+        max_inflight: int - cap in bytes on estimated memory of partitions
+            being decrypted at once
+        catalog: optional str filepath of SQLite catalog to read and update
+        store: optional str directory path of a content addressed store to
+            resolve chunk partitions through
+        progress: optional function called with a parallel.Partition event
+            as each partition is merged and a parallel.Merged event as each
+            file is reassembled
 
-            status.append(merge_status)
-            new_files.append(filepath)
+    Returns:
+        status: iterable of bool corresponding to filepath in new_files
+        new_files: iterable of filepaths for all files reassembled
+        used_files: iterable of filepaths to consumed partitions, chunk
+            partitions in the store are never consumed
+    """
 
-            if merge_status:
-                used_files.extend(partition_files)
+    with parallel.pool(workers, threads=not key) as executor:
+        with open_catalog(catalog, key) as cat:
+            valid_groups = tuple(
+                find_valid_path_groups(filepaths, key, executor, cat, store))
+
+        status = []
+        new_files = []
+        used_files = []
+        kept_files = set()
+
+        if not valid_groups:
+            print('> No partitions to merge from {} files'.format(len(filepaths)))
+
+        else:
+            for filename, filehash, valid_paths in valid_groups:
+                filepaths_out = [os.path.join(outdir, filename)]
+
+                if isinstance(filehash, digest.TreeDigest):
+                    tree, hasher = filehash, None
+                else:
+                    tree, hasher = None, hashlib.md5()
+
+                try:
+                    if tree and not digest.verify_tree(tree):
+                        raise digest.DigestMismatch('Manifest root mismatch')
+                    if tree and tree.members is not None:
+                        filepaths_out, partition_files = merge_pack(
+                            valid_paths, outdir, key, executor, max_inflight, tree)
+                        partition_files = tuple(parallel.report(
+                            partition_files, None, progress))
+                    else:
+                        partition_files = tuple(parallel.report(merge_partitions(
+                            valid_paths, filepaths_out[0], key, hasher, executor,
+                            max_inflight, tree), filepaths_out[0], progress))
+                except decrypt_errors() + (EOFError, digest.DigestMismatch, codec.CorruptPayload):
+                    partition_files = ()
+                    merge_status = False
+                else:
+                    merge_status = bool(tree) or hasher.digest() == filehash
+
+                status.extend([merge_status] * len(filepaths_out))
+                new_files.extend(filepaths_out)
+
+                if progress is not None:
+                    for fp_out in filepaths_out:
+                        progress(parallel.Merged(fp_out, merge_status))
+
+                if merge_status:
+                    used_files.extend(partition_files)
+                else:
+                    kept_files.update(meta[3] for meta in valid_paths)
+
+    # chunk partitions may be shared within and between files, rebuilt
+    # partitions have no file
+    used_files = [fp for fp in dict.fromkeys(used_files)
+                  if fp not in kept_files and not isinstance(fp, parity.Rebuilt)]
+
+    if store is not None:
+        used_files = [fp for fp in used_files if not contains(store, fp)]
 
     return status, new_files, used_files
 
@@ -187,36 +1031,76 @@ def remove(filepaths):
             print('> Unable to remove file: {}'.format(fp))
 
 
-def decrypt_merge(filepaths, outdir, key):
+def decrypt_merge(filepaths, outdir, key, workers=1,
+                  max_inflight=parallel.DEFAULT_MAX_INFLIGHT, catalog=None, store=None,
+                  progress=None):
     """Decrypts, merges valid files, and removes used partition files.
 
+    Partitions are decrypted directly into the reassembled output file,
+    no plaintext partition copies are written. Merging through a store
+    removes nothing, so stored versions can be restored again.
+
     Arg:
         filepaths: iterable of str filepaths to merge
         outdir: directory output path
         key: cryptographic key for decrypting input files
+        workers: int number of processes - 0 or None uses all cores
+        max_inflight: int - cap in bytes on estimated memory of partitions
+            being decrypted at once
+        catalog: optional str filepath of SQLite catalog to read and update,
+            removed partitions are dropped from the catalog
+        store: optional str directory path of a content addressed store to
+            resolve chunk partitions through
+        progress: optional function called with parallel.Partition and
+            parallel.Merged events, see merge
 
     Returns:
         status: iterable of bool corresponding to filepath in new_files
         dec_files: iterable of filepaths for all files reassembled
     """
 
-    status = []
-    dec_files = []
+    status, dec_files, used_part_files = merge(
+        filepaths, outdir, key, workers, max_inflight, catalog, store, progress)
 
-    with tempfile.TemporaryDirectory() as tmpdir:
-        decrypted_paths = batch_decrypt(key, filepaths, tmpdir)
-        candidates = [fp for fp in decrypted_paths if fp]
+    if store is not None:
+        used_part_files = []
 
-        mrg_status, new_files, used_part_files = merge(candidates, outdir)
-        status.extend(mrg_status)
-        dec_files.extend(new_files)
+    remove(used_part_files)
 
-        trash_files = []
+    with open_catalog(catalog, key) as cat:
+        if cat is not None:
+            cat.forget(used_part_files)
 
-        for enc_fp, dec_fp in zip(filepaths, decrypted_paths):
-            if dec_fp in used_part_files:
-                trash_files.append(enc_fp)
+    return status, dec_files
 
-        remove(trash_files)
 
-    return status, dec_files
+def prune_store(store, manifest_paths, key=None, workers=1, catalog=None):
+    """Removes chunk partitions from a store that no manifest refers to.
+
+    Every manifest still in use must be given, chunks listed only by
+    unreadable or missing manifests are removed.
+
+    Args:
+        store: str directory path of a content addressed store
+        manifest_paths: iterable of str filepaths of manifests to keep
+        key: cryptographic key for encrypted partitions, None for plaintext
+        workers: int number of workers - 0 or None uses all cores
+        catalog: optional str filepath of SQLite catalog to read and update
+
+    Returns:
+        list of removed filepaths
+    """
+
+    referenced = set()
+
+    with parallel.pool(workers, threads=not key) as executor, \
+            open_catalog(catalog, key) as cat:
+        for meta in read_paths(manifest_paths, key, executor, cat).values():
+            referenced.update(chunk_path(store, chunk_id, key)
+                              for chunk_id in manifest_chunks(meta))
+
+        removed = remove_unreferenced(store, referenced)
+        if cat is not None:
+            cat.forget(removed)
+
+    return removed
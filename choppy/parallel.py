@@ -0,0 +1,122 @@
+#! usr/bin/env/ python3
+
+"""
+Worker pool helpers for processing partitions concurrently.
+"""
+
+from collections import deque, namedtuple
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+import os
+
+# ------------------------------------------------------------------------------
+DEFAULT_MAX_INFLIGHT = 2**30
+MAX_PENDING = 256
+
+# progress events - filename is the input file when chopping, None for packs
+# of small files, and the reassembled file when merging
+Partition = namedtuple('Partition', ('filename', 'path'))
+Merged = namedtuple('Merged', ('filename', 'status'))
+
+
+def resolve_workers(workers):
+    """Converts user worker count to a usable int - 0 or None uses all cores."""
+
+    if not workers:
+        return os.cpu_count() or 1
+    return max(1, workers)
+
+
+@contextmanager
+def pool(workers=1, threads=False):
+    """Context manager providing a worker pool or None for serial use.
+
+    An existing executor passed as workers is yielded as is and left running,
+    so long running callers can share one pool between calls.
+
+    Args:
+        workers: int number of workers - 0 or None uses all cores, or a
+            concurrent.futures executor to share
+        threads: bool - use threads instead of processes for I/O bound tasks
+
+    Yields:
+        concurrent.futures executor or None if workers == 1
+    """
+
+    if isinstance(workers, Executor):
+        yield workers
+        return
+
+    workers = resolve_workers(workers)
+    pool_type = ThreadPoolExecutor if threads else ProcessPoolExecutor
+
+    if workers > 1:
+        with pool_type(max_workers=workers) as executor:
+            yield executor
+    else:
+        yield None
+
+
+def bounded_map(func, tasks, executor=None, max_inflight=DEFAULT_MAX_INFLIGHT,
+                cost=None):
+    """Maps func over argument tuples, yielding results in task order.
+
+    Tasks are submitted while the summed cost of unfinished tasks stays below
+    max_inflight. At least one task is always submitted so a single task
+    larger than max_inflight still runs. If the generator is closed early,
+    tasks not yet started are cancelled and closing returns once running
+    tasks finish, so no task writes after the generator is closed.
+
+    Args:
+        func: picklable module level function
+        tasks: iterable of argument tuples for func
+        executor: concurrent.futures executor or None to run serially
+        max_inflight: int - cap on summed cost of unfinished tasks
+        cost: function called with task arguments returning int cost,
+            typically estimated bytes of memory used by the task
+
+    Yields:
+        return value of func for each task
+    """
+
+    if executor is None:
+        for args in tasks:
+            yield func(*args)
+        return
+
+    pending = deque()
+    inflight = 0
+
+    try:
+        for args in tasks:
+            task_cost = cost(*args) if cost else 0
+
+            while pending and (inflight + task_cost > max_inflight or
+                               len(pending) >= MAX_PENDING):
+                future, done_cost = pending.popleft()
+                inflight -= done_cost
+                yield future.result()
+
+            pending.append((executor.submit(func, *args), task_cost))
+            inflight += task_cost
+
+        while pending:
+            future, _ = pending.popleft()
+            yield future.result()
+
+    finally:
+        # closed early, e.g. on error or cancellation - drop tasks not started
+        # and wait for running ones, their results and errors are discarded
+        for future, _ in pending:
+            future.cancel()
+        wait([future for future, _ in pending])
+
+
+def report(paths, filename, progress=None):
+    """Passes through partition filepaths, calling progress with a Partition
+    event for each."""
+
+    for path in paths:
+        if progress is not None:
+            progress(Partition(filename, path))
+        yield path
@@ -0,0 +1,227 @@
+#! usr/bin/env/ python3
+
+"""
+Reed-Solomon parity partitions for rebuilding missing data partitions.
+
+Parity is computed over GF(2^8) with a Cauchy matrix: parity partition j is
+the sum over data partitions i of coef(j, i) * payload i, with payloads
+zero padded to the longest. Any square submatrix of a Cauchy matrix is
+invertible, so any m <= k missing data partitions are rebuilt from m of k
+parity partitions and the data partitions still present. A group with
+parity holds at most MAX_SYMBOLS - k data partitions.
+
+Parity payload format:
+    [index total * byte len of data partition][parity bytes]
+
+    [index total * 8][len of longest data partition]
+
+Products with a constant use a 256 byte translation table, sums are XOR,
+vectorized with NumPy when installed.
+"""
+
+from functools import lru_cache
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from choppy import util
+
+# ------------------------------------------------------------------------------
+GF_POLY = 0x11d
+MAX_SYMBOLS = 256
+READ_SIZE = 2**18
+
+GF_EXP = [0] * 512
+GF_LOG = [0] * 256
+
+_x = 1
+for _i in range(255):
+    GF_EXP[_i] = _x
+    GF_LOG[_x] = _i
+    _x <<= 1
+    if _x & 0x100:
+        _x ^= GF_POLY
+for _i in range(255, 512):
+    GF_EXP[_i] = GF_EXP[_i - 255]
+del _x, _i
+
+
+def gf_mul(a, b):
+    if not a or not b:
+        return 0
+    return GF_EXP[GF_LOG[a] + GF_LOG[b]]
+
+
+def gf_inv(a):
+    if not a:
+        raise ZeroDivisionError('0 has no inverse in GF(2^8)')
+    return GF_EXP[255 - GF_LOG[a]]
+
+
+@lru_cache(maxsize=None)
+def mul_table(c):
+    """Returns bytes translation table multiplying every byte by c."""
+
+    return bytes(gf_mul(c, x) for x in range(256))
+
+
+def coefficient(j, i):
+    """Cauchy matrix coefficient of data partition i in parity partition j."""
+
+    return gf_inv((MAX_SYMBOLS - 1 - j) ^ i)
+
+
+def max_data_partitions(nparity):
+    """Max number of data partitions in a group with nparity partitions."""
+
+    return MAX_SYMBOLS - nparity
+
+
+def scale(c, data):
+    """Multiplies every byte of data by c."""
+
+    if c == 1:
+        return data
+    return bytes(data).translate(mul_table(c))
+
+
+def xor_into(acc, data, offset=0):
+    """XORs bytes-like data into bytearray acc at offset, in place."""
+
+    n = len(data)
+    if not n:
+        return
+    if np is not None:
+        view = np.frombuffer(acc, dtype=np.uint8)[offset:offset + n]
+        np.bitwise_xor(view, np.frombuffer(data, dtype=np.uint8), out=view)
+    else:
+        block = int.from_bytes(acc[offset:offset + n], 'big') ^ int.from_bytes(data, 'big')
+        acc[offset:offset + n] = block.to_bytes(n, 'big')
+
+
+def invert(matrix):
+    """Inverts a square matrix over GF(2^8) by Gauss-Jordan elimination.
+
+    Raises:
+        ValueError if matrix is singular
+    """
+
+    n = len(matrix)
+    rows = [list(row) + [int(r == c) for c in range(n)] for r, row in enumerate(matrix)]
+
+    for col in range(n):
+        pivot = next((r for r in range(col, n) if rows[r][col]), None)
+        if pivot is None:
+            raise ValueError('Singular parity matrix')
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+
+        inv = gf_inv(rows[col][col])
+        rows[col] = [gf_mul(inv, v) for v in rows[col]]
+
+        for r in range(n):
+            if r != col and rows[r][col]:
+                f = rows[r][col]
+                rows[r] = [v ^ gf_mul(f, p) for v, p in zip(rows[r], rows[col])]
+
+    return [row[n:] for row in rows]
+
+
+# ------------------------------------------------------------------------------
+def encode(file_, lengths, nparity):
+    """Computes parity payloads for consecutive data partitions of a file.
+
+    Memory use is nparity times the longest data partition.
+
+    Args:
+        file_: readable binary file object positioned at the first partition
+        lengths: sequence of int byte lengths of data partitions
+        nparity: int number of parity partitions
+
+    Returns:
+        list of bytearray parity payloads
+
+    Raises:
+        ValueError if there are too many data partitions for nparity
+    """
+
+    if len(lengths) > max_data_partitions(nparity):
+        raise ValueError('Too many partitions for {} parity partitions: {}'.format(
+            nparity, len(lengths)))
+
+    table = b''.join(util.encode_uint64(n) for n in lengths)
+    width = max(lengths, default=0)
+    parities = [bytearray(width) for _ in range(nparity)]
+
+    for i, nbytes in enumerate(lengths):
+        pos = 0
+        while pos < nbytes:
+            block = util.read_full(file_, min(READ_SIZE, nbytes - pos))
+            if not block:
+                raise EOFError('Input ended {} bytes early'.format(nbytes - pos))
+            for j, acc in enumerate(parities):
+                xor_into(acc, scale(coefficient(j, i), block), pos)
+            pos += len(block)
+
+    return [bytearray(table) + acc for acc in parities]
+
+
+def split_payload(payload, tot):
+    """Splits a parity payload into data partition lengths and parity bytes.
+
+    Returns:
+        tuple (tuple of int lengths, memoryview of parity bytes)
+    """
+
+    view = memoryview(payload)
+    lengths = tuple(util.decode_uint64(view[i:i + 8]) for i in range(0, 8 * tot, 8))
+    return lengths, view[8 * tot:]
+
+
+def decode(parities, blocks, missing):
+    """Rebuilds missing data partitions.
+
+    Args:
+        parities: dict of int parity index to parity bytes, at least
+            len(missing) entries
+        blocks: iterable of tuple (int data index, int offset, bytes) covering
+            every data partition not in missing
+        missing: sequence of int data indices to rebuild
+
+    Returns:
+        list of bytearray padded payloads in order of missing
+    """
+
+    rows = sorted(parities)[:len(missing)]
+    residuals = {j: bytearray(parities[j]) for j in rows}
+
+    for i, offset, block in blocks:
+        for j in rows:
+            xor_into(residuals[j], scale(coefficient(j, i), block), offset)
+
+    inverse = invert([[coefficient(j, i) for i in missing] for j in rows])
+    width = len(parities[rows[0]]) if rows else 0
+    rebuilt = []
+
+    for coefs in inverse:
+        acc = bytearray(width)
+        for c, j in zip(coefs, rows):
+            if c:
+                xor_into(acc, scale(c, residuals[j]))
+        rebuilt.append(acc)
+
+    return rebuilt
+
+
+class Rebuilt:
+    """Payload of a data partition rebuilt in memory from parity, used in
+    place of the filepath of a missing partition."""
+
+    def __init__(self, ix, payload):
+        self.ix = ix
+        self.payload = bytes(payload)
+
+
+    def __repr__(self):
+        return '<rebuilt partition {}>'.format(self.ix)
@@ -2,12 +2,32 @@
 
 """
 Functions for calculating and randomizing partition sizes.
+
+Content defined chunking finds partition boundaries with a gear rolling hash
+over the last GEAR_WINDOW bytes, so boundaries move with the content around
+them and an insertion or deletion only changes the partitions it touches.
+Boundaries are tested once a partition reaches the min size, with a stricter
+mask below the average size and a looser mask above it (normalized chunking),
+and forced at the max size.
 """
 
-from itertools import compress
-from random import choice as rand_choice
-from random import randint, shuffle
+import hashlib
+from random import Random
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 # ------------------------------------------------------------------------------
+GEAR_WINDOW = 32
+GEAR_MASK = 2**32 - 1
+GEAR = tuple(
+    int.from_bytes(hashlib.blake2b(bytes([i]), digest_size=4).digest(), 'big')
+    for i in range(256))
+
+MIN_CHUNK_SIZE = 2 * GEAR_WINDOW
+CHUNK_READ_SIZE = 2**22
 
 
 def byte_lengths(n_bytes, n_partitions):
@@ -28,55 +48,307 @@ def byte_lengths(n_bytes, n_partitions):
     return tuple(byte_reads)
 
 
-def wobbler(byte_reads, percent):
-    """Randomizes byte read amounts.
+def part_count(n_bytes, part_size):
+    """Calculates number of partitions needed so none exceeds part_size.
+
+    Args:
+        n_bytes: int - total file size in bytes
+        part_size: int - max partition size in bytes
+
+    Returns:
+        int >= 1
+    """
+
+    if part_size < 1:
+        raise ValueError('Partition size must be positive: {}'.format(part_size))
+
+    return max(1, -(-n_bytes // part_size))
+
+
+def pack_bins(sizes, pack_size):
+    """Groups items into bins of at most pack_size bytes.
+
+    Bins are filled next fit in input order, so files from the same directory
+    stay together. Items of pack_size or more get a bin of their own.
+
+    Args:
+        sizes: iterable of int item sizes in bytes
+        pack_size: int target bin size in bytes
+
+    Returns:
+        list of lists of int indices into sizes
+    """
+
+    if pack_size < 1:
+        raise ValueError('Pack size must be positive: {}'.format(pack_size))
+
+    bins = []
+    total = 0
+    for ix, size in enumerate(sizes):
+        if not bins or total + size > pack_size:
+            bins.append([])
+            total = 0
+        bins[-1].append(ix)
+        total += size
+
+    return bins
+
+
+def wobble_bounds(byte_reads, percent):
+    """Calculates inclusive bounds for randomized byte read amounts.
+
+    Args:
+        byte_reads: sequence of ints
+        percent: int or float < 1
+
+    Returns:
+        tuple (int min, int max)
+    """
+
+    if percent > 1:
+        percent /= 100
+
+    ave = sum(byte_reads) // len(byte_reads)
+    delta = int(ave * percent)
+    return ave - delta, ave + delta
+
+
+def wobbler(byte_reads, percent, seed=None, vectorize=False):
+    """Randomizes byte read amounts in linear time.
+
+    Partitions are shuffled into pairs once. Each pair moves a random number
+    of bytes from one partition to the other, limited so both stay within
+    percent of the average size. The sum is unchanged by construction.
 
     Args:
         byte_reads: iterable of ints
         percent: int or float < 1
+        seed: optional int for reproducible sizes
+        vectorize: bool - use NumPy when installed, seeded results then
+            differ from the pure Python path
 
     Returns:
         iterable of ints with sum == sum of byte_reads
     """
 
+    byte_reads = tuple(byte_reads)
+    if len(byte_reads) < 2:
+        return byte_reads
+
+    min_v, max_v = wobble_bounds(byte_reads, percent)
+    if min_v == max_v:
+        return byte_reads
+
+    if vectorize and np is not None:
+        return _wobbler_numpy(byte_reads, min_v, max_v, seed)
+
+    rng = Random(seed)
     rdlist = list(byte_reads)
+    indices = list(range(len(rdlist)))
+    rng.shuffle(indices)
 
-    if percent > 1:
-        percent /= 100
+    for ix, rx in zip(indices[0::2], indices[1::2]):
+        lo = min(rdlist[ix] - min_v, max_v - rdlist[rx])
+        hi = min(max_v - rdlist[ix], rdlist[rx] - min_v)
+        offset = rng.randint(-lo, hi)
+        rdlist[ix] += offset
+        rdlist[rx] -= offset
 
-    ave = sum(rdlist) // len(rdlist)
-    delta = int(ave * percent)
-    min_v, max_v = (ave - delta, ave + delta)
-    in_bounds = lambda x: min_v <= x <= max_v
+    return tuple(rdlist)
+
+
+def _wobbler_numpy(byte_reads, min_v, max_v, seed=None):
+    rng = np.random.RandomState(seed)
+    rdlist = np.array(byte_reads, dtype=np.int64)
+    indices = rng.permutation(len(rdlist))
+
+    npairs = len(rdlist) // 2
+    ix, rx = indices[:npairs], indices[npairs:2 * npairs]
+
+    lo = np.minimum(rdlist[ix] - min_v, max_v - rdlist[rx])
+    hi = np.minimum(max_v - rdlist[ix], rdlist[rx] - min_v)
+    offset = np.floor(rng.random_sample(npairs) * (hi + lo + 1)).astype(np.int64) - lo
 
-    def random_offset():
-        return randint(1, delta) * rand_choice((-1, 1))
+    rdlist[ix] += offset
+    rdlist[rx] -= offset
 
-    indices = [i for i in range(len(rdlist))]
+    return tuple(rdlist.tolist())
 
-    def randomize_ix():
-        shuffle(indices)
 
-    for ix, n in enumerate(rdlist):
-        offset = random_offset()
+# ------------------------------------------------------------------------------
+def chunk_sizes(avg_size):
+    """Default min and max partition sizes for content defined chunking.
+
+    Args:
+        avg_size: int - target average partition size in bytes
+
+    Returns:
+        tuple (int min size, int avg size, int max size)
+    """
+
+    return max(MIN_CHUNK_SIZE, avg_size // 4), avg_size, avg_size * 4
+
+
+def chunk_masks(min_size, avg_size, max_size):
+    """Validates chunk sizes and returns boundary masks for the gear hash.
+
+    Masks test the high bits of the hash, which depend on the whole window.
+
+    Returns:
+        tuple (int mask below avg size, int mask above avg size)
+    """
+
+    if not MIN_CHUNK_SIZE <= min_size <= avg_size <= max_size:
+        raise ValueError('Invalid chunk sizes: {} {} {}'.format(min_size, avg_size, max_size))
+
+    bits = avg_size.bit_length() - 1
+    mask_s = (2**min(bits + 1, 32) - 1) << (32 - min(bits + 1, 32))
+    mask_l = (2**max(bits - 1, 1) - 1) << (32 - max(bits - 1, 1))
+    return mask_s, mask_l
+
+
+def _cut_python(view, start, min_size, avg_size, max_size, mask_s, mask_l):
+    n = len(view)
+    limit = min(start + max_size, n)
+    normal = min(start + avg_size, limit)
+    warm = min(start + min_size - 1, limit)
+
+    gear = GEAR
+    h = 0
+
+    for b in view[start + min_size - GEAR_WINDOW:warm]:
+        h = ((h << 1) + gear[b]) & GEAR_MASK
+
+    for pos, b in enumerate(view[warm:normal], warm):
+        h = ((h << 1) + gear[b]) & GEAR_MASK
+        if not h & mask_s:
+            return pos + 1
+
+    for pos, b in enumerate(view[normal:limit], normal):
+        h = ((h << 1) + gear[b]) & GEAR_MASK
+        if not h & mask_l:
+            return pos + 1
+
+    if limit == start + max_size:
+        return limit
+    return None
+
+
+def _candidates_numpy(data, mask_s, mask_l):
+    gear = _candidates_numpy.gear
+    if gear is None:
+        gear = _candidates_numpy.gear = np.array(GEAR, dtype=np.uint32)
+
+    g = gear[np.frombuffer(data, dtype=np.uint8)]
+    if len(g) < GEAR_WINDOW:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty
+
+    # hash over a window of 2w bytes from hashes over windows of w bytes:
+    # h2w[i] = (hw[i - w] << w) + hw[i]
+    h = g
+    width = 1
+    while width < GEAR_WINDOW:
+        h = (h[:-width] << np.uint32(width)) + h[width:]
+        width *= 2
 
-        if in_bounds(n + offset):
-            rdlist[ix] += offset
+    offset = GEAR_WINDOW - 1
+    cand_s = np.flatnonzero((h & np.uint32(mask_s)) == 0) + offset
+    cand_l = np.flatnonzero((h & np.uint32(mask_l)) == 0) + offset
+    return cand_s, cand_l
 
-            randomize_ix()
-            mask = (in_bounds(rdlist[rx] - offset) for rx in indices)
-            rand_ix = tuple(compress(indices, mask))
 
-            if len(rand_ix) > 1:
-                for rx in rand_ix:
-                    if rx != ix:
-                        break
-            else:
-                rx = ix
+_candidates_numpy.gear = None
 
-            rdlist[rx] -= offset
 
-    if sum(rdlist) == sum(byte_reads):
-        return tuple(rdlist)
+def _cut_numpy(cand_s, cand_l, n, start, min_size, avg_size, max_size):
+    k = np.searchsorted(cand_s, start + min_size - 1)
+    if k < len(cand_s) and cand_s[k] < min(start + avg_size, n):
+        return int(cand_s[k]) + 1
+
+    k = np.searchsorted(cand_l, start + avg_size)
+    if k < len(cand_l) and cand_l[k] < min(start + max_size, n):
+        return int(cand_l[k]) + 1
+
+    if start + max_size <= n:
+        return start + max_size
+    return None
+
+
+def chunk_lengths(data, min_size, avg_size, max_size, final=True, vectorize=True):
+    """Finds content defined partition boundaries in data.
+
+    Args:
+        data: bytes-like object
+        min_size: int - min partition size, at least MIN_CHUNK_SIZE
+        avg_size: int - target average partition size
+        max_size: int - max partition size
+        final: bool - data ends the input, otherwise a trailing partition
+            whose boundary depends on data not yet read is left out
+        vectorize: bool - use NumPy when installed, boundaries are the same
+            as the pure Python path
+
+    Returns:
+        list of int partition lengths
+    """
+
+    mask_s, mask_l = chunk_masks(min_size, avg_size, max_size)
+    view = memoryview(data).cast('B')
+    n = len(view)
+
+    if vectorize and np is not None:
+        cand_s, cand_l = _candidates_numpy(view, mask_s, mask_l)
+        cut_point = lambda start: _cut_numpy(
+            cand_s, cand_l, n, start, min_size, avg_size, max_size)
     else:
-        return byte_reads
+        cut_point = lambda start: _cut_python(
+            view, start, min_size, avg_size, max_size, mask_s, mask_l)
+
+    lengths = []
+    start = 0
+    while start < n:
+        cut = cut_point(start)
+        if cut is None:
+            if not final:
+                break
+            cut = n
+        lengths.append(cut - start)
+        start = cut
+
+    return lengths
+
+
+def chunker(file_, min_size, avg_size, max_size, vectorize=True):
+    """Splits a readable binary file into content defined partitions.
+
+    Memory use is bounded by a few times max_size.
+
+    Args:
+        file_: binary file-like object
+        min_size: int - min partition size, at least MIN_CHUNK_SIZE
+        avg_size: int - target average partition size
+        max_size: int - max partition size
+        vectorize: bool - use NumPy when installed
+
+    Yields:
+        bytes of each partition in order
+    """
+
+    read_size = max(4 * max_size, CHUNK_READ_SIZE)
+    buffer = bytearray()
+    eof = False
+
+    while not eof or buffer:
+        if not eof:
+            data = file_.read(read_size)
+            eof = not data
+            buffer.extend(data)
+
+        lengths = chunk_lengths(buffer, min_size, avg_size, max_size, eof, vectorize)
+
+        start = 0
+        with memoryview(buffer) as view:
+            for nbytes in lengths:
+                yield bytes(view[start:start + nbytes])
+                start += nbytes
+        del buffer[:start]
@@ -0,0 +1,147 @@
+#! usr/bin/env/ python3
+
+"""
+Random access to a chopped file without reassembling it.
+"""
+
+from bisect import bisect_right
+from collections import OrderedDict
+from itertools import accumulate
+import io
+import os
+
+from choppy.catalog import open_catalog
+from choppy.merge import find_valid_path_groups, read_payload
+from choppy import digest
+
+# ------------------------------------------------------------------------------
+DEFAULT_CACHE_SIZE = 4
+
+
+class PartitionReader(io.RawIOBase):
+    """Seekable, read only file-like object over the partitions of one file.
+
+    Partition offsets and lengths come from the metadata blocks, so a read
+    only decrypts the partitions overlapping the requested range. Each
+    partition is verified against its manifest digest when it is loaded and
+    the most recently used partitions are kept in an LRU cache, memory use
+    is up to cache_size times the partition size.
+
+    Args:
+        paths: iterable of str filepaths with partitions
+        key: cryptographic key for encrypted partitions, None for plaintext
+        filename: str filename of the group to read, needed if paths hold
+            more than one complete group
+        cache_size: int number of decrypted partitions to keep
+        catalog: optional str filepath of SQLite catalog to read and update
+        store: optional str directory path of a content addressed store to
+            resolve chunk partitions through
+
+    Raises:
+        ValueError if no single complete group matches
+        digest.DigestMismatch if the manifest is inconsistent
+    """
+
+    def __init__(self, paths, key=None, filename=None, cache_size=DEFAULT_CACHE_SIZE,
+                 catalog=None, store=None):
+        super().__init__()
+
+        with open_catalog(catalog, key) as cat:
+            groups = [group for group in find_valid_path_groups(paths, key, None, cat, store)
+                      if filename is None or group[0] == filename]
+
+        if len(groups) != 1:
+            raise ValueError('Expected one complete partition group, found {}'.format(
+                len(groups)))
+
+        self.name, filehash, meta_paths = groups[0]
+        self._tree = filehash if isinstance(filehash, digest.TreeDigest) else None
+
+        if self._tree and not digest.verify_tree(self._tree):
+            raise digest.DigestMismatch('Manifest root mismatch')
+
+        self._key = key
+        self._parts = [meta for meta in meta_paths if meta[2]]
+        self._starts = [0] + list(accumulate(meta[2] for meta in self._parts))
+        self._cache = OrderedDict()
+        self._cache_size = max(1, cache_size)
+        self._pos = 0
+
+
+    @property
+    def size(self):
+        """int length of the reassembled file."""
+
+        return self._starts[-1]
+
+
+    def readable(self):
+        return True
+
+
+    def seekable(self):
+        return True
+
+
+    def tell(self):
+        return self._pos
+
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            pos = offset
+        elif whence == os.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == os.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError('Invalid whence: {}'.format(whence))
+
+        if pos < 0:
+            raise ValueError('Negative seek position: {}'.format(pos))
+
+        self._pos = pos
+        return pos
+
+
+    def _partition(self, part_ix):
+        """Returns payload of partition at position part_ix, through the cache."""
+
+        if part_ix in self._cache:
+            self._cache.move_to_end(part_ix)
+            return self._cache[part_ix]
+
+        ix, seek, nbytes, fp, codec_name = self._parts[part_ix]
+        payload = read_payload(fp, seek, nbytes, self._key, ix, self._tree, codec_name)
+
+        self._cache[part_ix] = payload
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+
+        return payload
+
+
+    def readinto(self, buffer):
+        if self.closed:
+            raise ValueError('read from closed PartitionReader')
+
+        view = memoryview(buffer).cast('B')
+        copied = 0
+
+        while copied < len(view) and self._pos < self.size:
+            part_ix = bisect_right(self._starts, self._pos) - 1
+            payload = self._partition(part_ix)
+
+            start = self._pos - self._starts[part_ix]
+            nbytes = min(len(payload) - start, len(view) - copied)
+            view[copied:copied + nbytes] = payload[start:start + nbytes]
+
+            copied += nbytes
+            self._pos += nbytes
+
+        return copied
+
+
+    def close(self):
+        self._cache.clear()
+        super().close()
@@ -0,0 +1,444 @@
+#! usr/bin/env/ python3
+
+"""
+Long running worker daemon accepting chop and merge jobs on a Unix socket.
+
+The daemon pays interpreter startup, imports and key derivation once: jobs
+run on one shared worker pool, keys derived from passwords are kept in
+crypto.KEY_CACHE and AEAD / Fernet instances are reused across jobs with the
+same key.
+
+Protocol:
+    newline delimited JSON in both directions. Each request line is a job,
+    each job is answered with a started event, progress events as chop and
+    merge jobs write partitions and reassemble files, then a done or error
+    event. Events of concurrent jobs may interleave, they carry the job id.
+
+    {"id": 1, "command": "chop", "paths": ["/data/a.bin"], "outdir": "/out",
+     "keyfile": "/keys/key.txt", "part_size": "64M"}
+
+    {"id": 1, "event": "started"}
+    {"id": 1, "event": "partition", "filename": "/data/a.bin", "path": "/out/0.chp.0"}
+    ...
+    {"id": 1, "event": "done", "result": {"partitions": [...]}}
+
+    Merge jobs send a partition event for each partition merged and a
+    merged event with filename and status for each file reassembled. A job
+    whose client disconnects stops at its next progress event. Progress
+    events are not sent for jobs with "progress": false.
+
+Commands and result fields:
+    chop: partitions
+    merge: files, status
+    verify: results - list of {"filename", "verified"}
+    status: groups - list of {"filename", "found", "total", "complete"}
+
+Job fields mirror the command line options: paths, outdir, partitions,
+wobble, randfn, cipher, hash_algo, seed, part_size, chunk_size, store,
+catalog, compress, level, nparity, pack_size and max_inflight (MiB). Sizes
+are int bytes or str with K, M, G or T suffix. Keys are given by one of
+keyfile, key, password or passwordfile with salt (filepath), iterations,
+kdf and scrypt_cost, or no_encrypt. Filepaths are used as given, the client resolves them
+relative to its working directory.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import socketserver
+import stat
+import threading
+
+from choppy import crypto, parallel
+from choppy.digest import DEFAULT_HASH
+
+# ------------------------------------------------------------------------------
+DEFAULT_MAX_JOBS = 4
+DEFAULT_MAX_INFLIGHT = 1024
+PATH_FIELDS = ('outdir', 'keyfile', 'passwordfile', 'salt', 'store', 'catalog')
+
+def read_file(fp, mode='rb'):
+    with open(fp, mode) as infile:
+        return infile.read()
+
+
+def job_key(job):
+    """Returns key of job from its key options, None for no_encrypt.
+
+    Raises:
+        ValueError if job has no key options
+    """
+
+    if job.get('no_encrypt'):
+        return None
+
+    if job.get('key'):
+        return bytes(job['key'], 'utf-8')
+
+    if job.get('keyfile'):
+        return read_file(job['keyfile'])
+
+    if job.get('password') or job.get('passwordfile'):
+        if not job.get('salt'):
+            raise ValueError('salt file required for password use')
+
+        password = job.get('password') or read_file(job['passwordfile'], 'r').strip()
+        salt = read_file(job['salt'])
+
+        # concurrent jobs with the same password wait for one derivation,
+        # later jobs find the key in crypto.KEY_CACHE
+        return crypto.load_key(
+            password, salt, job.get('iterations', 100000),
+            job.get('kdf', crypto.DEFAULT_KDF), job.get('scrypt_cost', crypto.SCRYPT_COST))
+
+    raise ValueError('Job requires key, keyfile, password or passwordfile, or no_encrypt')
+
+
+def job_size(value):
+    """Converts int bytes or str size with unit suffix into int bytes."""
+
+    if value is None or isinstance(value, int):
+        return value
+
+    from choppy.user_options import parse_size
+    return parse_size(value)
+
+
+def progress_event(event):
+    """Converts a parallel.Partition or parallel.Merged event to a dict."""
+
+    if isinstance(event, parallel.Merged):
+        return {'event': 'merged', 'filename': event.filename, 'status': event.status}
+    return {'event': 'partition', 'filename': event.filename, 'path': event.path}
+
+
+def run_job(job, executor=None, max_inflight=DEFAULT_MAX_INFLIGHT, progress=None):
+    """Runs one job on executor.
+
+    Args:
+        job: dict with command, paths and options
+        executor: shared concurrent.futures executor or None to run serially
+        max_inflight: int - default cap in MiB on estimated memory of
+            partitions being processed at once
+        progress: optional function called with parallel.Partition and
+            parallel.Merged events of chop and merge jobs, exceptions it
+            raises stop the job
+
+    Returns:
+        dict result of command
+
+    Raises:
+        ValueError if command is unknown
+    """
+
+    command = job.get('command')
+    paths = job.get('paths', [])
+    outdir = job.get('outdir', os.getcwd())
+    key = job_key(job)
+
+    workers = executor or 1
+    inflight = job.get('max_inflight', max_inflight) * 2**20
+    catalog = job.get('catalog')
+    store = job.get('store')
+
+    if command == 'chop':
+        from choppy import partition
+        from choppy.chop import chop_encrypt
+
+        chunk_size = job_size(job.get('chunk_size'))
+        outpaths = chop_encrypt(
+            paths, outdir, key, job.get('partitions', 10), job.get('wobble', 0),
+            job.get('randfn', False), cipher=job.get('cipher', crypto.DEFAULT_CIPHER),
+            workers=workers, max_inflight=inflight,
+            hash_algo=job.get('hash_algo', DEFAULT_HASH), seed=job.get('seed'),
+            part_size=job_size(job.get('part_size')),
+            chunking=partition.chunk_sizes(chunk_size) if chunk_size else None,
+            store=store, compress=job.get('compress'), level=job.get('level'),
+            nparity=job.get('nparity', 0), pack_size=job_size(job.get('pack_size')),
+            progress=progress)
+
+        return {'partitions': outpaths}
+
+    elif command == 'merge':
+        from choppy.merge import decrypt_merge
+
+        status, filepaths = decrypt_merge(
+            paths, outdir, key, workers=workers, max_inflight=inflight,
+            catalog=catalog, store=store, progress=progress)
+
+        return {'files': filepaths, 'status': status}
+
+    elif command == 'verify':
+        from choppy.merge import verify
+
+        results = verify(paths, key, workers, inflight, catalog, store)
+        return {'results': [{'filename': fn, 'verified': ok} for fn, ok in results]}
+
+    elif command == 'status':
+        from choppy.merge import group_status
+
+        summary = group_status(paths, key, workers, catalog, store)
+        return {'groups': [{'filename': fn, 'found': found, 'total': tot,
+                            'complete': state == 'complete', 'state': state}
+                           for fn, found, tot, state in summary]}
+
+    raise ValueError('Unknown command: {}'.format(command))
+
+
+# ------------------------------------------------------------------------------
+class JobHandler(socketserver.StreamRequestHandler):
+    """Reads jobs of one connection and hands them to the server job threads,
+    events are written back as jobs progress."""
+
+    def handle(self):
+        lock = threading.Lock()
+        pending = []
+
+        def send(event):
+            data = bytes(json.dumps(event) + '\n', 'utf-8')
+            with lock:
+                self.wfile.write(data)
+                self.wfile.flush()
+
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                job = json.loads(line.decode('utf-8'))
+                if not isinstance(job, dict):
+                    raise ValueError('Job must be a JSON object')
+            except ValueError as e:
+                send({'id': None, 'event': 'error', 'error': 'Invalid job: {}'.format(e)})
+                continue
+
+            pending.append(self.server.jobs.submit(self.server.run, job, send))
+
+        for future in pending:
+            future.result()
+
+
+class JobServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unix socket server running jobs on a shared worker pool.
+
+    The socket file is created readable and writable by the owner only and is
+    removed when the server is closed.
+
+    Args:
+        socket_path: str filepath of the Unix socket
+        executor: concurrent.futures executor shared by all jobs or None
+        max_jobs: int number of jobs run at once
+        max_inflight: int - default cap in MiB on estimated memory of
+            partitions being processed at once per job
+
+    Raises:
+        FileExistsError if socket_path exists and is not a socket
+        OSError if another server is listening on socket_path
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, executor=None, max_jobs=DEFAULT_MAX_JOBS,
+                 max_inflight=DEFAULT_MAX_INFLIGHT):
+
+        remove_stale_socket(socket_path)
+
+        umask = os.umask(0o177)
+        try:
+            super().__init__(socket_path, JobHandler)
+        finally:
+            os.umask(umask)
+
+        self.socket_path = socket_path
+        self.executor = executor
+        self.max_inflight = max_inflight
+        self.jobs = ThreadPoolExecutor(max_workers=max(1, max_jobs))
+
+
+    def run(self, job, send):
+        """Runs job, sending started, progress and done or error events.
+
+        Sending fails once the client disconnects, which stops the job at
+        its next progress event.
+        """
+
+        job_id = job.get('id')
+
+        def progress(event):
+            send(dict(progress_event(event), id=job_id))
+
+        try:
+            send({'id': job_id, 'event': 'started'})
+            try:
+                result = run_job(job, self.executor, self.max_inflight,
+                                 progress if job.get('progress', True) else None)
+            except Exception as e:
+                send({'id': job_id, 'event': 'error', 'error': str(e) or type(e).__name__})
+            else:
+                send({'id': job_id, 'event': 'done', 'result': result})
+        except OSError:
+            pass  # client disconnected
+
+
+    def server_close(self):
+        super().server_close()
+        self.jobs.shutdown(wait=True)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+
+def remove_stale_socket(socket_path):
+    """Removes socket file left behind by a server that is no longer running."""
+
+    if not os.path.exists(socket_path):
+        return
+
+    if not stat.S_ISSOCK(os.stat(socket_path).st_mode):
+        raise FileExistsError('Not a socket: {}'.format(socket_path))
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except ConnectionRefusedError:
+            os.remove(socket_path)
+        else:
+            raise OSError('Server already listening on {}'.format(socket_path))
+
+
+def ignore_interrupt():
+    """Worker process initializer, Ctrl-C stops the daemon which then shuts
+    down its workers."""
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def serve(socket_path, workers=0, max_jobs=DEFAULT_MAX_JOBS,
+          max_inflight=DEFAULT_MAX_INFLIGHT):
+    """Serves jobs on socket_path until interrupted or terminated.
+
+    Worker processes are started by a fork server, forking the threaded
+    daemon itself is not safe.
+
+    Args:
+        socket_path: str filepath of the Unix socket
+        workers: int number of worker processes shared by all jobs - 0 or
+            None uses all cores
+        max_jobs: int number of jobs run at once
+        max_inflight: int - default cap in MiB on estimated memory of
+            partitions being processed at once per job
+    """
+
+    workers = parallel.resolve_workers(workers)
+    executor = None
+
+    if workers > 1:
+        executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context('forkserver'),
+            initializer=ignore_interrupt)
+
+    signal.signal(signal.SIGTERM, interrupt)
+
+    try:
+        with JobServer(socket_path, executor, max_jobs, max_inflight) as server:
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+    finally:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        if executor is not None:
+            executor.shutdown()
+
+
+# ------------------------------------------------------------------------------
+def resolve_paths(job, cwd=None):
+    """Returns copy of job with relative filepaths joined to cwd."""
+
+    cwd = cwd or os.getcwd()
+    job = dict(job)
+
+    for field in PATH_FIELDS:
+        if job.get(field):
+            job[field] = os.path.join(cwd, job[field])
+
+    if 'paths' in job:
+        job['paths'] = [os.path.join(cwd, fp) for fp in job['paths']]
+    if 'outdir' not in job:
+        job['outdir'] = cwd
+
+    return job
+
+
+def read_jobs(files):
+    """Reads JSON jobs, one per line, resolving filepaths and numbering jobs
+    without an id.
+
+    Args:
+        files: iterable of binary file objects
+
+    Yields:
+        dict jobs
+    """
+
+    job_id = 0
+    for file_ in files:
+        for line in file_:
+            if not line.strip():
+                continue
+            job_id += 1
+            job = json.loads(line.decode('utf-8'))
+            job.setdefault('id', job_id)
+            yield resolve_paths(job)
+
+
+def submit(socket_path, jobs):
+    """Sends jobs to a running server, yielding events as they arrive.
+
+    Jobs are sent from a separate thread, so events of finished jobs are read
+    while later jobs are still being sent.
+
+    Args:
+        socket_path: str filepath of the Unix socket
+        jobs: iterable of dict jobs
+
+    Yields:
+        dict events
+    """
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(socket_path)
+
+    def send_jobs():
+        try:
+            with sock.makefile('wb') as wfile:
+                for job in jobs:
+                    wfile.write(bytes(json.dumps(job) + '\n', 'utf-8'))
+        finally:
+            sock.shutdown(socket.SHUT_WR)
+
+    sender = threading.Thread(target=send_jobs, daemon=True)
+    sender.start()
+
+    with sock, sock.makefile('rb') as rfile:
+        for line in rfile:
+            yield json.loads(line.decode('utf-8'))
+
+    sender.join()
+
+
+def failed(event):
+    """Checks if event reports a failed job, a file that did not merge or a
+    group that did not verify."""
+
+    if event.get('event') == 'error':
+        return True
+    if event.get('event') == 'merged':
+        return not event['status']
+    results = event.get('result', {}).get('results', [])
+    return not all(result['verified'] for result in results)
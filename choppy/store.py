@@ -0,0 +1,123 @@
+#! usr/bin/env/ python3
+
+"""
+Content addressed store of chunk partitions.
+
+Store layout:
+    [root]/chunks/[2 character prefix]/[chunk filename]
+
+Chunk partitions are content defined partitions named by their chunk id,
+keyed by the encryption key when encrypted. Identical chunks of any file or
+version chopped into the store are written and encrypted once. Each chopped
+file gets a small manifest, written outside the store, listing its chunk ids.
+
+Chunks are written to a temporary file and renamed into place, so concurrent
+chops writing the same chunk each leave a complete partition and a crash
+never leaves a partial chunk under its chunk filename. Pruning removes
+temporary files only once they are older than TEMP_MAX_AGE, so writes of a
+chop running at the same time are left alone.
+"""
+
+import hashlib
+import os
+import time
+
+from choppy.util import is_temp
+
+# ------------------------------------------------------------------------------
+CHUNK_DIR = 'chunks'
+DEFAULT_CHUNK_SIZE = 2**22
+
+# seconds before a temporary file counts as left by an interrupted write
+TEMP_MAX_AGE = 3600
+
+
+def chunk_filename(chunk_id, key=None):
+    """Stable filename of a content defined partition.
+
+    Filenames of encrypted partitions are keyed so they do not reveal the
+    chunk id of the plaintext.
+
+    Args:
+        chunk_id: bytes from digest.chunk_id
+        key: str or bytes - encryption key, None for plaintext partitions
+
+    Returns:
+        str filename
+    """
+
+    if key:
+        if isinstance(key, str):
+            key = bytes(key, 'utf-8')
+        name = hashlib.blake2b(chunk_id, digest_size=16, key=key[:64]).hexdigest()
+    else:
+        name = chunk_id.hex()
+
+    return '{}.chp'.format(name)
+
+
+def chunk_path(root, chunk_id, key=None):
+    """Returns filepath of chunk_id in the store at root."""
+
+    fn = chunk_filename(chunk_id, key)
+    return os.path.join(root, CHUNK_DIR, fn[:2], fn)
+
+
+def chunk_paths(root, temp=False):
+    """Yields filepaths of every chunk partition in the store at root.
+
+    Args:
+        root: str directory path of store
+        temp: bool - yield temporary files of unfinished writes instead
+    """
+
+    for dirpath, _, filenames in os.walk(os.path.join(root, CHUNK_DIR)):
+        for fn in filenames:
+            if is_temp(fn) == temp:
+                yield os.path.join(dirpath, fn)
+
+
+def contains(root, fp):
+    """Checks fp is inside the store at root."""
+
+    root = os.path.abspath(root)
+    return os.path.commonpath((root, os.path.abspath(fp))) == root
+
+
+def remove_unreferenced(root, referenced, temp_max_age=TEMP_MAX_AGE):
+    """Removes chunk partitions no longer listed by any manifest, along with
+    temporary files left by interrupted writes.
+
+    Temporary files modified within temp_max_age seconds may belong to a
+    chop still writing to the store and are kept.
+
+    Args:
+        root: str directory path of store
+        referenced: iterable of chunk filepaths to keep
+        temp_max_age: int or float seconds - min age of removed temporary
+            files, 0 removes all of them
+
+    Returns:
+        list of removed filepaths
+    """
+
+    keep = set(map(os.path.abspath, referenced))
+    removed = []
+
+    for fp in chunk_paths(root):
+        if os.path.abspath(fp) not in keep:
+            os.remove(fp)
+            removed.append(fp)
+
+    cutoff = time.time() - temp_max_age
+    for fp in chunk_paths(root, temp=True):
+        try:
+            if os.stat(fp).st_mtime > cutoff:
+                continue
+            os.remove(fp)
+        except FileNotFoundError:
+            # renamed into place or removed by its writer meanwhile
+            continue
+        removed.append(fp)
+
+    return removed
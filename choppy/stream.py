@@ -0,0 +1,394 @@
+#! usr/bin/env/ python3
+
+"""
+Chunked authenticated encryption for partition files.
+
+Stream format:
+    [magic][version][cipher id][frame size][nonce prefix] ||
+    [header record length][header record] ||
+    [frame 0][frame 1] ... [final frame]
+
+    [4][1][1][4][7]
+    [4][read value]
+
+Every frame holds frame size bytes of plaintext followed by a 16 byte tag,
+except the final frame which may be shorter (or empty). Frame nonces are built
+from the nonce prefix, a uint32 frame counter and a final frame flag, so
+reordered, truncated or extended streams fail authentication. The stream header
+is passed as associated data for every frame.
+
+Version 2 streams carry a small header record (the partition metadata block)
+encrypted and authenticated on its own with a header flag in its nonce, so the
+metadata can be read without decrypting any payload frames. Version 1 streams
+have no header record. Readers present the header record followed by the frame
+plaintext as one continuous stream.
+
+Cipher ids:
+    1: AES-256-GCM
+    2: ChaCha20-Poly1305
+
+Memory use is bounded by the frame size regardless of partition size.
+"""
+
+import base64
+from functools import lru_cache
+import os
+import struct
+
+# ------------------------------------------------------------------------------
+MAGIC = b'\x89chp'
+VERSION = 2
+VERSIONS = (1, 2)
+
+FRAME_SIZE = 2**18
+MAX_FRAME_SIZE = 2**26
+MAX_RECORD_SIZE = 2**28
+TAG_SIZE = 16
+PREFIX_SIZE = 7
+KEY_CACHE_SIZE = 16
+
+HEADER = struct.Struct('>4sBBI{}s'.format(PREFIX_SIZE))
+NONCE = struct.Struct('>{}sIB'.format(PREFIX_SIZE))
+RECORD_LEN = struct.Struct('>I')
+
+FLAG_FRAME = 0
+FLAG_FINAL = 1
+FLAG_HEADER = 2
+
+CIPHERS = {
+    'aesgcm': (1, 'AESGCM'),
+    'chacha20': (2, 'ChaCha20Poly1305'),
+    }
+
+CIPHER_IDS = {v[0]: k for k, v in CIPHERS.items()}
+
+
+# ------------------------------------------------------------------------------
+class StreamHeaderError(ValueError):
+    """Raised when a partition does not start with a readable stream header."""
+
+
+def invalid_tag():
+    """Returns new cryptography.exceptions.InvalidTag, imported on first use."""
+
+    from cryptography.exceptions import InvalidTag
+    return InvalidTag()
+
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def aead_cipher(key, cipher):
+    """Returns AEAD instance of cipher keyed with the derived subkey of key.
+
+    Instances are cached so partitions encrypted with the same key skip
+    subkey derivation. cryptography is imported on first use, not when the
+    module is loaded.
+    """
+
+    from cryptography.hazmat.primitives.ciphers import aead
+    return getattr(aead, CIPHERS[cipher][1])(derive_key(key, cipher))
+
+
+def derive_key(key, cipher):
+    """Derives a cipher specific subkey from a Fernet formatted key.
+
+    Args:
+        key: str or bytes - urlsafe base64 encoded 32 byte key
+        cipher: str - name of cipher in CIPHERS
+
+    Returns:
+        bytes - 32 byte key
+    """
+
+    if isinstance(key, str):
+        key = bytes(key, 'utf-8')
+
+    raw_key = base64.urlsafe_b64decode(key)
+    if len(raw_key) != 32:
+        raise ValueError('Key must be 32 url-safe base64-encoded bytes.')
+
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+    hkdf = HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=None,
+        info=b'choppy-stream-' + bytes(cipher, 'utf-8'),
+        backend=default_backend()
+        )
+
+    return hkdf.derive(raw_key)
+
+
+def stream_size(nbytes, header_size=None, frame_size=FRAME_SIZE):
+    """Byte length of a complete stream of nbytes plaintext.
+
+    Args:
+        nbytes: int plaintext length of frames
+        header_size: int plaintext length of the header record, None for
+            version 1 streams
+        frame_size: int plaintext bytes per frame
+
+    Returns:
+        int bytes
+    """
+
+    frames = max(1, -(-nbytes // frame_size))
+    size = HEADER.size + nbytes + frames * TAG_SIZE
+    if header_size is not None:
+        size += RECORD_LEN.size + header_size + TAG_SIZE
+    return size
+
+
+def frame_size(file_):
+    """Reads frame size from the header of a stream, file position is
+    restored before returning."""
+
+    pos = file_.tell()
+    header = file_.read(HEADER.size)
+    file_.seek(pos)
+    return HEADER.unpack(header)[3]
+
+
+def is_stream(file_):
+    """Checks if readable, seekable file object starts with stream magic bytes.
+
+    File position is restored before returning.
+    """
+
+    pos = file_.tell()
+    magic = file_.read(len(MAGIC))
+    file_.seek(pos)
+    return magic == MAGIC
+
+
+# ------------------------------------------------------------------------------
+class StreamWriter:
+    """Write only file-like object encrypting data into fixed size frames.
+
+    Args:
+        key: str or bytes - urlsafe base64 encoded 32 byte key
+        file_: binary file object opened for writing
+        cipher: str - name of cipher in CIPHERS
+        frame_size: int - plaintext bytes per frame
+        header: bytes - optional header record, e.g. partition metadata
+    """
+
+    def __init__(self, key, file_, cipher='aesgcm', frame_size=FRAME_SIZE, header=None):
+
+        if cipher not in CIPHERS:
+            raise ValueError('Unsupported cipher: {}'.format(cipher))
+
+        if not 0 < frame_size <= MAX_FRAME_SIZE:
+            raise ValueError('Invalid frame size: {}'.format(frame_size))
+
+        if header is not None and len(header) > MAX_RECORD_SIZE:
+            raise ValueError('Header record too large: {}'.format(len(header)))
+
+        cipher_id = CIPHERS[cipher][0]
+        version = 1 if header is None else VERSION
+
+        self._file = file_
+        self._aead = aead_cipher(key, cipher)
+        self._prefix = os.urandom(PREFIX_SIZE)
+        self._header = HEADER.pack(MAGIC, version, cipher_id, frame_size, self._prefix)
+        self._frame_size = frame_size
+        self._counter = 0
+        self._buffer = bytearray()
+        self.closed = False
+
+        self._file.write(self._header)
+
+        if header is not None:
+            nonce = NONCE.pack(self._prefix, 0, FLAG_HEADER)
+            record = self._aead.encrypt(nonce, bytes(header), self._header)
+            self._file.write(RECORD_LEN.pack(len(record)))
+            self._file.write(record)
+
+
+    def _write_frame(self, data, final=False):
+        nonce = NONCE.pack(self._prefix, self._counter, FLAG_FINAL if final else FLAG_FRAME)
+        self._file.write(self._aead.encrypt(nonce, bytes(data), self._header))
+        self._counter += 1
+
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError('write to closed StreamWriter')
+
+        # a full frame is always held back until more data arrives so the
+        # final frame is never a full frame followed by an empty one
+        view = memoryview(data)
+        if self._buffer:
+            fill = self._frame_size - len(self._buffer)
+            self._buffer.extend(view[:fill])
+            view = view[fill:]
+            if not view:
+                return len(data)
+            self._write_frame(self._buffer)
+            self._buffer = bytearray()
+
+        while len(view) > self._frame_size:
+            self._write_frame(view[:self._frame_size])
+            view = view[self._frame_size:]
+
+        self._buffer.extend(view)
+        return len(data)
+
+
+    def close(self):
+        """Writes final frame. Underlying file object is not closed."""
+
+        if not self.closed:
+            self._write_frame(self._buffer, final=True)
+            self._buffer = bytearray()
+            self.closed = True
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.close()
+
+
+class StreamReader:
+    """Read only file-like object decrypting a stream one frame at a time.
+
+    The header record of version 2 streams is decrypted on open, payload
+    frames are only read from the file once plaintext past the header record
+    is requested.
+
+    Args:
+        key: str or bytes - urlsafe base64 encoded 32 byte key
+        file_: binary file object positioned at start of stream
+
+    Raises:
+        StreamHeaderError if stream header is not recognized
+        cryptography.exceptions.InvalidTag if authentication of a frame fails
+    """
+
+    def __init__(self, key, file_):
+
+        header = file_.read(HEADER.size)
+        if len(header) != HEADER.size:
+            raise StreamHeaderError('Incomplete stream header')
+
+        magic, version, cipher_id, frame_size, prefix = HEADER.unpack(header)
+
+        if magic != MAGIC or version not in VERSIONS:
+            raise StreamHeaderError('Unrecognized stream header')
+
+        if cipher_id not in CIPHER_IDS:
+            raise StreamHeaderError('Unsupported cipher id: {}'.format(cipher_id))
+
+        if not 0 < frame_size <= MAX_FRAME_SIZE:
+            raise StreamHeaderError('Invalid frame size: {}'.format(frame_size))
+
+        cipher = CIPHER_IDS[cipher_id]
+
+        self.cipher = cipher
+        self._file = file_
+        self._aead = aead_cipher(key, cipher)
+        self._header = header
+        self._prefix = prefix
+        self._block_size = frame_size + TAG_SIZE
+        self._counter = 0
+        self._next_block = None
+        self._frame = b''
+        self._pos = 0
+        self._eof = False
+
+        if version > 1:
+            self._frame = self._read_header_record()
+
+
+    def _read_header_record(self):
+        record_len = self._file.read(RECORD_LEN.size)
+        if len(record_len) != RECORD_LEN.size:
+            raise invalid_tag()
+
+        record_len = RECORD_LEN.unpack(record_len)[0]
+        if record_len > MAX_RECORD_SIZE + TAG_SIZE:
+            raise StreamHeaderError('Invalid header record length: {}'.format(record_len))
+
+        nonce = NONCE.pack(self._prefix, 0, FLAG_HEADER)
+        return self._aead.decrypt(nonce, self._file.read(record_len), self._header)
+
+
+    def _read_frame(self):
+        block = self._next_block
+        self._next_block = self._file.read(self._block_size)
+        final = not self._next_block
+
+        nonce = NONCE.pack(self._prefix, self._counter, FLAG_FINAL if final else FLAG_FRAME)
+        self._frame = self._aead.decrypt(nonce, block, self._header)
+        self._pos = 0
+        self._counter += 1
+        self._eof = final
+
+
+    def read(self, n=-1):
+        """Reads up to n bytes of plaintext, all remaining bytes if n < 0."""
+
+        chunks = []
+        remaining = n
+
+        while remaining:
+            if self._pos == len(self._frame):
+                if self._eof:
+                    break
+                if self._next_block is None:
+                    self._next_block = self._file.read(self._block_size)
+                if not self._next_block:
+                    raise invalid_tag()
+                self._read_frame()
+                continue
+
+            end = len(self._frame) if remaining < 0 else self._pos + remaining
+            chunk = self._frame[self._pos:end]
+            self._pos += len(chunk)
+            chunks.append(chunk)
+
+            if remaining > 0:
+                remaining -= len(chunk)
+
+        return b''.join(chunks)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        pass
+
+
+# ------------------------------------------------------------------------------
+def encrypt_file(key, fp_in, fp_out, cipher='aesgcm', frame_size=FRAME_SIZE):
+    """Encrypts file into stream format with memory bounded by frame size."""
+
+    with open(fp_in, 'rb') as infile, open(fp_out, 'wb') as outfile:
+        with StreamWriter(key, outfile, cipher, frame_size) as writer:
+            data = infile.read(frame_size)
+            while data:
+                writer.write(data)
+                data = infile.read(frame_size)
+
+    return fp_out
+
+
+def decrypt_file(key, fp_in, fp_out):
+    """Decrypts stream format file with memory bounded by frame size."""
+
+    with open(fp_in, 'rb') as infile, open(fp_out, 'wb') as outfile:
+        reader = StreamReader(key, infile)
+        data = reader.read(FRAME_SIZE)
+        while data:
+            outfile.write(data)
+            data = reader.read(FRAME_SIZE)
+
+    return fp_out
@@ -7,6 +7,9 @@ import getpass
 import os
 import sys
 
+from choppy.codec import CODECS
+from choppy.crypto import CIPHERS, DEFAULT_CIPHER, DEFAULT_KDF, KDFS, SCRYPT_COST
+from choppy.digest import DEFAULT_HASH, HASHES
 from choppy.version import VERSION
 
 # ------------------------------------------------------------------------------
@@ -30,6 +33,41 @@ def validate_directory(user_dir):
         raise argparse.ArgumentTypeError(msg)
 
 
+def validate_file(user_fp):
+    """Checks input file is readable without opening it, so thousands of
+    inputs do not exhaust file descriptors. Returns stdin for -."""
+
+    if user_fp == '-':
+        return sys.stdin.buffer
+    if os.path.isfile(user_fp) and os.access(user_fp, os.R_OK):
+        return user_fp
+    msg = 'Unable to read input file: {}'.format(user_fp)
+    raise argparse.ArgumentTypeError(msg)
+
+
+def parse_size(user_size):
+    """Converts size with optional K, M, G or T suffix into int bytes."""
+
+    units = 'KMGT'
+    size = user_size.strip().upper().rstrip('B') or '0'
+    power = 0
+
+    if size[-1] in units:
+        power = units.index(size[-1]) + 1
+        size = size[:-1]
+
+    try:
+        nbytes = int(float(size) * 1024**power)
+    except ValueError:
+        nbytes = 0
+
+    if nbytes < 1:
+        msg = 'Invalid partition size: {}'.format(user_size)
+        raise argparse.ArgumentTypeError(msg)
+
+    return nbytes
+
+
 def load_pw_options(subcmd, pw_only=False):
     """Initializes key and password input options.
 
@@ -60,6 +98,34 @@ def load_pw_options(subcmd, pw_only=False):
         '-t', '--iterations', type=int, default=10**5, metavar='n',
         help='perform n iterations in key derivation - defaults to 100,000')
 
+    pwgrp.add_argument(
+        '--kdf', default=DEFAULT_KDF, choices=KDFS,
+        help='key derivation function, scrypt is memory-hard - default: {}'.format(DEFAULT_KDF))
+
+    pwgrp.add_argument(
+        '--scrypt-cost', type=int, default=SCRYPT_COST[0], dest='scrypt_cost', metavar='n',
+        help='scrypt CPU/memory cost n, a power of 2 using 1 KiB per unit - default: {}'.format(SCRYPT_COST[0]))
+
+
+def load_worker_options(subcmd, pfx):
+    """Initializes parallel processing options.
+
+    Args:
+        subcmd: Argparse sub_parser instance
+        pfx: str - str prefix to designate encrypt or decrypt in help text
+
+    """
+
+    worker_grp = subcmd.add_argument_group('Workers')
+
+    worker_grp.add_argument(
+        '-j', '--jobs', type=int, default=1, metavar='n',
+        help='{}crypt partitions using n processes - 0 uses all cores - default: 1'.format(pfx))
+
+    worker_grp.add_argument(
+        '--max-inflight', type=int, default=1024, metavar='MiB', dest='max_inflight',
+        help='cap on estimated memory of partitions being processed at once - default: 1024')
+
 
 def load_keypass_options(subcmd, pfx):
     """Initializes key and password selection options.
@@ -82,6 +148,10 @@ def load_keypass_options(subcmd, pfx):
         '--use-pw', action='store_true', dest='use_pw',
         help='enables usage of password, salt, iterations for {}cryption - enter pw in secure prompt or specify file with -i'.format(pfx))
 
+    kpg.add_argument(
+        '--no-encrypt', action='store_true', dest='no_encrypt',
+        help='plaintext partitions without {}cryption, e.g. for inputs that are already encrypted'.format(pfx))
+
     load_pw_options(subcmd)
 
 
@@ -95,9 +165,10 @@ def parse_arguments():
     parser.set_defaults(kw='', pw='')
     parser.set_defaults(passwordfile=None, keyfile=None, kp_file=None)
     parser.set_defaults(use_pw=False, use_key=False)
+    parser.set_defaults(outdir=None)
 
     subparsers = parser.add_subparsers(
-        dest='command', metavar='(chop | merge | derive | gen)',
+        dest='command', metavar='(chop | merge | derive | gen | serve | client)',
         help='see docs/usage for more information')
 
     chop_aliases = ['chp', 'c']
@@ -105,44 +176,112 @@ def parse_arguments():
     derive_aliases = ['der', 'd']
     gen_aliases = ['gen', 'g']
 
-    cmds = ('chop', 'merge', 'derive', 'generate')
-    cmd_alias = (chop_aliases, merge_aliases, derive_aliases, gen_aliases)
+    cmds = ('chop', 'merge', 'derive', 'generate', 'serve', 'client')
+    cmd_alias = (chop_aliases, merge_aliases, derive_aliases, gen_aliases, [], [])
     cmd_map = dict(zip(cmds, cmd_alias))
 
     chp = subparsers.add_parser('chop', aliases=chop_aliases)
     mrg = subparsers.add_parser('merge', aliases=merge_aliases)
     derkey = subparsers.add_parser('derive', aliases=derive_aliases)
     gen_util = subparsers.add_parser('generate', aliases=gen_aliases)
+    srv = subparsers.add_parser('serve')
+    cli = subparsers.add_parser('client')
 
     # --------------------------------------------------------------------------
     chop_grp = chp.add_argument_group('Chop')
 
     chop_grp.add_argument(
-        'input', nargs='+', type=argparse.FileType('rb'), metavar='infile',
-        help='input file(s) to chop and encrypt')
+        'input', nargs='+', type=validate_file, metavar='infile',
+        help='input file(s) to chop and encrypt - use - to read stdin')
+
+    chop_grp.add_argument(
+        '--name', default='stdin', metavar='filename',
+        help='filename to merge stdin input into - default: stdin')
 
     chop_grp.add_argument(
         '-n', type=int, default=10, dest='partitions', metavar='n',
         help='create n partitions from each input file - default: 10')
 
+    chop_grp.add_argument(
+        '-b', '--part-size', type=parse_size, dest='part_size', metavar='size',
+        help='max partition size e.g. 64M - derives partition count from file size, overrides -n')
+
+    chop_grp.add_argument(
+        '--cdc', type=parse_size, dest='chunk_size', metavar='size',
+        help='content defined partitions of average size e.g. 4M - unchanged partitions are reused on re-chop')
+
+    chop_grp.add_argument(
+        '--store', type=validate_directory, metavar='dir',
+        help='write partitions to a deduplicating content addressed store, manifests to outdir - implies --cdc 4M')
+
+    chop_grp.add_argument(
+        '--pack', type=parse_size, dest='pack_size', metavar='size',
+        help='pack input files smaller than size e.g. 64M together into shared partitions')
+
+    chop_grp.add_argument(
+        '--parity', type=int, default=0, dest='nparity', metavar='k', choices=range(0, 256),
+        help='add k parity partitions per file - merge rebuilds up to k missing partitions')
+
     chop_grp.add_argument(
         '-w', '--wobble', type=int, default=0, metavar='n', choices=range(1, 100),
         help='randomize partition size (1-99)')
 
+    chop_grp.add_argument(
+        '--seed', type=int, metavar='n',
+        help='seed for reproducible wobble partition sizes')
+
     chop_grp.add_argument(
         '-r', '--randfn', action='store_true',
         help='use random file names for partitions instead of sequential numeric')
 
+    chop_grp.add_argument(
+        '-c', '--cipher', default=DEFAULT_CIPHER, choices=CIPHERS,
+        help='partition encryption format - default: {}'.format(DEFAULT_CIPHER))
+
+    chop_grp.add_argument(
+        '--hash', default=DEFAULT_HASH, choices=HASHES, dest='hash_algo',
+        help='hash for partition digests and tree hash - default: {}'.format(DEFAULT_HASH))
+
+    chop_grp.add_argument(
+        '--compress', default='none', choices=CODECS,
+        help='compress partitions before encryption, skipped for data that does not shrink - default: none')
+
+    chop_grp.add_argument(
+        '--level', type=int, metavar='n',
+        help='compression level - default: 6 for zlib and lzma, 9 for bz2')
+
     load_keypass_options(chp, pfx='en')
+    load_worker_options(chp, pfx='en')
 
     # --------------------------------------------------------------------------
     mrg_grp = mrg.add_argument_group('Merge')
 
     mrg_grp.add_argument(
-        'input', nargs='+', type=argparse.FileType('rb'), metavar='infile',
+        'input', nargs='+', type=validate_file, metavar='infile',
         help='input files to decrypt and merge')
 
+    mrg_grp.add_argument(
+        '--catalog', metavar='db-file',
+        help='SQLite catalog of partition metadata - unchanged files are not re-read')
+
+    mrg_grp.add_argument(
+        '--status', action='store_true',
+        help='list partition groups and whether they are complete without merging')
+
+    mrg_grp.add_argument(
+        '--verify-only', action='store_true', dest='verify_only',
+        help='decrypt and hash partition groups against their digests without writing output')
+
+    mrg_grp.add_argument(
+        '--stdout', action='store_true',
+        help='stream the merged file of a single partition group to stdout')
+
+    mrg_grp.add_argument(
+        '--store', type=validate_directory, metavar='dir',
+        help='resolve partitions of input manifests through a content addressed store - nothing is removed')
+
     load_keypass_options(mrg, pfx='de')
+    load_worker_options(mrg, pfx='de')
 
     # --------------------------------------------------------------------------
     load_pw_options(derkey, pw_only=True)
@@ -166,12 +305,37 @@ def parse_arguments():
         '-r', '--repeat', type=int, default=1, metavar='n',
         help='generate n files per command')
 
+    # --------------------------------------------------------------------------
+    srv_grp = srv.add_argument_group('Serve')
+
+    srv_grp.add_argument(
+        'socket', metavar='socket',
+        help='Unix socket filepath to accept JSON jobs on')
+
+    srv_grp.add_argument(
+        '--max-jobs', type=int, default=4, dest='max_jobs', metavar='n',
+        help='run up to n jobs at once on the shared workers - default: 4')
+
+    load_worker_options(srv, pfx='en/de')
+
+    # --------------------------------------------------------------------------
+    cli_grp = cli.add_argument_group('Client')
+
+    cli_grp.add_argument(
+        'socket', metavar='socket',
+        help='Unix socket filepath of a running choppy serve')
+
+    cli_grp.add_argument(
+        'jobs', nargs='*', type=validate_file, default=[sys.stdin.buffer], metavar='jobfile',
+        help='files of JSON jobs, one per line - default: stdin')
+
     # --------------------------------------------------------------------------
     for grp in (chp, mrg, derkey, gen_util):
         grp.add_argument(
             '-o', '--outdir', type=validate_directory, default=os.getcwd(),
             metavar='dir', help='output directory')
 
+    for grp in (chp, mrg, derkey, gen_util, srv, cli):
         grp.add_argument(
             '-q', '--quiet', action='store_true',
             help='disable all console text output')
@@ -1,6 +1,12 @@
 #! usr/bin/env/ python3
 
+from contextlib import contextmanager
 from itertools import chain
+import io
+import mmap
+import os
+from secrets import token_hex
+import stat
 import struct
 from sys import byteorder
 
@@ -25,9 +31,29 @@ def fmt_hex(n):
 _CFP_HEX = '6368307070794650'
 CFP = hash_str(_CFP_HEX)
 
+# versioned layout: [CFPV][version][kind] starts every metadata block
+CFPV = hash_str(_CFP_HEX + '76')
+LAYOUT_VERSION = 4
+LAYOUT_VERSIONS = (1, 2, 3, 4)
+
+# version 4 adds a codec id byte after [CFPV][version][kind]
+CODEC_OFFSET = 18
+
+# [CFPV][version][kind][codec id][group id][index][index total] ||
+# [read next][byte len of partition] for lengths of up to 64 bits
+METADATA = struct.Struct('>16sBBB16sIIHQ')
+
+KIND_DATA = 0
+KIND_MANIFEST = 1
+KIND_CHUNK = 2
+KIND_CHUNK_MANIFEST = 3
+KIND_PARITY = 4
+KIND_PACK_MANIFEST = 5
+
 
 # ------------------------------------------------------------------------------
 X16 = struct.Struct('>H')
+X32 = struct.Struct('>I')
 X64 = struct.Struct('>Q')
 
 
@@ -39,6 +65,14 @@ def decode_uint16(b):
     return X16.unpack(b)[0]
 
 
+def encode_uint32(n):
+    return X32.pack(n)
+
+
+def decode_uint32(b):
+    return X32.unpack(b)[0]
+
+
 def encode_uint64(n):
     return X64.pack(n)
 
@@ -57,6 +91,8 @@ def encode_uint(n):
 def decode_uint(b):
     if len(b) == 2:
         return decode_uint16(b)
+    elif len(b) == 4:
+        return decode_uint32(b)
     elif len(b) == 8:
         return decode_uint64(b)
     else:
@@ -68,3 +104,344 @@ def decode_uint(b):
 
 def byte_len(b):
     return encode_uint16(len(b))
+
+
+# ------------------------------------------------------------------------------
+COPY_SIZE = 2**18
+KERNEL_COPY_SIZE = 2**30
+
+
+def read_full(infile, nbytes):
+    """Reads nbytes from infile, fewer only at end of input.
+
+    Unlike a single read, short reads from pipes and raw streams are retried.
+    """
+
+    data = infile.read(nbytes)
+    if len(data) == nbytes or not data:
+        return data
+
+    chunks = [data]
+    nbytes -= len(data)
+    while nbytes > 0:
+        data = infile.read(nbytes)
+        if not data:
+            break
+        chunks.append(data)
+        nbytes -= len(data)
+
+    return b''.join(chunks)
+
+
+def read_exact(infile, nbytes):
+    """Reads exactly nbytes from infile.
+
+    Raises:
+        struct.error if infile ends early, as for a truncated metadata block
+    """
+
+    data = read_full(infile, nbytes)
+    if len(data) != nbytes:
+        raise struct.error('Expected {} bytes, read {}'.format(nbytes, len(data)))
+    return data
+
+
+def regular_fileno(file_):
+    """Returns file descriptor of a regular file opened in Python, None for
+    other file objects such as pipes, sockets, encrypting or in memory files."""
+
+    if not isinstance(file_, (io.BufferedReader, io.BufferedWriter, io.BufferedRandom,
+                              io.FileIO)):
+        return None
+
+    try:
+        fd = file_.fileno()
+        return fd if stat.S_ISREG(os.fstat(fd).st_mode) else None
+    except (OSError, ValueError):
+        return None
+
+
+def kernel_copy(infile, outfile, nbytes):
+    """Copies up to nbytes between regular files without passing data through
+    Python, with os.copy_file_range or else os.sendfile.
+
+    Copies are made at explicit offsets and the positions of both file
+    objects are moved past the copied bytes, as with read and write. outfile
+    may be a PositionalWriter, which only supports os.copy_file_range.
+
+    Returns:
+        int bytes copied - 0 if the files or platform do not support kernel
+        copies, fewer than nbytes if infile ends early
+    """
+
+    positional = isinstance(outfile, PositionalWriter)
+    src = regular_fileno(infile)
+    dst = regular_fileno(outfile._file if positional else outfile)
+    if src is None or dst is None or nbytes <= 0:
+        return 0
+
+    use_range = hasattr(os, 'copy_file_range')
+    if not use_range and (positional or not hasattr(os, 'sendfile')):
+        return 0
+
+    src_pos = infile.tell()
+    if positional:
+        dst_pos = outfile.offset
+    else:
+        outfile.flush()
+        dst_pos = outfile.tell()
+
+    copied = 0
+    try:
+        while copied < nbytes:
+            count = min(nbytes - copied, KERNEL_COPY_SIZE)
+            if use_range:
+                n = os.copy_file_range(src, dst, count, src_pos + copied, dst_pos + copied)
+            else:
+                os.lseek(dst, dst_pos + copied, os.SEEK_SET)
+                n = os.sendfile(dst, src, src_pos + copied, count)
+            if not n:
+                break
+            copied += n
+    except OSError:
+        # unsupported by file system or kernel, the caller copies the rest
+        pass
+
+    infile.seek(src_pos + copied)
+    if positional:
+        outfile.offset += copied
+    else:
+        outfile.seek(dst_pos + copied)
+
+    return copied
+
+
+def hash_range(infile, offset, nbytes, hasher, chunk=COPY_SIZE):
+    """Updates hasher with nbytes of a regular file at offset through a
+    memory map, without copying data into Python objects or moving the file
+    position.
+
+    Returns:
+        bool - False if infile cannot be mapped or ends before offset + nbytes
+    """
+
+    fd = regular_fileno(infile)
+    if fd is None or nbytes <= 0 or os.fstat(fd).st_size < offset + nbytes:
+        return nbytes == 0
+
+    start = offset - offset % mmap.ALLOCATIONGRANULARITY
+    end = offset - start + nbytes
+
+    try:
+        with mmap.mmap(fd, end, access=mmap.ACCESS_READ, offset=start) as mapped:
+            with memoryview(mapped) as view:
+                for pos in range(offset - start, end, chunk):
+                    hasher.update(view[pos:min(pos + chunk, end)])
+    except (OSError, ValueError):
+        return False
+
+    return True
+
+
+def copy_bytes(infile, outfile, nbytes, chunk=COPY_SIZE, hasher=None):
+    """Copies nbytes from current position of infile to outfile in chunks.
+
+    Regular files are copied inside the kernel, with a hasher the copied
+    range is hashed through a memory map of infile. Other data is read into
+    one reused buffer when infile supports readinto, so allocations do not
+    grow with nbytes.
+
+    Args:
+        infile: readable binary file object
+        outfile: writable binary file object, must not keep references to
+            written data after write returns
+        nbytes: int number of bytes to copy
+        chunk: int max bytes per read
+        hasher: optional hashlib object updated with copied bytes
+
+    Raises:
+        EOFError if infile ends before nbytes are copied
+    """
+
+    offset = infile.tell() if hasher is not None and regular_fileno(infile) else None
+    copied = kernel_copy(infile, outfile, nbytes)
+
+    if copied and hasher is not None and not hash_range(infile, offset, copied, hasher):
+        # data is already copied, hash it from infile instead
+        infile.seek(offset)
+        copy_bytes(infile, NullWriter(), copied, chunk, hasher)
+
+    nbytes -= copied
+
+    readinto = getattr(infile, 'readinto', None)
+    if readinto is not None and nbytes > 0:
+        view = memoryview(bytearray(min(chunk, nbytes)))
+
+    while nbytes > 0:
+        if readinto is not None:
+            n = readinto(view[:min(chunk, nbytes)])
+            data = view[:n]
+        else:
+            data = infile.read(min(chunk, nbytes))
+        if not data:
+            raise EOFError('Input ended {} bytes early'.format(nbytes))
+        outfile.write(data)
+        if hasher:
+            hasher.update(data)
+        nbytes -= len(data)
+
+
+TEMP_SUFFIX = '.tmp'
+
+
+def is_temp(fn):
+    """Checks if filename is a temporary file of atomic_write."""
+
+    return fn.startswith('.') and fn.endswith(TEMP_SUFFIX)
+
+
+@contextmanager
+def atomic_write(fp):
+    """Opens a hidden temporary file next to fp for binary writing, moved to
+    fp with os.replace once the block completes.
+
+    Readers of fp never see a partially written file and an interrupted write
+    leaves any previous fp in place. The temporary file is removed on error.
+
+    Args:
+        fp: str filepath
+
+    Yields:
+        binary file object opened for writing
+    """
+
+    dirname, basename = os.path.split(fp)
+    tmp = os.path.join(dirname, '.{}.{}{}'.format(basename, token_hex(4), TEMP_SUFFIX))
+
+    file_ = open(tmp, 'xb')
+    try:
+        with file_:
+            yield file_
+        os.replace(tmp, fp)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def preallocate(fn, size):
+    """Creates or truncates file and reserves size bytes on disk.
+
+    Disk space is reserved with posix_fallocate where supported, otherwise
+    the file is extended with truncate.
+
+    Args:
+        fn: str filepath
+        size: int final file size in bytes
+    """
+
+    with open(fn, 'wb') as outfile:
+        if size and hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(outfile.fileno(), 0, size)
+                return
+            except OSError:
+                pass
+        outfile.truncate(size)
+
+
+class PositionalWriter:
+    """Write only file-like object writing at an explicit offset.
+
+    Uses os.pwrite where available so the file position of the underlying
+    file object is never shared between writers.
+
+    Args:
+        file_: binary file object opened for writing
+        offset: int position of first write
+    """
+
+    def __init__(self, file_, offset):
+        self._file = file_
+        self.offset = offset
+
+
+    def write(self, data):
+        if hasattr(os, 'pwrite'):
+            view = memoryview(data)
+            while view:
+                n = os.pwrite(self._file.fileno(), view, self.offset)
+                self.offset += n
+                view = view[n:]
+        else:
+            self._file.seek(self.offset)
+            self._file.write(data)
+            self.offset += len(data)
+
+        return len(data)
+
+
+class NullWriter:
+    """Write only file-like object discarding all data."""
+
+    def write(self, data):
+        return len(data)
+
+
+class SplitWriter:
+    """Write only file-like object splitting consecutive writes into files.
+
+    Args:
+        members: iterable of tuple (str filepath, int byte length) in order
+    """
+
+    def __init__(self, members):
+        self._members = iter(members)
+        self._file = None
+        self._left = 0
+        self._next()
+
+
+    def _next(self):
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+
+        for fp, nbytes in self._members:
+            self._file = open(fp, 'wb')
+            if nbytes:
+                self._left = nbytes
+                return
+            self._file.close()
+            self._file = None
+
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            if self._file is None:
+                raise ValueError('Write past end of last file: {} bytes'.format(len(view)))
+            n = min(len(view), self._left)
+            self._file.write(view[:n])
+            self._left -= n
+            view = view[n:]
+            if not self._left:
+                self._next()
+
+        return len(data)
+
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
@@ -24,8 +24,8 @@ from choppy.version import VERSION
 if sys.argv[-1] == 'setup.py':
     print("To install choppy, run 'python setup.py install'\n")
 
-if sys.version_info[:3] < (3, 6):
-    print('choppy requires Python 3.6 or later ({}.{}.{} detected)'.format(*sys.version_info[:3]))
+if sys.version_info[:3] < (3, 7):
+    print('choppy requires Python 3.7 or later ({}.{}.{} detected)'.format(*sys.version_info[:3]))
     sys.exit(-1)
 
 
@@ -49,7 +49,7 @@ setup(
         'Intended Audience :: Science/Research',
         'License :: OSI Approved :: BSD License',
         'Operating System :: OS Independent',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.7',
         'Topic :: Communications :: File Sharing',
         'Topic :: Security :: Cryptography',
         'Topic :: Utilities'
@@ -57,7 +57,7 @@ setup(
 
     keywords='cryptography partition',
     packages=find_packages(exclude=['docs']),
-    python_requires='>3.6',
+    python_requires='>=3.7',
     install_requires=['cryptography'],
     extras_require={},
     package_data={'':['LICENSE.txt', 'MANIFEST.in', 'docs/*', 'tests/*']},
@@ -0,0 +1,144 @@
+#! usr/bin/env/ python3
+
+import asyncio
+import os
+
+from os.path import abspath, dirname
+import sys
+parent_dir = dirname(abspath(dirname('__file__')))
+sys.path.insert(0, parent_dir)
+
+import unittest
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+import tempfile
+import time
+
+from cryptography.fernet import Fernet
+
+from choppy.aio import Merged, Partition, chop_encrypt_async, decrypt_merge_async
+
+# choppy.chop is the chop function once the package is imported
+chop_module = import_module('choppy.chop')
+
+# ------------------------------------------------------------------------------
+class TestAsync(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.data = os.urandom(50000)
+        self.input_file = os.path.join(self.tmpdir.name, 'test_file.txt')
+        with open(self.input_file, 'wb') as outfile:
+            outfile.write(self.data)
+
+        self.key = Fernet.generate_key()
+        self.outdir = os.path.join(self.tmpdir.name, 'chop')
+        os.mkdir(self.outdir)
+
+
+    def collect(self, events):
+        async def consume():
+            return [event async for event in events]
+        return asyncio.run(consume())
+
+
+    def test_chop_merge(self):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            events = self.collect(chop_encrypt_async(
+                [self.input_file], self.outdir, self.key, 10, executor=executor,
+                queue_size=2))
+
+        self.assertEqual(11, len(events))
+        self.assertTrue(all(event.filename == self.input_file for event in events))
+        self.assertEqual(sorted(os.listdir(self.outdir)),
+                         sorted(os.path.basename(event.path) for event in events))
+
+        merge_dir = os.path.join(self.tmpdir.name, 'merge')
+        os.mkdir(merge_dir)
+        fp_out = os.path.join(merge_dir, 'test_file.txt')
+
+        events = self.collect(decrypt_merge_async(
+            [event.path for event in events], merge_dir, self.key, workers=2))
+
+        self.assertEqual(Merged(fp_out, True), events[-1])
+        self.assertEqual(11, len([e for e in events if isinstance(e, Partition)]))
+        self.assertEqual([], os.listdir(self.outdir))
+        with open(fp_out, 'rb') as infile:
+            self.assertEqual(self.data, infile.read())
+
+
+    def test_cancel(self):
+        async def consume():
+            events = chop_encrypt_async(
+                [self.input_file], self.outdir, self.key, 200, queue_size=1)
+            first = await events.__anext__()
+            await events.aclose()
+            return first, len(os.listdir(self.outdir))
+
+        first, written = asyncio.run(consume())
+        self.assertTrue(os.path.isfile(first.path))
+        self.assertLess(written, 10)
+        self.assertEqual(written, len(os.listdir(self.outdir)))
+
+
+    def test_cancel_task(self):
+        async def consume():
+            events = []
+            async for event in chop_encrypt_async(
+                    [self.input_file], self.outdir, self.key, 200, queue_size=1):
+                events.append(event)
+                await asyncio.sleep(10)
+
+        async def run():
+            task = asyncio.ensure_future(consume())
+            await asyncio.sleep(0.2)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            return len(os.listdir(self.outdir))
+
+        written = asyncio.run(run())
+        self.assertLess(written, 10)
+        self.assertEqual(written, len(os.listdir(self.outdir)))
+
+
+    def test_cancel_executor(self):
+        write_partition = chop_module.write_partition
+        finished = []
+
+        def slow_write(*args, **kwargs):
+            time.sleep(0.05)
+            result = write_partition(*args, **kwargs)
+            finished.append(time.monotonic())
+            return result
+
+        async def consume(executor):
+            events = chop_encrypt_async(
+                [self.input_file], self.outdir, self.key, 200, executor=executor,
+                queue_size=1)
+            await events.__anext__()
+            await events.aclose()
+            return time.monotonic(), sorted(os.listdir(self.outdir))
+
+        with mock.patch.object(chop_module, 'write_partition', side_effect=slow_write):
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                closed, written = asyncio.run(consume(executor))
+                time.sleep(0.2)
+
+        self.assertLess(len(written), 200)
+        self.assertEqual(written, sorted(os.listdir(self.outdir)))
+        self.assertTrue(all(end <= closed for end in finished))
+
+
+    def test_error(self):
+        missing = os.path.join(self.tmpdir.name, 'missing.txt')
+        with self.assertRaises(FileNotFoundError):
+            self.collect(chop_encrypt_async([missing], self.outdir, self.key, 2))
+
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,10 @@
 #! usr/bin/env/ python3
 
+from importlib import import_module
+import io
 import os
+import threading
+import time
 
 from os.path import abspath, dirname
 import sys
@@ -8,13 +12,31 @@ parent_dir = dirname(abspath(dirname('__file__')))
 sys.path.insert(0, parent_dir)
 
 import unittest
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
 import tempfile
 
 from cryptography.fernet import Fernet
 
-from choppy.chop import chop_encrypt
-from choppy.merge import decrypt_merge
-from choppy.crypto import md5_hash
+from choppy import util
+from choppy.chop import (
+    chop, chop_encrypt, chop_stream, convert_filename, convert_hash, convert_nbytes,
+    generate_filepath, metadata_block, partition_tasks, task_cost)
+from choppy.catalog import Catalog
+from choppy.merge import (
+    decrypt_merge, group_status, merge, merge_stream, prune_store, read_metadata,
+    read_path_metadata, verify)
+from choppy.crypto import hash_str, md5_hash
+from choppy.codec import CODECS
+from choppy.digest import HASHES
+from choppy.parallel import bounded_map
+from choppy.partition import byte_lengths
+from choppy.store import TEMP_MAX_AGE, chunk_paths
+from choppy.stream import is_stream
+
+# choppy.chop is shadowed by the chop function on the package
+chop_module = import_module('choppy.chop')
+
 
 # ------------------------------------------------------------------------------
 def make_file(tmpdir, filesize=1024):
@@ -44,7 +66,7 @@ class TestChopMerge(unittest.TestCase):
         _paths = [self.input_file]
         n_parts = 10
         encrypted_paths = chop_encrypt(_paths, self.tmp_chop, self.key, n_parts)
-        self.assertEqual(n_parts, len(encrypted_paths))
+        self.assertEqual(n_parts + 1, len(encrypted_paths))
 
         status, decrypted_paths = decrypt_merge(encrypted_paths, self.tmp_merge, self.key)
         self.assertTrue(all(status))
@@ -54,6 +76,585 @@ class TestChopMerge(unittest.TestCase):
         self.assertEqual(self.input_file_hash, decrypted_file_hash)
 
 
+    def test_chop_encrypt_outputs(self):
+        out_dir = os.path.join(self.tmpdir.name, 'out')
+        os.mkdir(out_dir)
+        encrypted_paths = chop_encrypt([self.input_file], out_dir, self.key, 3)
+
+        self.assertEqual(sorted(encrypted_paths),
+                         sorted(os.path.join(out_dir, fn) for fn in os.listdir(out_dir)))
+
+        for fp in encrypted_paths:
+            with open(fp, 'rb') as infile:
+                self.assertTrue(is_stream(infile))
+
+
+    def test_merge_skips_foreign_files(self):
+        encrypted_paths = chop_encrypt([self.input_file], self.tmp_chop, self.key, 5)
+
+        junk = os.path.join(self.tmpdir.name, 'junk.chp.9')
+        with open(junk, 'wb') as outfile:
+            outfile.write(os.urandom(256))
+
+        other_key = chop_encrypt(
+            [self.input_file], self.tmp_merge, Fernet.generate_key(), 2, randfn=True)
+
+        status, decrypted_paths = decrypt_merge(
+            encrypted_paths + [junk] + other_key, self.tmp_merge, self.key)
+
+        self.assertEqual([True], status)
+        self.assertEqual(self.input_file_hash, md5_hash(decrypted_paths[0]))
+        self.assertTrue(os.path.exists(junk))
+        self.assertFalse(any(map(os.path.exists, encrypted_paths)))
+
+
+    def test_chop_merge_plaintext(self):
+        chopped_paths = chop([self.input_file], self.tmp_chop, 4, 20, False)
+
+        for workers in (1, 4):
+            status, new_files, used_files = merge(
+                chopped_paths, self.tmp_merge, workers=workers)
+
+            self.assertEqual([True], status)
+            self.assertEqual(sorted(chopped_paths), sorted(used_files))
+            self.assertEqual(self.input_file_hash, md5_hash(new_files[0]))
+
+
+    @unittest.skipUnless(hasattr(os, 'copy_file_range'), 'requires os.copy_file_range')
+    def test_plaintext_kernel_copy(self):
+        kernel_copy = util.kernel_copy
+        copied = []
+
+        def counted(*args):
+            copied.append(kernel_copy(*args))
+            return copied[-1]
+
+        with mock.patch.object(util, 'kernel_copy', side_effect=counted):
+            paths = chop_encrypt([self.input_file], self.tmp_chop, None, 4)
+            self.assertEqual(1024, sum(copied))
+
+            del copied[:]
+            status, new_files = decrypt_merge(paths, self.tmp_merge, None)
+            self.assertEqual(1024, sum(copied))
+
+        self.assertEqual([True], status)
+        self.assertEqual(self.input_file_hash, md5_hash(new_files[0]))
+
+
+    def test_chop_merge_workers(self):
+        for cipher in ('aesgcm', 'fernet'):
+            encrypted_paths = chop_encrypt(
+                [self.input_file], self.tmp_chop, self.key, 6, wobble=30,
+                cipher=cipher, workers=3, max_inflight=1)
+            self.assertEqual(7, len(encrypted_paths))
+
+            status, decrypted_paths = decrypt_merge(
+                encrypted_paths, self.tmp_merge, self.key, workers=2)
+            self.assertTrue(all(status))
+            self.assertEqual(self.input_file_hash, md5_hash(decrypted_paths[0]))
+
+
+    def test_chop_merge_part_size(self):
+        encrypted_paths = chop_encrypt(
+            [self.input_file], self.tmp_chop, self.key, None, part_size=100)
+        self.assertEqual(12, len(encrypted_paths))
+
+        status, decrypted_paths = decrypt_merge(encrypted_paths, self.tmp_merge, self.key)
+        self.assertEqual([True], status)
+        self.assertEqual(self.input_file_hash, md5_hash(decrypted_paths[0]))
+
+
+    def test_read_metadata_index_width(self):
+        group_id = os.urandom(16)
+        block = metadata_block(util.KIND_DATA, group_id, 70000, 2**20, 123)
+        (tot, gid, _, _), ix, seek, nbytes, _ = read_metadata(io.BytesIO(bytes(block)))
+        self.assertEqual((2**20, group_id, 70000, len(block), 123), (tot, gid, ix, seek, nbytes))
+
+        # version 2 headers store index fields as uint16
+        block = util.bcat(
+            util.CFPV, (2, util.KIND_DATA), group_id, util.encode_uint16(7),
+            util.encode_uint16(9), *convert_nbytes(123))
+        (tot, gid, _, _), ix, seek, nbytes, _ = read_metadata(io.BytesIO(bytes(block)))
+        self.assertEqual((9, group_id, 7, len(block), 123), (tot, gid, ix, seek, nbytes))
+
+
+    def test_truncated_headers_are_skipped(self):
+        chopped_paths = chop([self.input_file], self.tmp_chop, 2, 0, False)
+        stray = os.path.join(self.tmpdir.name, 'stray.chp.0')
+
+        # data partitions and the manifest, cut at every header byte
+        for fp in chopped_paths:
+            seek = read_path_metadata(fp)[2]
+            with open(fp, 'rb') as infile:
+                header = infile.read(seek)
+
+            for size in range(seek):
+                with open(stray, 'wb') as outfile:
+                    outfile.write(header[:size])
+                self.assertIsNone(read_path_metadata(stray), size)
+
+        manifest = next(fp for fp in chopped_paths if read_path_metadata(fp)[0][2])
+        with open(manifest, 'rb') as infile:
+            manifest_header = infile.read(read_path_metadata(manifest)[2])
+
+        # cut after [CFPV][version][kind], inside the filename and before the hash id
+        hash_id_offset = 49 + len('test_file.txt')
+        for size in (18, hash_id_offset - 1, hash_id_offset):
+            header = manifest_header[:size]
+            with open(stray, 'wb') as outfile:
+                outfile.write(header)
+
+            paths = chopped_paths + [stray]
+            self.assertEqual(1, len(group_status(paths)))
+            self.assertEqual([('test_file.txt', True)], verify(paths))
+            out_dir = tempfile.mkdtemp(dir=self.tmpdir.name)
+            status, new_files, _ = merge(paths, out_dir)
+            self.assertEqual([True], status)
+            self.assertEqual(self.input_file_hash, md5_hash(new_files[0]))
+
+
+    def test_chop_merge_chunking(self):
+        chunking = (2**6, 2**8, 2**10)
+        data = os.urandom(2**16)
+        with open(self.input_file, 'wb') as outfile:
+            outfile.write(data)
+
+        paths = chop_encrypt([self.input_file], self.tmp_chop, self.key, None, chunking=chunking)
+
+        data = data[:5000] + b'edit' + data[5000:]
+        with open(self.input_file, 'wb') as outfile:
+            outfile.write(data)
+
+        fresh_paths = chop_encrypt(
+            [self.input_file], self.tmp_merge, self.key, None, chunking=chunking)
+        rechop_paths = chop_encrypt(
+            [self.input_file], self.tmp_chop, self.key, None, chunking=chunking)
+
+        names = lambda fpaths: set(map(os.path.basename, fpaths[:-1]))
+        self.assertLess(len(rechop_paths), 10)
+        self.assertLessEqual(names(fresh_paths), names(paths) | names(rechop_paths))
+
+        # chunks only listed by the overwritten manifest are removed
+        self.assertFalse(all(map(os.path.exists, paths[:-1])))
+        chopped = [os.path.join(self.tmp_chop, fn) for fn in os.listdir(self.tmp_chop)
+                   if fn != 'test_file.txt']
+
+        status, decrypted_paths = decrypt_merge(chopped, self.tmpdir.name, self.key)
+        self.assertEqual([True], status)
+        with open(decrypted_paths[0], 'rb') as infile:
+            self.assertEqual(data, infile.read())
+        self.assertEqual(['test_file.txt'], os.listdir(self.tmp_chop))
+
+
+    def test_rechop_replaces_truncated_chunk(self):
+        chunking = (2**6, 2**8, 2**10)
+        data = b''.join(bytes('{} {}\n'.format(i, os.urandom(8).hex()), 'utf-8')
+                        for i in range(2000))
+        with open(self.input_file, 'wb') as outfile:
+            outfile.write(data)
+
+        for key in (self.key, None):
+            for compress in (None, 'zlib'):
+                outdir = tempfile.mkdtemp(dir=self.tmpdir.name)
+                paths = chop_encrypt([self.input_file], outdir, key, None, chunking=chunking,
+                                     compress=compress)
+                self.assertEqual([], chop_encrypt([self.input_file], outdir, key, None,
+                                                  chunking=chunking, compress=compress)[:-1])
+
+                target = [fp for fp in paths[:-1]
+                          if read_path_metadata(fp, key)[4] == (compress or 'none')][0]
+                with open(target, 'r+b') as outfile:
+                    outfile.truncate(os.path.getsize(target) // 2)
+
+                rechop_paths = chop_encrypt([self.input_file], outdir, key, None,
+                                            chunking=chunking, compress=compress)
+                self.assertEqual([target], rechop_paths[:-1])
+                self.assertFalse([fn for fn in os.listdir(outdir) if fn.endswith('.tmp')])
+
+                status, decrypted_paths = decrypt_merge(
+                    rechop_paths[-1:] + paths[:-1], self.tmp_merge, key)
+                self.assertEqual([True], status)
+                with open(decrypted_paths[0], 'rb') as infile:
+                    self.assertEqual(data, infile.read())
+
+
+    def test_chop_merge_store(self):
+        store = os.path.join(self.tmpdir.name, 'store')
+        chunking = (2**6, 2**8, 2**10)
+        data = os.urandom(2**15)
+
+        second_file = os.path.join(self.tmp_merge, 'second.txt')
+        for fp, content in ((self.input_file, data), (second_file, data[:2000] + data)):
+            with open(fp, 'wb') as outfile:
+                outfile.write(content)
+
+        manifests, n_new = [], []
+        for fp in (self.input_file, second_file):
+            paths = chop_encrypt(
+                [fp], self.tmp_chop, self.key, None, randfn=True, chunking=chunking,
+                store=store)
+            manifests.append(paths[-1])
+            n_new.append(len(paths) - 1)
+
+        n_chunks = len(list(chunk_paths(store)))
+        self.assertEqual(sum(n_new), n_chunks)
+        self.assertLess(n_new[1], 10)
+
+        status, decrypted_paths = decrypt_merge(
+            manifests, self.tmpdir.name, self.key, workers=2, store=store)
+        self.assertEqual([True, True], status)
+        self.assertEqual(data, open(decrypted_paths[0], 'rb').read())
+        self.assertTrue(all(map(os.path.exists, manifests)))
+
+        removed = prune_store(store, manifests[1:], self.key)
+        self.assertLess(len(removed), 10)
+        self.assertEqual(n_chunks - len(removed), len(list(chunk_paths(store))))
+
+        status, _ = decrypt_merge(manifests[1:], self.tmp_chop, self.key, store=store)
+        self.assertEqual([True], status)
+
+
+    def test_interrupted_store_write(self):
+        store = os.path.join(self.tmpdir.name, 'store')
+        chunking = (2**6, 2**8, 2**10)
+        data = os.urandom(2**14)
+        with open(self.input_file, 'wb') as outfile:
+            outfile.write(data)
+
+        copy_bytes = util.copy_bytes
+
+        def interrupted(infile, outfile, nbytes, *args, **kwargs):
+            if nbytes > 2**6:
+                copy_bytes(infile, outfile, nbytes // 2, *args, **kwargs)
+                raise KeyboardInterrupt
+            copy_bytes(infile, outfile, nbytes, *args, **kwargs)
+
+        with mock.patch.object(util, 'copy_bytes', side_effect=interrupted):
+            with self.assertRaises(KeyboardInterrupt):
+                chop_encrypt([self.input_file], self.tmp_chop, self.key, None,
+                             chunking=chunking, store=store)
+
+        self.assertEqual([], list(chunk_paths(store)))
+        self.assertEqual([], list(chunk_paths(store, temp=True)))
+
+        paths = chop_encrypt([self.input_file], self.tmp_chop, self.key, None,
+                             chunking=chunking, store=store)
+        status, decrypted_paths = decrypt_merge(
+            paths[-1:], self.tmp_merge, self.key, store=store)
+        self.assertEqual([True], status)
+        with open(decrypted_paths[0], 'rb') as infile:
+            self.assertEqual(data, infile.read())
+
+        # temporary files of writes in progress are kept
+        chunk_dir = os.path.dirname(paths[0])
+        stale, fresh = (os.path.join(chunk_dir, '.{}.chp.0.tmp'.format(name))
+                        for name in ('stale', 'fresh'))
+        for fp in (stale, fresh):
+            open(fp, 'wb').close()
+        mtime = time.time() - 2 * TEMP_MAX_AGE
+        os.utime(stale, (mtime, mtime))
+
+        self.assertEqual([stale], prune_store(store, paths[-1:], self.key))
+        self.assertEqual([fresh], list(chunk_paths(store, temp=True)))
+
+
+    def test_chop_merge_compress(self):
+        data = b''.join(bytes('{},log line {}\n'.format(i, i % 7), 'utf-8') for i in range(5000))
+        data += os.urandom(len(data))
+        with open(self.input_file, 'wb') as outfile:
+            outfile.write(data)
+
+        for codec_name in CODECS:
+            paths = chop_encrypt(
+                [self.input_file], self.tmp_chop, self.key, 4, compress=codec_name, level=1)
+            codecs = [read_path_metadata(fp, self.key)[4] for fp in paths]
+            if codec_name != 'none':
+                self.assertEqual([codec_name, codec_name, 'none', 'none', 'none'], codecs)
+                self.assertLess(sum(map(os.path.getsize, paths)), len(data) * 0.75)
+
+            status, decrypted_paths = decrypt_merge(
+                paths, self.tmp_merge, self.key, workers=2)
+            self.assertEqual([True], status)
+            with open(decrypted_paths[0], 'rb') as infile:
+                self.assertEqual(data, infile.read())
+
+
+    def test_compressor_cost_bounds_inflight(self):
+        lock = threading.Lock()
+        counts = {'running': 0, 'peak': 0}
+
+        def tracked(*args):
+            with lock:
+                counts['running'] += 1
+                counts['peak'] = max(counts['peak'], counts['running'])
+            time.sleep(0.05)
+            with lock:
+                counts['running'] -= 1
+
+        def peak(compress, level):
+            counts['peak'] = 0
+            tasks = partition_tasks(self.input_file, generate_filepath(self.tmp_chop), 8,
+                                    key=self.key, compress=compress, level=level)
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                list(bounded_map(tracked, tasks, executor, 2**28, task_cost))
+            return counts['peak']
+
+        self.assertEqual(4, peak(None, None))
+        self.assertEqual(4, peak('zlib', 9))
+        self.assertEqual(2, peak('lzma', 6))
+        self.assertEqual(1, peak('lzma', 9))
+
+
+    def test_chop_merge_stream(self):
+        data = os.urandom(10000)
+
+        class Pipe(io.RawIOBase):
+            """Stream returning short reads like a pipe."""
+            def __init__(self, data):
+                self._data = io.BytesIO(data)
+
+            def read(self, n=-1):
+                return self._data.read(min(n, 777))
+
+        for workers in (1, 2):
+            paths = chop_stream(
+                Pipe(data), self.tmp_chop, self.key, 3000, 'dump.sql', workers=workers)
+            self.assertEqual(5, len(paths))
+
+            outfile = io.BytesIO()
+            self.assertEqual('dump.sql', merge_stream(
+                paths, outfile, self.key, workers=workers, max_inflight=1))
+            self.assertEqual(data, outfile.getvalue())
+
+            status, decrypted_paths = decrypt_merge(paths, self.tmp_merge, self.key)
+            self.assertEqual([True], status)
+            self.assertEqual('dump.sql', os.path.basename(decrypted_paths[0]))
+
+        paths = chop_stream(io.BytesIO(), self.tmp_chop, self.key)
+        outfile = io.BytesIO()
+        merge_stream(paths, outfile, self.key)
+        self.assertEqual(b'', outfile.getvalue())
+        self.assertRaises(ValueError, merge_stream, paths[:0], outfile, self.key)
+
+
+    def test_chop_merge_parity(self):
+        chopped_paths = chop_encrypt(
+            [self.input_file], self.tmp_chop, self.key, 6, 30, nparity=2)
+        self.assertEqual(6 + 2 + 1, len(chopped_paths))
+
+        paths = [fp for fp in chopped_paths if fp not in chopped_paths[1:6:3]]
+        self.assertEqual([('test_file.txt', 4, 6, 'rebuildable')], group_status(paths, self.key))
+        self.assertEqual([('test_file.txt', 3, 6, 'incomplete')],
+                         group_status(chopped_paths[3:], self.key))
+
+        for workers in (1, 2):
+            status, new_files, used_files = merge(
+                paths, self.tmp_merge, self.key, workers=workers)
+            self.assertEqual([True], status)
+            self.assertEqual(self.input_file_hash, md5_hash(new_files[0]))
+            self.assertEqual(sorted(paths), sorted(used_files))
+
+        status, new_files, used_files = merge(chopped_paths[3:], self.tmp_merge, self.key)
+        self.assertEqual([], status)
+
+        self.assertRaises(ValueError, chop, [self.input_file], self.tmp_chop, 255, 0, False,
+                          nparity=2)
+
+
+    def test_chop_merge_pack(self):
+        small_files = []
+        for ix, size in enumerate((0, 100, 300, 700, 50)):
+            fp = os.path.join(self.tmp_chop, 'small_{}.txt'.format(ix))
+            with open(fp, 'wb') as outfile:
+                outfile.write(os.urandom(size))
+            small_files.append(fp)
+
+        out_dir = os.path.join(self.tmpdir.name, 'out')
+        os.mkdir(out_dir)
+        inputs = [self.input_file] + small_files
+
+        for workers in (1, 2):
+            chopped_paths = chop_encrypt(
+                inputs, out_dir, self.key, 4, workers=workers, pack_size=512)
+            self.assertEqual(2 * (4 + 1) + 2, len(chopped_paths))
+
+            status, new_files = decrypt_merge(
+                chopped_paths, self.tmp_merge, self.key, workers=workers)
+            self.assertEqual([True] * len(inputs), status)
+            self.assertEqual(sorted(map(os.path.basename, inputs)),
+                             sorted(map(os.path.basename, new_files)))
+            for fp in inputs:
+                self.assertEqual(md5_hash(fp), md5_hash(os.path.join(self.tmp_merge,
+                                                                     os.path.basename(fp))))
+            self.assertEqual([], os.listdir(out_dir))
+
+        twin = os.path.join(self.tmp_merge, 'small_1.txt')
+        with open(twin, 'wb') as outfile:
+            outfile.write(b'twin')
+        with self.assertRaises(ValueError):
+            chop_encrypt(inputs + [twin], out_dir, self.key, 4, pack_size=512)
+        self.assertEqual([], os.listdir(out_dir))
+
+
+    def test_files_share_pipeline(self):
+        second_file = os.path.join(self.tmp_merge, 'second.txt')
+        with open(second_file, 'wb') as outfile:
+            outfile.write(os.urandom(2048))
+
+        write_partition = chop_module.write_partition
+        events = []
+
+        def tracked(fp, *args):
+            events.append(('start', fp))
+            time.sleep(0.05)
+            result = write_partition(fp, *args)
+            events.append(('end', fp))
+            return result
+
+        out_dir = tempfile.mkdtemp(dir=self.tmpdir.name)
+        with mock.patch.object(chop_module, 'write_partition', side_effect=tracked):
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                paths = chop_encrypt([self.input_file, second_file], out_dir, self.key, 4,
+                                     workers=executor, nparity=1)
+        self.assertEqual(2 * (4 + 1 + 1), len(paths))
+
+        # the second file starts while partitions of the first are written
+        first_end = max(ix for ix, event in enumerate(events)
+                        if event == ('end', self.input_file))
+        self.assertLess(events.index(('start', second_file)), first_end)
+
+        merge_dir = tempfile.mkdtemp(dir=self.tmpdir.name)
+        status, new_files = decrypt_merge(paths, merge_dir, self.key)
+        self.assertEqual([True, True], status)
+        self.assertEqual([md5_hash(self.input_file), md5_hash(second_file)],
+                         [md5_hash(fp) for fp in new_files])
+
+
+    def test_merge_hash_algorithms(self):
+        for hash_algo in HASHES:
+            chopped_paths = chop([self.input_file], self.tmp_chop, 5, 0, True, hash_algo)
+            status, new_files, used_files = merge(chopped_paths, self.tmp_merge)
+            self.assertEqual([True], status)
+            self.assertEqual(self.input_file_hash, md5_hash(new_files[0]))
+
+
+    def test_merge_rejects_corrupt_partition(self):
+        chopped_paths = chop([self.input_file], self.tmp_chop, 4, 0, False)
+
+        with open(chopped_paths[1], 'r+b') as outfile:
+            outfile.seek(-1, os.SEEK_END)
+            last = outfile.read(1)
+            outfile.seek(-1, os.SEEK_END)
+            outfile.write(bytes([last[0] ^ 1]))
+
+        for workers in (1, 2):
+            status, new_files, used_files = merge(
+                chopped_paths, self.tmp_merge, workers=workers)
+            self.assertEqual([False], status)
+            self.assertEqual([], used_files)
+
+
+    def test_verify(self):
+        encrypted_paths = chop_encrypt([self.input_file], self.tmp_chop, self.key, 4)
+
+        for workers in (1, 2):
+            self.assertEqual([('test_file.txt', True)],
+                             verify(encrypted_paths, self.key, workers))
+
+        with open(encrypted_paths[2], 'r+b') as outfile:
+            outfile.seek(-1, os.SEEK_END)
+            last = outfile.read(1)
+            outfile.seek(-1, os.SEEK_END)
+            outfile.write(bytes([last[0] ^ 1]))
+
+        plain_dir = os.path.join(self.tmpdir.name, 'plain')
+        os.mkdir(plain_dir)
+        plain_paths = chop([self.input_file], plain_dir, 4, 0, False)
+        with open(plain_paths[1], 'r+b') as outfile:
+            outfile.seek(-1, os.SEEK_END)
+            last = outfile.read(1)
+            outfile.seek(-1, os.SEEK_END)
+            outfile.write(bytes([last[0] ^ 1]))
+
+        self.assertEqual([('test_file.txt', False)], verify(encrypted_paths, self.key))
+        self.assertEqual([('test_file.txt', False)], verify(plain_paths))
+        self.assertEqual([], os.listdir(self.tmp_merge))
+
+
+    def test_verify_raises_unexpected_errors(self):
+        encrypted_paths = chop_encrypt([self.input_file], self.tmp_chop, self.key, 4)
+
+        # only decrypt, digest and codec errors mark a group as failed
+        with mock.patch('choppy.merge.verify_payload', side_effect=ValueError('bug')):
+            with self.assertRaises(ValueError):
+                verify(encrypted_paths, self.key)
+
+
+    def test_merge_requires_manifest(self):
+        chopped_paths = chop([self.input_file], self.tmp_chop, 4, 0, False)
+        status, new_files, used_files = merge(chopped_paths[:-1], self.tmp_merge)
+        self.assertEqual([], status)
+
+
+    def test_merge_legacy_layout(self):
+        with open(self.input_file, 'rb') as infile:
+            data = infile.read()
+
+        n_parts = 3
+        byte_reads = byte_lengths(len(data), n_parts)
+        group_block = util.bcat(
+            util.CFP, hash_str(''.join(map(str, byte_reads))), util.encode_uint16(n_parts),
+            *convert_filename(self.input_file), *convert_hash(self.input_file))
+
+        legacy_paths = []
+        offset = 0
+        for ix, nbytes in enumerate(byte_reads):
+            fp = os.path.join(self.tmp_chop, 'legacy.{}'.format(ix))
+            with open(fp, 'wb') as outfile:
+                outfile.write(group_block)
+                outfile.write(util.bcat(util.encode_uint16(ix), *convert_nbytes(nbytes)))
+                outfile.write(data[offset:offset + nbytes])
+            offset += nbytes
+            legacy_paths.append(fp)
+
+        for workers in (1, 2):
+            status, new_files, used_files = merge(legacy_paths, self.tmp_merge, workers=workers)
+            self.assertEqual([True], status)
+            self.assertEqual(self.input_file_hash, md5_hash(new_files[0]))
+
+        self.assertEqual([('test_file.txt', True)], verify(legacy_paths, workers=2))
+
+
+    def test_merge_catalog(self):
+        db_path = os.path.join(self.tmpdir.name, 'catalog.db')
+        encrypted_paths = chop_encrypt([self.input_file], self.tmp_chop, self.key, 4)
+
+        summary = group_status(encrypted_paths[1:], self.key, catalog=db_path)
+        self.assertEqual([('test_file.txt', 3, 4, 'incomplete')], summary)
+
+        with mock.patch('choppy.merge.read_path_metadata', wraps=read_path_metadata) as reader:
+            summary = group_status(encrypted_paths, self.key, catalog=db_path)
+            self.assertEqual([('test_file.txt', 4, 4, 'complete')], summary)
+            self.assertEqual([encrypted_paths[0]], [c[0][0] for c in reader.call_args_list])
+
+        status, _ = decrypt_merge(encrypted_paths, self.tmp_merge, self.key, catalog=db_path)
+        self.assertEqual([True], status)
+
+        with Catalog(db_path, self.key) as cat:
+            self.assertEqual(0, cat.prune())
+
+
+    def test_chop_merge_fernet(self):
+        _paths = [self.input_file]
+        n_parts = 4
+        encrypted_paths = chop_encrypt(
+            _paths, self.tmp_chop, self.key, n_parts, cipher='fernet')
+
+        status, decrypted_paths = decrypt_merge(encrypted_paths, self.tmp_merge, self.key)
+        self.assertTrue(all(status))
+        self.assertEqual(self.input_file_hash, md5_hash(decrypted_paths[0]))
+
+
     def tearDown(self):
         self.tmpdir.cleanup()
 
@@ -0,0 +1,145 @@
+#! usr/bin/env/ python3
+
+import os
+import threading
+import time
+
+from os.path import abspath, dirname
+import sys
+parent_dir = dirname(abspath(dirname('__file__')))
+sys.path.insert(0, parent_dir)
+
+import unittest
+from unittest import mock
+
+from choppy import crypto, stream
+
+# ------------------------------------------------------------------------------
+class TestLoadKey(unittest.TestCase):
+    def setUp(self):
+        self.now = 0
+        self.drops = 0
+        self.cache = crypto.KeyCache(maxsize=2, ttl=10, clock=lambda: self.now,
+                                     on_drop=self.on_drop)
+        self.salt = os.urandom(32)
+
+
+    def on_drop(self):
+        self.drops += 1
+
+
+    def load(self, password='password', **kwargs):
+        return crypto.load_key(password, self.salt, 1000, cache=self.cache, **kwargs)
+
+
+    def test_cache_hits(self):
+        with mock.patch.object(crypto, 'derive', wraps=crypto.derive) as derive:
+            key = self.load()
+            self.assertEqual(key, self.load(b'password'))
+            self.assertEqual(1, derive.call_count)
+
+        self.assertEqual((1, 1), (self.cache.hits, self.cache.misses))
+        self.assertEqual(key, crypto.load_key('password', self.salt, 1000, cache=None))
+        self.assertNotEqual(key, crypto.load_key('password', self.salt, 1001, cache=None))
+
+
+    def test_expiry_and_eviction(self):
+        self.load('a')
+        self.now = 5
+        self.load('b')
+        self.assertEqual(0, self.drops)
+        self.load('c')
+        self.assertEqual(2, len(self.cache))
+        self.assertEqual(1, self.drops)
+
+        self.load('b')
+        self.assertEqual(1, self.cache.hits)
+
+        self.now = 15
+        self.load('b')
+        self.assertEqual(1, self.cache.hits)
+        self.assertEqual(4, self.cache.misses)
+        self.assertEqual(2, self.drops)
+
+        self.now = 30
+        self.cache.get(self.cache.entry(b'x', self.salt, 'pbkdf2', (1000,)))
+        self.assertEqual(0, len(self.cache))
+        self.assertEqual(3, self.drops)
+
+
+    def test_wipe(self):
+        self.load()
+        cached = [key for _, key in self.cache._entries.values()]
+        self.cache.wipe()
+
+        self.assertEqual(0, len(self.cache))
+        self.assertEqual(bytearray(len(cached[0])), cached[0])
+        self.assertEqual(1, self.drops)
+
+
+    def test_ciphers_dropped_with_keys(self):
+        cache = crypto.KeyCache(ttl=10, clock=lambda: self.now, on_drop=crypto.clear_ciphers)
+        key = crypto.load_key('password', self.salt, 1000, cache=cache)
+        crypto.clear_ciphers()
+
+        def cached_ciphers():
+            crypto.fernet(key)
+            stream.aead_cipher(key, 'aesgcm')
+            return crypto.fernet.cache_info().currsize + stream.aead_cipher.cache_info().currsize
+
+        self.assertEqual(2, cached_ciphers())
+        self.now = 10
+        cache.get(cache.entry(b'password', self.salt, 'pbkdf2', (1000,)))
+        self.assertEqual(0, crypto.fernet.cache_info().currsize)
+        self.assertEqual(0, stream.aead_cipher.cache_info().currsize)
+
+        self.assertEqual(2, cached_ciphers())
+        with mock.patch.object(crypto, 'KEY_CACHE', cache):
+            crypto.wipe_keys()
+        self.assertEqual(0, crypto.fernet.cache_info().currsize)
+        self.assertEqual(0, stream.aead_cipher.cache_info().currsize)
+
+
+    def test_derivations_only_wait_for_same_key(self):
+        started = {}
+        release = threading.Event()
+        derive = crypto.derive
+
+        def slow_derive(password, *args):
+            started[password] = started.get(password, 0) + 1
+            if password == b'slow':
+                release.wait(5)
+            return derive(password, *args)
+
+        with mock.patch.object(crypto, 'derive', side_effect=slow_derive):
+            slow = [threading.Thread(target=self.load, args=('slow',)) for _ in range(2)]
+            for thread in slow:
+                thread.start()
+            while not started:
+                time.sleep(0.01)
+
+            # another password derives while the slow derivation is running
+            self.load('fast')
+            self.assertEqual({b'slow': 1, b'fast': 1}, started)
+
+            release.set()
+            for thread in slow:
+                thread.join()
+
+        self.assertEqual({b'slow': 1, b'fast': 1}, started)
+        self.assertEqual(1, self.cache.hits)
+        self.assertEqual({}, self.cache._deriving)
+
+
+    def test_scrypt(self):
+        key = self.load(kdf='scrypt', scrypt_cost=(2**10, 8, 1))
+        self.assertEqual(44, len(key))
+        self.assertNotEqual(key, self.load())
+        self.assertNotEqual(key, self.load(kdf='scrypt', scrypt_cost=(2**11, 8, 1)))
+
+        with self.assertRaises(ValueError):
+            self.load(kdf='bcrypt')
+
+
+if __name__ == '__main__':
+    unittest.main()
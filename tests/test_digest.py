@@ -0,0 +1,45 @@
+#! usr/bin/env/ python3
+
+import hashlib
+import zlib
+
+from os.path import abspath, dirname
+import sys
+parent_dir = dirname(abspath(dirname('__file__')))
+sys.path.insert(0, parent_dir)
+
+import unittest
+
+from choppy import digest
+
+# ------------------------------------------------------------------------------
+def sha256(data):
+    return hashlib.sha256(data).digest()
+
+
+class TestDigest(unittest.TestCase):
+    def test_tree_root(self):
+        leaves = [sha256(bytes([i])) for i in range(3)]
+        left = sha256(digest.NODE + leaves[0] + leaves[1])
+        expected = sha256(digest.NODE + left + leaves[2])
+        self.assertEqual(expected, digest.tree_root('sha256', leaves))
+        self.assertEqual(leaves[0], digest.tree_root('sha256', leaves[:1]))
+
+
+    def test_crc32(self):
+        hasher = digest.new('crc32')
+        hasher.update(b'chop')
+        hasher.update(b'py')
+        self.assertEqual(zlib.crc32(b'choppy').to_bytes(4, 'big'), hasher.digest())
+
+
+    def test_verify_tree(self):
+        parts = tuple(digest.new_leaf('blake2b').digest() for _ in range(5))
+        tree = digest.TreeDigest('blake2b', digest.tree_root('blake2b', parts), parts)
+        self.assertTrue(digest.verify_tree(tree))
+        self.assertFalse(digest.verify_tree(tree._replace(parts=parts[::-1][:4])))
+
+
+# ------------------------------------------------------------------------------
+if __name__ == '__main__':
+    unittest.main()
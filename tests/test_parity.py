@@ -0,0 +1,63 @@
+#! usr/bin/env/ python3
+
+import io
+import os
+
+from os.path import abspath, dirname
+import sys
+parent_dir = dirname(abspath(dirname('__file__')))
+sys.path.insert(0, parent_dir)
+
+import unittest
+from unittest import mock
+
+from choppy import parity
+
+# ------------------------------------------------------------------------------
+class TestParity(unittest.TestCase):
+    def setUp(self):
+        self.lengths = (700, 1000, 0, 999, 1)
+        self.data = [os.urandom(n) for n in self.lengths]
+
+
+    def rebuild(self, nparity, missing, rows):
+        payloads = parity.encode(io.BytesIO(b''.join(self.data)), self.lengths, nparity)
+        parities = {}
+        for j in rows:
+            lengths, parities[j] = parity.split_payload(payloads[j], len(self.lengths))
+            self.assertEqual(self.lengths, lengths)
+
+        blocks = [(i, 0, data) for i, data in enumerate(self.data) if i not in missing]
+        rebuilt = parity.decode(parities, blocks, missing)
+        return [bytes(payload[:self.lengths[i]]) for i, payload in zip(missing, rebuilt)]
+
+
+    def test_rebuild(self):
+        for missing, rows in (([1], [0]), ([0, 3], [2, 1]), ([1, 2, 4], [0, 1, 2])):
+            rebuilt = self.rebuild(3, missing, rows)
+            self.assertEqual([self.data[i] for i in missing], rebuilt)
+
+
+    def test_rebuild_without_numpy(self):
+        with mock.patch.object(parity, 'np', None):
+            self.assertEqual([self.data[3]], self.rebuild(1, [3], [0]))
+
+
+    def test_invert(self):
+        matrix = [[parity.coefficient(j, i) for i in range(4)] for j in range(4)]
+        inverse = parity.invert(matrix)
+        for r in range(4):
+            for c in range(4):
+                v = 0
+                for k in range(4):
+                    v ^= parity.gf_mul(matrix[r][k], inverse[k][c])
+                self.assertEqual(int(r == c), v)
+
+
+    def test_too_many_partitions(self):
+        with self.assertRaises(ValueError):
+            parity.encode(io.BytesIO(), [0] * 255, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+#! usr/bin/env/ python3
+
+from os.path import abspath, dirname
+import sys
+parent_dir = dirname(abspath(dirname('__file__')))
+sys.path.insert(0, parent_dir)
+
+import io
+import os
+import unittest
+
+from choppy import partition
+
+# ------------------------------------------------------------------------------
+class TestWobbler(unittest.TestCase):
+    def check_wobble(self, byte_reads, percent, **kwargs):
+        wobbled = partition.wobbler(byte_reads, percent, **kwargs)
+        min_v, max_v = partition.wobble_bounds(byte_reads, percent)
+
+        self.assertEqual(len(byte_reads), len(wobbled))
+        self.assertEqual(sum(byte_reads), sum(wobbled))
+        self.assertTrue(all(min_v <= n <= max_v for n in wobbled))
+        return wobbled
+
+
+    def test_bounds_and_sum(self):
+        for n_bytes, n_parts, percent in ((10**6, 7, 50), (12345, 100, 99), (10**9, 1000, 5)):
+            byte_reads = partition.byte_lengths(n_bytes, n_parts)
+            wobbled = self.check_wobble(byte_reads, percent)
+            self.assertNotEqual(byte_reads, wobbled)
+
+
+    def test_seed(self):
+        byte_reads = partition.byte_lengths(10**6, 50)
+        self.assertEqual(partition.wobbler(byte_reads, 30, seed=7),
+                         partition.wobbler(byte_reads, 30, seed=7))
+
+
+    def test_small_partitions(self):
+        byte_reads = partition.byte_lengths(10, 10)
+        self.assertEqual(byte_reads, self.check_wobble(byte_reads, 50))
+        self.assertEqual((5,), partition.wobbler((5,), 50))
+
+
+    @unittest.skipIf(partition.np is None, 'numpy not installed')
+    def test_vectorized(self):
+        byte_reads = partition.byte_lengths(10**8, 10001)
+        self.check_wobble(byte_reads, 40, vectorize=True, seed=3)
+
+
+class TestPartCount(unittest.TestCase):
+    def test_part_count(self):
+        self.assertEqual(1, partition.part_count(0, 64))
+        self.assertEqual(1, partition.part_count(64, 64))
+        self.assertEqual(2, partition.part_count(65, 64))
+        self.assertEqual(2**20, partition.part_count(2**46, 2**26))
+        self.assertRaises(ValueError, partition.part_count, 10, 0)
+
+
+class TestPackBins(unittest.TestCase):
+    def test_pack_bins(self):
+        self.assertEqual([[0, 1], [2, 3], [4, 5]],
+                         partition.pack_bins((40, 60, 70, 0, 50, 50), 100))
+        self.assertEqual([[0], [1]], partition.pack_bins((0, 200), 100))
+        self.assertEqual([], partition.pack_bins((), 100))
+        self.assertRaises(ValueError, partition.pack_bins, (1,), 0)
+
+
+class TestChunker(unittest.TestCase):
+    sizes = (2**10, 2**12, 2**14)
+
+    def test_lengths(self):
+        data = os.urandom(2**20)
+        lengths = partition.chunk_lengths(data, *self.sizes, vectorize=False)
+        self.assertEqual(len(data), sum(lengths))
+        self.assertTrue(all(self.sizes[0] <= n <= self.sizes[2] for n in lengths[:-1]))
+
+        chunks = list(partition.chunker(io.BytesIO(data), *self.sizes))
+        self.assertEqual(lengths, [len(chunk) for chunk in chunks])
+        self.assertEqual(data, b''.join(chunks))
+
+
+    @unittest.skipIf(partition.np is None, 'numpy not installed')
+    def test_vectorized(self):
+        data = os.urandom(2**20)
+        self.assertEqual(partition.chunk_lengths(data, *self.sizes, vectorize=False),
+                         partition.chunk_lengths(data, *self.sizes, vectorize=True))
+
+
+    def test_insertion_is_local(self):
+        data = os.urandom(2**20)
+        chunks = set(partition.chunker(io.BytesIO(data), *self.sizes))
+        edited = set(partition.chunker(io.BytesIO(b'x' + data), *self.sizes))
+        self.assertLessEqual(len(edited - chunks), 3)
+
+
+    def test_invalid_sizes(self):
+        self.assertRaises(ValueError, partition.chunk_lengths, b'', 16, 2**12, 2**14)
+        self.assertRaises(ValueError, partition.chunk_lengths, b'', 2**12, 2**10, 2**14)
+
+
+# ------------------------------------------------------------------------------
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+#! usr/bin/env/ python3
+
+import io
+import os
+
+from os.path import abspath, dirname
+import sys
+parent_dir = dirname(abspath(dirname('__file__')))
+sys.path.insert(0, parent_dir)
+
+import unittest
+from unittest import mock
+import tempfile
+
+from cryptography.fernet import Fernet
+
+from choppy import reader
+from choppy.chop import chop, chop_encrypt
+from choppy.reader import PartitionReader
+
+# ------------------------------------------------------------------------------
+class TestPartitionReader(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.data = os.urandom(5000)
+        self.input_file = os.path.join(self.tmpdir.name, 'test_file.txt')
+        with open(self.input_file, 'wb') as outfile:
+            outfile.write(self.data)
+
+        self.key = Fernet.generate_key()
+        self.outdir = os.path.join(self.tmpdir.name, 'chop')
+        os.mkdir(self.outdir)
+
+
+    def test_random_access(self):
+        paths = chop_encrypt([self.input_file], self.outdir, self.key, 7, compress='zlib')
+
+        with PartitionReader(paths, self.key) as part_reader:
+            self.assertEqual(len(self.data), part_reader.size)
+            self.assertEqual('test_file.txt', part_reader.name)
+
+            for offset, n in ((0, 10), (700, 1500), (4990, 100), (6000, 10)):
+                part_reader.seek(offset)
+                self.assertEqual(self.data[offset:offset + n], part_reader.read(n))
+
+            part_reader.seek(-25, os.SEEK_END)
+            self.assertEqual(self.data[-25:], part_reader.read())
+            self.assertEqual(len(self.data), part_reader.tell())
+
+            part_reader.seek(0)
+            self.assertEqual(self.data, io.BufferedReader(part_reader).read())
+
+
+    def test_reads_overlapping_partitions(self):
+        paths = chop([self.input_file], self.outdir, 10, 0, False)
+
+        with mock.patch.object(reader, 'read_payload', wraps=reader.read_payload) as read:
+            part_reader = PartitionReader(paths, cache_size=2)
+            part_reader.seek(1000)
+            self.assertEqual(self.data[1000:1100], part_reader.read(100))
+            self.assertEqual(1, read.call_count)
+
+            part_reader.seek(1050)
+            part_reader.read(10)
+            self.assertEqual(1, read.call_count)
+
+            part_reader.seek(0)
+            part_reader.read(len(self.data))
+            self.assertEqual(11, read.call_count)
+            self.assertEqual(2, len(part_reader._cache))
+
+            part_reader.close()
+            with self.assertRaises(ValueError):
+                part_reader.read(1)
+
+
+    def test_requires_one_group(self):
+        with self.assertRaises(ValueError):
+            PartitionReader([], self.key)
+
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+#! usr/bin/env/ python3
+
+import os
+import socket
+import threading
+
+from os.path import abspath, dirname
+import sys
+parent_dir = dirname(abspath(dirname('__file__')))
+sys.path.insert(0, parent_dir)
+
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+import tempfile
+
+from cryptography.fernet import Fernet
+
+from choppy import crypto, server
+
+# ------------------------------------------------------------------------------
+class TestServer(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.data = os.urandom(20000)
+        self.input_file = os.path.join(self.tmpdir.name, 'test_file.txt')
+        with open(self.input_file, 'wb') as outfile:
+            outfile.write(self.data)
+
+        self.outdir = os.path.join(self.tmpdir.name, 'chop')
+        os.mkdir(self.outdir)
+        self.socket_path = os.path.join(self.tmpdir.name, 'choppy.sock')
+
+
+    def start(self, executor=None):
+        job_server = server.JobServer(self.socket_path, executor, max_jobs=2)
+        thread = threading.Thread(target=job_server.serve_forever, daemon=True)
+        thread.start()
+
+        def stop():
+            job_server.shutdown()
+            job_server.server_close()
+            thread.join()
+
+        self.addCleanup(stop)
+        return job_server
+
+
+    def results(self, jobs):
+        self.events = list(server.submit(self.socket_path, jobs))
+        done = {event['id']: event for event in self.events
+                if event['event'] in ('done', 'error')}
+        self.assertEqual(len(jobs), len([e for e in self.events if e['event'] == 'started']))
+        return done
+
+
+    def progress(self, job_id, name):
+        return [event for event in self.events if event['id'] == job_id and event['event'] == name]
+
+
+    def test_chop_merge_jobs(self):
+        key = Fernet.generate_key().decode('utf-8')
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            self.start(executor)
+            self.assertEqual(0o600, os.stat(self.socket_path).st_mode & 0o777)
+
+            chopped = self.results([{'id': 'chop', 'command': 'chop', 'key': key,
+                                     'paths': [self.input_file], 'outdir': self.outdir,
+                                     'part_size': '4K'}])
+            partitions = chopped['chop']['result']['partitions']
+            self.assertEqual(6, len(partitions))
+            self.assertCountEqual(partitions, [e['path'] for e in self.progress('chop', 'partition')])
+
+            merge_dir = os.path.join(self.tmpdir.name, 'merge')
+            os.mkdir(merge_dir)
+            done = self.results([{'id': 1, 'command': 'verify', 'key': key, 'paths': partitions}])
+            done.update(self.results([{'id': 2, 'command': 'merge', 'key': key,
+                                       'paths': partitions, 'outdir': merge_dir}]))
+            merged = self.progress(2, 'merged')
+            self.assertEqual(6, len(self.progress(2, 'partition')))
+
+            quiet = self.results([{'id': 3, 'command': 'chop', 'key': key, 'progress': False,
+                                   'paths': [self.input_file], 'outdir': self.outdir,
+                                   'partitions': 2}])
+            self.assertEqual(['started', 'done'], [e['event'] for e in self.events])
+
+        self.assertFalse(server.failed(done[1]))
+        self.assertEqual([{'filename': 'test_file.txt', 'verified': True}],
+                         done[1]['result']['results'])
+        self.assertEqual([True], done[2]['result']['status'])
+        self.assertEqual([True], [e['status'] for e in merged])
+        self.assertFalse(any(server.failed(e) for e in merged))
+        self.assertTrue(quiet[3]['result']['partitions'])
+        with open(done[2]['result']['files'][0], 'rb') as infile:
+            self.assertEqual(self.data, infile.read())
+
+
+    def test_password_key_is_derived_once(self):
+        self.start()
+        salt = os.path.join(self.tmpdir.name, 'salt.txt')
+        with open(salt, 'wb') as outfile:
+            outfile.write(os.urandom(32))
+
+        job = {'command': 'chop', 'password': 'hunter2', 'salt': salt, 'iterations': 1000,
+               'paths': [self.input_file], 'outdir': self.outdir, 'partitions': 2}
+
+        crypto.wipe_keys()
+        misses = crypto.KEY_CACHE.misses
+        done = self.results([dict(job, id=ix, randfn=True) for ix in range(3)])
+        self.assertEqual(3, len(done))
+        self.assertEqual(misses + 1, crypto.KEY_CACHE.misses)
+
+
+    def test_job_errors(self):
+        self.start()
+        done = self.results([{'id': 1, 'command': 'shred', 'no_encrypt': True},
+                             {'id': 2, 'command': 'merge', 'paths': []}])
+
+        self.assertIn('Unknown command', done[1]['error'])
+        self.assertTrue(server.failed(done[2]))
+
+
+    def test_stale_socket(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.socket_path)
+        sock.close()
+
+        self.start()
+        with self.assertRaises(OSError):
+            server.JobServer(self.socket_path)
+
+
+    def test_resolve_paths(self):
+        job = server.resolve_paths({'paths': ['a', '/b'], 'keyfile': 'k'}, cwd='/w')
+        self.assertEqual({'paths': ['/w/a', '/b'], 'keyfile': '/w/k', 'outdir': '/w'}, job)
+
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+#! usr/bin/env/ python3
+
+import os
+import subprocess
+
+from os.path import abspath, dirname
+import sys
+parent_dir = dirname(abspath(dirname('__file__')))
+sys.path.insert(0, parent_dir)
+
+import unittest
+import tempfile
+
+# ------------------------------------------------------------------------------
+PACKAGE_DIR = dirname(dirname(abspath(__file__)))
+HEAVY_MODULES = ('cryptography', 'numpy', 'sqlite3', 'concurrent.futures')
+
+# cumulative import time of choppy.choppy, microseconds
+IMPORT_BUDGET = 100000
+
+
+def run_python(*args):
+    env = dict(os.environ, PYTHONPATH=PACKAGE_DIR)
+    proc = subprocess.run(
+        (sys.executable,) + args, env=env, cwd=PACKAGE_DIR, check=True,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    return proc
+
+
+def loaded_modules(code):
+    check = '; print(",".join(m for m in {!r} if m in sys.modules))'.format(HEAVY_MODULES)
+    out = run_python('-c', 'import sys; ' + code + check).stdout.strip().splitlines()
+    return [m for m in out[-1].split(',') if m] if out else []
+
+
+class TestStartup(unittest.TestCase):
+    def test_cli_import_is_light(self):
+        self.assertEqual([], loaded_modules('import choppy.choppy'))
+
+
+    def test_generate_is_light(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            code = ('from choppy.choppy import main; '
+                    'sys.argv = ["choppy", "gen", "-p", "16", "-k", "-o", {!r}]; main()'
+                    ).format(tmpdir)
+            self.assertEqual([], loaded_modules(code))
+            self.assertEqual(2, len(os.listdir(tmpdir)))
+
+
+    def test_catalog_import_is_light(self):
+        self.assertNotIn('cryptography', loaded_modules('import choppy.catalog'))
+
+
+    def test_public_names_load_on_access(self):
+        code = ('import choppy, types; '
+                'assert callable(choppy.chop) and callable(choppy.merge); '
+                'assert isinstance(choppy.crypto, types.ModuleType)')
+        run_python('-c', code)
+
+
+    def test_import_time_budget(self):
+        stderr = run_python('-X', 'importtime', '-c', 'import choppy.choppy').stderr
+        line = [ln for ln in stderr.splitlines() if ln.rstrip().endswith('| choppy.choppy')][-1]
+        cumulative = int(line.split('|')[1])
+        self.assertLess(cumulative, IMPORT_BUDGET, 'import choppy.choppy took {} us'.format(cumulative))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+#! usr/bin/env/ python3
+
+import io
+import os
+
+from os.path import abspath, dirname
+import sys
+parent_dir = dirname(abspath(dirname('__file__')))
+sys.path.insert(0, parent_dir)
+
+import unittest
+
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet
+
+from choppy import stream
+
+# ------------------------------------------------------------------------------
+def encrypt_bytes(key, data, frame_size, cipher='aesgcm'):
+    buf = io.BytesIO()
+    with stream.StreamWriter(key, buf, cipher, frame_size) as writer:
+        for ix in range(0, len(data), 7):
+            writer.write(data[ix:ix + 7])
+    return buf.getvalue()
+
+
+def decrypt_bytes(key, token):
+    return stream.StreamReader(key, io.BytesIO(token)).read()
+
+
+class TestStream(unittest.TestCase):
+    def setUp(self):
+        self.key = Fernet.generate_key()
+        self.frame_size = 64
+
+
+    def test_roundtrip(self):
+        for cipher in stream.CIPHERS:
+            for size in (0, 1, 63, 64, 65, 128, 1000):
+                data = os.urandom(size)
+                token = encrypt_bytes(self.key, data, self.frame_size, cipher)
+                self.assertTrue(stream.is_stream(io.BytesIO(token)))
+                self.assertEqual(len(token), len(data) + stream.HEADER.size +
+                                 stream.TAG_SIZE * (1 + max(0, size - 1) // self.frame_size))
+                self.assertEqual(data, decrypt_bytes(self.key, token))
+
+
+    def test_partial_reads(self):
+        data = os.urandom(500)
+        token = encrypt_bytes(self.key, data, self.frame_size)
+        reader = stream.StreamReader(self.key, io.BytesIO(token))
+        chunks = iter(lambda: reader.read(37), b'')
+        self.assertEqual(data, b''.join(chunks))
+
+
+    def test_tampered(self):
+        token = bytearray(encrypt_bytes(self.key, os.urandom(300), self.frame_size))
+        token[-1] ^= 1
+        with self.assertRaises(InvalidTag):
+            decrypt_bytes(self.key, bytes(token))
+
+
+    def test_truncated(self):
+        tag_block = self.frame_size + stream.TAG_SIZE
+        token = encrypt_bytes(self.key, os.urandom(300), self.frame_size)
+        truncated = token[:stream.HEADER.size + 2 * tag_block]
+        with self.assertRaises(InvalidTag):
+            decrypt_bytes(self.key, truncated)
+
+
+    def test_header_record(self):
+        header, data = os.urandom(40), os.urandom(300)
+        buf = io.BytesIO()
+        with stream.StreamWriter(self.key, buf, frame_size=self.frame_size, header=header) as writer:
+            writer.write(data)
+        token = buf.getvalue()
+
+        self.assertEqual(header + data, decrypt_bytes(self.key, token))
+
+        # header record is readable without any payload frames
+        record_end = stream.HEADER.size + stream.RECORD_LEN.size + len(header) + stream.TAG_SIZE
+        reader = stream.StreamReader(self.key, io.BytesIO(token[:record_end]))
+        self.assertEqual(header, reader.read(len(header)))
+
+
+    def test_wrong_key(self):
+        token = encrypt_bytes(self.key, os.urandom(100), self.frame_size)
+        with self.assertRaises(InvalidTag):
+            decrypt_bytes(Fernet.generate_key(), token)
+
+
+# ------------------------------------------------------------------------------
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+#! usr/bin/env/ python3
+
+import hashlib
+import io
+import mmap
+import os
+
+from os.path import abspath, dirname
+import sys
+parent_dir = dirname(abspath(dirname('__file__')))
+sys.path.insert(0, parent_dir)
+
+import unittest
+from unittest import mock
+import tempfile
+
+from choppy import util
+
+# ------------------------------------------------------------------------------
+class TestCopyBytes(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.data = os.urandom(10000)
+        self.src = os.path.join(self.tmpdir.name, 'src')
+        self.dst = os.path.join(self.tmpdir.name, 'dst')
+        with open(self.src, 'wb') as outfile:
+            outfile.write(self.data)
+
+
+    def copy(self, hasher=None):
+        with open(self.src, 'rb') as infile, open(self.dst, 'wb') as outfile:
+            infile.read(100)
+            outfile.write(b'x')
+            util.copy_bytes(infile, outfile, 5000, chunk=999, hasher=hasher)
+            self.assertEqual(5100, infile.tell())
+            outfile.write(b'y')
+
+        with open(self.dst, 'rb') as infile:
+            self.assertEqual(b'x' + self.data[100:5100] + b'y', infile.read())
+
+
+    def test_kernel_copy(self):
+        with open(self.src, 'rb') as infile, open(self.dst, 'wb') as outfile:
+            self.assertEqual(len(self.data), util.kernel_copy(infile, outfile, 2**20))
+        self.copy()
+
+
+    def test_kernel_copy_unsupported(self):
+        with mock.patch.object(os, 'copy_file_range', side_effect=OSError, create=True):
+            self.copy()
+        self.assertEqual(0, util.kernel_copy(io.BytesIO(self.data), io.BytesIO(), 10))
+
+
+    def test_copy_hashed(self):
+        hasher = hashlib.md5()
+        self.copy(hasher)
+        self.assertEqual(hashlib.md5(self.data[100:5100]).digest(), hasher.digest())
+
+
+    def test_kernel_copy_hashed(self):
+        hasher = hashlib.md5()
+        with mock.patch.object(util, 'hash_range', wraps=util.hash_range) as hash_range:
+            self.copy(hasher)
+        self.assertTrue(hash_range.call_count)
+        self.assertEqual(hashlib.md5(self.data[100:5100]).digest(), hasher.digest())
+
+        hasher = hashlib.md5()
+        with mock.patch.object(mmap, 'mmap', side_effect=OSError):
+            self.copy(hasher)
+        self.assertEqual(hashlib.md5(self.data[100:5100]).digest(), hasher.digest())
+
+
+    def test_positional_writer(self):
+        util.preallocate(self.dst, 300)
+        with open(self.src, 'rb') as infile, open(self.dst, 'r+b') as outfile:
+            util.copy_bytes(infile, util.PositionalWriter(outfile, 200), 100)
+            util.copy_bytes(infile, util.PositionalWriter(outfile, 0), 200,
+                            hasher=hashlib.md5())
+
+        with open(self.dst, 'rb') as infile:
+            self.assertEqual(self.data[100:300] + self.data[:100], infile.read())
+
+
+    def test_short_input(self):
+        for infile in (io.BytesIO(self.data), open(self.src, 'rb')):
+            with infile:
+                with self.assertRaises(EOFError):
+                    util.copy_bytes(infile, io.BytesIO(), len(self.data) + 1)
+
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()